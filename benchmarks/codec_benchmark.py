@@ -0,0 +1,69 @@
+"""compare redis_orm codecs and compressions on payloads shaped like ours
+
+run from the project root:
+python -m benchmarks.codec_benchmark --repeat 2000
+"""
+import argparse
+import random
+import string
+import timeit
+
+from redis_orm.codecs import CODECS, COMPRESSIONS, Serializer
+
+
+def _word(length=8):
+    return "".join(random.choices(string.ascii_lowercase, k=length))
+
+
+def payload_shapes():
+    """small flat record, nested profile and a large list of records"""
+    random.seed(42)
+    small = {"name": _word(), "age": random.randint(18, 90), "active": True}
+    nested = {
+        "id": random.randint(1, 10 ** 9),
+        "name": _word(12),
+        "address": {"city": _word(), "street": _word(20), "zip": _word(5)},
+        "tags": [_word() for _ in range(10)],
+        "scores": [random.random() for _ in range(20)],
+    }
+    large = {"items": [{"sku": _word(10), "price": round(random.random() * 100, 2), "qty": random.randint(1, 9)}
+                       for _ in range(500)]}
+    return {"small": small, "nested": nested, "large": large}
+
+
+def available_serializers(compress_threshold):
+    for codec in CODECS:
+        for compression in (None, *COMPRESSIONS):
+            try:
+                serializer = Serializer(codec, compression, compress_threshold)
+            except ImportError:
+                continue  # optional package not installed
+            yield f"{codec}+{compression or 'none'}", serializer
+
+
+def run(repeat: int, compress_threshold: int) -> list:
+    results = []
+    for shape, payload in payload_shapes().items():
+        for name, serializer in available_serializers(compress_threshold):
+            encoded = serializer.dumps(payload)
+            encode_time = timeit.timeit(lambda: serializer.dumps(payload), number=repeat) / repeat
+            decode_time = timeit.timeit(lambda: serializer.loads(encoded), number=repeat) / repeat
+            results.append({"shape": shape, "serializer": name, "bytes": len(encoded),
+                            "encode_us": encode_time * 1e6, "decode_us": decode_time * 1e6})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--compress-threshold", type=int, default=1024)
+    args = parser.parse_args()
+
+    print(f"{'shape':<8} {'serializer':<16} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+    for result in run(args.repeat, args.compress_threshold):
+        print(f"{result['shape']:<8} {result['serializer']:<16} {result['bytes']:>8} "
+              f"{result['encode_us']:>10.2f} {result['decode_us']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
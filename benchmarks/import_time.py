@@ -0,0 +1,74 @@
+"""import time budget of the orm packages, for CLIs and serverless cold starts
+
+run from the project root, exits with 1 when a package is over its budget or imports a heavy
+dependency it should only load on use:
+python -m benchmarks.import_time
+python -m benchmarks.import_time --budget postgres_orm=150 --repeat 9
+
+every import runs in a fresh interpreter, the reported time is the median of the runs in milliseconds
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# milliseconds, generous enough for a slow CI machine, pandas alone takes longer than any of them
+BUDGETS = {"postgres_orm": 250, "redis_orm": 400, "data_operators": 50}
+
+# modules that importing the package must not load, they are imported by the code paths that need them
+HEAVY_MODULES = ("pandas", "numpy", "pydantic", "pyarrow", "asyncpg")
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = """
+import json, sys, time
+started = time.perf_counter()
+import {package}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"ms": elapsed * 1000, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(package: str, repeat: int) -> dict:
+    """median import time of package in milliseconds and the heavy modules it loaded"""
+    timings = []
+    heavy = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", MEASURE.format(package=package, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True, cwd=PROJECT_ROOT).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["ms"])
+        heavy = result["heavy"]
+    return {"package": package, "ms": round(statistics.median(timings), 1), "heavy": heavy}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", action="append", default=[], help="package=milliseconds, can be repeated")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for budget in args.budget:
+        package, _, milliseconds = budget.partition("=")
+        budgets[package] = float(milliseconds)
+
+    failures = []
+    for package, budget in budgets.items():
+        result = measure(package, args.repeat)
+        print(f"{package:<16} {result['ms']:>8.1f} ms  (budget {budget} ms)")
+        if result["ms"] > budget:
+            failures.append(f"{package} imports in {result['ms']} ms, budget is {budget} ms")
+        if result["heavy"]:
+            failures.append(f"{package} imports {', '.join(result['heavy'])} at import time")
+
+    for failure in failures:
+        print(f"OVER BUDGET {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""throughput, latency and memory of postgres_orm, redis_orm and data_operators at several data sizes
+
+run from the project root:
+python -m benchmarks.suite --sizes 1000,10000 --output results.json
+python -m benchmarks.suite --baseline results.json --threshold 0.2  # exits with 1 on regressions
+
+targets:
+- postgres: set DATTYORM_BENCH_POSTGRES to a dsn ("dbname=bench user=postgres host=localhost"),
+  skipped when not set. the benchmark_row table is dropped and recreated
+- redis: set DATTYORM_BENCH_REDIS to host:port, otherwise in-process fakeredis if it is installed.
+  keys start with "benchmark:"
+- files: csv and json files generated in a temporary directory
+
+every case runs `--repeat` times with fresh setup, min/median/max are the durations of whole runs and rows/s
+uses the median. p50/p99 are latencies of single operations over all runs: cases made of many small operations
+(point lookups, single row updates) time every one of them, bulk cases are one operation per run, so their
+percentiles only have `--repeat` samples and p99 is close to max.
+peak memory comes from one more run under tracemalloc, so it only counts python allocations.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from unittest import mock
+
+# compared with the baseline, max_ms and p99_ms are only reported, a few slow operations would fail the comparison
+METRICS = {"rows_per_second": "higher", "min_ms": "lower", "median_ms": "lower", "p50_ms": "lower",
+           "peak_memory_kb": "lower"}
+
+
+class Case:
+    """
+    one measured operation, setup() prepares fresh state outside of the measured time
+    and returns the argument for run(state).
+
+    cases made of many small operations pass `operations` instead of run, operations(state) yields
+    zero argument callables and every one of them is timed on its own
+    """
+    def __init__(self, target, operation, rows, run=None, setup=None, operations=None):
+        if (run is None) == (operations is None):
+            raise ValueError("case needs either run or operations")
+        self.target = target
+        self.operation = operation
+        self.rows = rows
+        self.operations = operations or (lambda state: [lambda: run(state)])
+        self.setup = setup or (lambda: None)
+
+    def run_once(self, state) -> list:
+        """latencies of the operations of one run, in seconds"""
+        latencies = []
+        for operation in self.operations(state):
+            started = time.perf_counter()
+            operation()
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+
+def percentile(samples: list, percent: int) -> float:
+    """value below which `percent` of the samples are, interpolated between the two closest samples"""
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[percent - 1]
+
+
+def measure(case: Case, size: int, repeat: int) -> dict:
+    run_latencies = []
+    operation_latencies = []
+    for _ in range(repeat):
+        latencies = case.run_once(case.setup())
+        run_latencies.append(sum(latencies))
+        operation_latencies.extend(latencies)
+
+    state = case.setup()
+    tracemalloc.start()
+    try:
+        case.run_once(state)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(run_latencies)
+    return {"target": case.target, "operation": case.operation, "size": size, "rows": case.rows,
+            "rows_per_second": round(case.rows / median if median else 0.0, 1),
+            "operations": len(operation_latencies),
+            "p50_ms": round(percentile(operation_latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(operation_latencies, 99) * 1000, 3),
+            "min_ms": round(min(run_latencies) * 1000, 3), "median_ms": round(median * 1000, 3),
+            "max_ms": round(max(run_latencies) * 1000, 3), "peak_memory_kb": round(peak_memory / 1024, 1)}
+
+
+def generate_rows(size: int) -> list:
+    random.seed(size)
+    return [{"name": "".join(random.choices(string.ascii_lowercase, k=10)), "age": random.randint(18, 90),
+             "city": random.choice(("tbilisi", "batumi", "kutaisi", "rustavi"))} for _ in range(size)]
+
+
+def postgres_cases(size: int, rows: list, directory: str):
+    dsn = os.environ.get("DATTYORM_BENCH_POSTGRES")
+    if not dsn:
+        return
+    from psycopg2.extensions import parse_dsn
+    from postgres_orm import BaseManager, BaseModel, columns
+
+    class benchmark_row(BaseModel):
+        id = columns.PrimaryKey()
+        name = columns.VarChar()
+        age = columns.Integer()
+        city = columns.VarChar()
+
+    manager = BaseManager(benchmark_row())
+    manager.set_connection(parse_dsn(dsn))
+    with manager._get_cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS benchmark_row")
+    manager.create_table(benchmark_row())
+
+    def empty_table():
+        with manager._get_cursor() as cursor:
+            cursor.execute("TRUNCATE benchmark_row RESTART IDENTITY")
+
+    def filled_table():
+        empty_table()
+        manager.batch_insert(rows, use_copy=True, chunk_size=10_000)
+
+    filled_once = {}
+
+    def filled_table_once():
+        if not filled_once:
+            filled_table()
+            filled_once[True] = True
+
+    changes = [{"id": key, "age": 1} for key in range(1, size + 1)]
+    lookup_keys = random.sample(range(1, size + 1), min(size, 1000))
+    csv_path = os.path.join(directory, "postgres_export.csv")
+    yield Case("postgres", "batch_insert_values", size, lambda _: manager.batch_insert(rows), empty_table)
+    yield Case("postgres", "batch_insert_copy", size,
+               lambda _: manager.batch_insert(rows, use_copy=True, chunk_size=10_000), empty_table)
+    yield Case("postgres", "select", size, lambda _: manager.select(batch_size=size), filled_table_once)
+    yield Case("postgres", "get_by_id", len(lookup_keys), setup=filled_table_once,
+               operations=lambda _: (lambda key=key: manager.filter(id=key).first() for key in lookup_keys))
+    yield Case("postgres", "export_csv", size, lambda _: manager.export_data_as_csv(csv_path), filled_table_once)
+    yield Case("postgres", "bulk_update", size, lambda _: manager.bulk_update(changes, "id"), filled_table_once)
+    yield Case("postgres", "delete_many", size,
+               lambda _: manager.delete_many("id", list(range(1, size + 1))), filled_table)
+
+
+def redis_cases(size: int, rows: list, directory: str):
+    from redis_orm import RedisORM
+    address = os.environ.get("DATTYORM_BENCH_REDIS")
+    if address:
+        host, _, port = address.partition(":")
+        redis_orm = RedisORM(host, int(port or 6379))
+    else:
+        try:
+            import fakeredis
+        except ImportError:
+            return
+        with mock.patch("redis_orm.redis_orm.redis.Redis", fakeredis.FakeRedis):
+            redis_orm = RedisORM()
+
+    items = {f"benchmark:{key}": row for key, row in enumerate(rows)}
+    keys = list(items)
+    updated_keys = keys[:1000]
+
+    def clean():
+        redis_orm.delete_many(redis_orm.redis_client.scan_iter(match="benchmark:*", count=1000))
+
+    def filled():
+        clean()
+        redis_orm.insert_many(items)
+
+    json_path = os.path.join(directory, "redis_export.json")
+    yield Case("redis", "insert_many", size, lambda _: redis_orm.insert_many(items), clean)
+    yield Case("redis", "select_many", size, lambda _: redis_orm.select_many(keys), filled)
+    yield Case("redis", "select_all", size, lambda _: redis_orm.select_all("benchmark:*"), filled)
+    yield Case("redis", "select", len(updated_keys), setup=filled,
+               operations=lambda _: (lambda key=key: redis_orm.select_from_redis(key) for key in updated_keys))
+    yield Case("redis", "update_data", len(updated_keys), setup=filled,
+               operations=lambda _: (lambda key=key: redis_orm.update_data(key, {"age": 1}) for key in updated_keys))
+    yield Case("redis", "export_json", size,
+               lambda _: redis_orm.export_all_to_json("benchmark:*", json_path, lines=True), filled)
+    yield Case("redis", "delete_many", size, lambda _: redis_orm.delete_many(keys), filled)
+
+
+def file_cases(size: int, rows: list, directory: str):
+    import pandas as pd
+    from data_operators import CSVDataOperator, JsonDataOperator
+
+    csv_path = os.path.join(directory, f"rows_{size}.csv")
+    json_path = os.path.join(directory, f"rows_{size}.json")
+    ndjson_path = os.path.join(directory, f"rows_{size}.ndjson")
+    pd.DataFrame(rows).to_csv(csv_path, index=False)
+    with open(json_path, "w") as file:
+        json.dump(rows, file)
+
+    def loaded(operator_class, path):
+        def setup():
+            operator = operator_class(path)
+            operator.get_data()
+            return operator
+        return setup
+
+    def empty_csv():
+        path = os.path.join(directory, "insert.csv")
+        open(path, "w").close()
+        return CSVDataOperator(path)
+
+    def insert_rows(operator):
+        for row in rows:
+            yield lambda row=row: operator.insert_data(row)
+        yield lambda: operator.df  # pending rows are flushed into the frame on first access
+
+    def empty_ndjson():
+        open(ndjson_path, "w").close()
+        return JsonDataOperator(ndjson_path)
+
+    def copy_of_csv():
+        path = os.path.join(directory, "rewrite.csv")
+        with open(csv_path) as source, open(path, "w") as target:
+            target.write(source.read())
+        return CSVDataOperator(path)
+
+    names = [row["name"] for row in rows[:100]]
+    yield Case("files", "csv_read", size, lambda _: CSVDataOperator(csv_path).get_data())
+    yield Case("files", "csv_insert_data", size, setup=empty_csv, operations=insert_rows)
+    yield Case("files", "csv_update_data", len(names), setup=loaded(CSVDataOperator, csv_path),
+               operations=lambda operator: (lambda name=name: operator.update_data("name", name, {"age": 1})
+                                            for name in names))
+    yield Case("files", "csv_delete_where", size, lambda operator: operator.delete_where({"city": "batumi"}),
+               loaded(CSVDataOperator, csv_path))
+    yield Case("files", "csv_export", size,
+               lambda operator: operator.df.to_csv(os.path.join(directory, "export.csv"), index=False),
+               loaded(CSVDataOperator, csv_path))
+    yield Case("files", "csv_stream_update", size,
+               lambda operator: operator.stream_update({"city": "batumi"}, {"age": 1}, chunksize=10_000), copy_of_csv)
+    yield Case("files", "json_read", size, lambda _: JsonDataOperator(json_path).get_data())
+    yield Case("files", "ndjson_append", size, lambda operator: operator.append_records(rows), empty_ndjson)
+
+
+TARGETS = {"postgres": postgres_cases, "redis": redis_cases, "files": file_cases}
+
+
+def run(sizes, targets, repeat: int) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            rows = generate_rows(size)
+            for target in targets:
+                for case in TARGETS[target](size, rows, directory):
+                    result = measure(case, size, repeat)
+                    results.append(result)
+                    print(f"{result['target']:<9} {result['operation']:<20} {size:>8} "
+                          f"{result['rows_per_second']:>12.0f} {result['p50_ms']:>10.3f} {result['p99_ms']:>10.3f} "
+                          f"{result['min_ms']:>10.2f} {result['median_ms']:>10.2f} {result['max_ms']:>10.2f} "
+                          f"{result['peak_memory_kb']:>10.0f}", flush=True)
+    return results
+
+
+def compare(results: list, baseline: list, threshold: float) -> list:
+    """messages for every metric that got worse than baseline by more than threshold (0.2 -> 20%)"""
+    baseline_results = {(result["target"], result["operation"], result["size"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get((result["target"], result["operation"], result["size"]))
+        if previous is None:
+            continue
+        for metric, better in METRICS.items():
+            old, new = previous.get(metric), result[metric]  # older results may not have the metric
+            if not old:
+                continue
+            change = (new - old) / old if better == "lower" else (old - new) / old
+            if change > threshold:
+                regressions.append(f"{result['target']}.{result['operation']} size {result['size']}: "
+                                   f"{metric} {old} -> {new} ({change:+.0%} worse)")
+    return regressions
+
+
+@contextmanager
+def _quiet_logging():
+    """the orm logs every operation, keep the benchmark output readable"""
+    import logging
+    logging.disable(logging.INFO)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated row counts")
+    parser.add_argument("--targets", default=",".join(TARGETS), help="comma separated, postgres, redis, files")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="results json of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    targets = [target.strip() for target in args.targets.split(",")]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets {', '.join(sorted(unknown))}")
+
+    print(f"{'target':<9} {'operation':<20} {'size':>8} {'rows/s':>12} {'p50 ms':>10} {'p99 ms':>10} "
+          f"{'min ms':>10} {'median ms':>10} {'max ms':>10} {'peak kb':>10}")
+    with _quiet_logging():
+        results = run(sizes, targets, args.repeat)
+
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+              "platform": platform.platform(), "repeat": args.repeat, "results": results}
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)["results"], args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions over {args.threshold:.0%} compared to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,21 @@
-from .csv_data_operator import CSVDataOperator
-from .json_data_operator import JsonDataOperator
\ No newline at end of file
+import importlib
+
+# operators are imported on first use, they pull in pandas (and pyarrow for ParquetDataOperator)
+_LAZY_EXPORTS = {
+    "CSVDataOperator": ".csv_data_operator",
+    "JsonDataOperator": ".json_data_operator",
+    "ParquetDataOperator": ".parquet_data_operator",
+}
+__all__ = list(_LAZY_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        value = getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted([*globals(), *_LAZY_EXPORTS])
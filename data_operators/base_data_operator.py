@@ -1,14 +1,57 @@
+import os
+import shutil
+import tempfile
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from utils.helpers import parse_file_path, get_metadata
 import pandas as pd
-from data_operators.base_file_info_validation import BaseFileInfo
+from data_operators.indexes import INDEX_CLASSES, INDEX_KINDS, lookup_mask, parse_lookup
 
 
 class BaseDataOperator(ABC):
     def __init__(self, file_path):
         self.file_path = file_path
-        self.df = pd.DataFrame()
-        self.file_metadata = None
+        self._df = pd.DataFrame()
+        self._pending_rows = []  # inserted rows not concatenated to the dataframe yet
+        self._file_metadata = None
+        self._metadata_outdated = False
+        self._indexes = {}  # column -> HashIndex or SortedIndex
+        self._next_label = 0  # row labels are never reused, so indexes stay valid after deletes
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """dataframe with the file content, rows inserted since the last access are concatenated here, at once"""
+        if self._pending_rows:
+            new_data = pd.DataFrame(self._pending_rows)
+            self._pending_rows = []
+            self._append(new_data)
+        return self._df
+
+    @df.setter
+    def df(self, df: pd.DataFrame) -> None:
+        self._df = df
+        self._pending_rows = []
+        self._metadata_outdated = True
+        self._next_label = int(df.index.max()) + 1 if len(df) and pd.api.types.is_integer_dtype(df.index) else len(df)
+        for index in self._indexes.values():
+            index.invalidate()
+
+    @property
+    def file_metadata(self):
+        """metadata of the file, recomputed on access after the data changed"""
+        if self._metadata_outdated:
+            self._metadata_outdated = False
+            _, file_name, file_extension = parse_file_path(self.file_path)
+            from data_operators.base_file_info_validation import BaseFileInfo
+            file_info = get_metadata(self.file_path)
+            self._file_metadata = BaseFileInfo(file_name=file_name, file_extension=file_extension, **file_info)
+            self._file_metadata.headers_and_types = self._df_headers_types()
+        return self._file_metadata
+
+    @file_metadata.setter
+    def file_metadata(self, file_metadata) -> None:
+        self._file_metadata = file_metadata
+        self._metadata_outdated = False
 
     @abstractmethod
     def get_data(self):
@@ -19,31 +62,212 @@ class BaseDataOperator(ABC):
         pass
 
     def insert_data(self, data: dict) -> None:
-        """gets data as a dict, converts to dataframe and concatenates to existing df"""
-        try:
-            new_data = pd.DataFrame([data])
-            if self.df.empty:
-                self.df = new_data
-            else:
-                self.df = pd.concat((self.df, new_data), ignore_index=True)
-        finally:
-            self._update_file_metadata()  # if data is inserted in an empty file get the metadata
+        """gets data as a dict, it is added to df the next time df is used"""
+        self._pending_rows.append(data)
+        self._update_file_metadata()  # if data is inserted in an empty file get the metadata
+
+    def insert_many(self, rows) -> None:
+        """insert many rows at once, rows is a list or generator of dicts or a dataframe"""
+        if isinstance(rows, pd.DataFrame):
+            self.df  # rows inserted before keep their place
+            self._append(rows)
+        else:
+            self._pending_rows.extend(rows)
+        self._update_file_metadata()
+
+    def create_index(self, column: str, kind: str = "hash") -> None:
+        """
+        index a column, so lookups on it don't scan the whole dataframe.
+        used by find, query, update_data, update_where, update_many, delete_data and delete_where
+        when they filter on the column, and kept in sync as rows are inserted, updated and deleted.
+
+        args:
+        - `column`: column to index
+        - `kind`: "hash" for equality (eq, in), "sorted" for equality and ranges (lt, lte, gt, gte, range),
+           changed rows are merged into a sorted index, which is slower than updating a hash index
+        """
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"index kind should be one of {INDEX_KINDS}, got {kind}")
+        self._indexes[column] = INDEX_CLASSES[kind](column)
+
+    def drop_index(self, column: str) -> None:
+        self._indexes.pop(column, None)
+
+    def find(self, column, value) -> pd.DataFrame:
+        """rows where column equals value"""
+        return self.query(**{column: value})
+
+    def query(self, **lookups) -> pd.DataFrame:
+        """
+        rows matching all lookups, `column=value` or `column__lookup=value` like postgres_orm Query.filter.
+        lookups on indexed columns are answered by the index, the rest only check the rows found by them
+
+        lookups: eq (default), ne, lt, lte, gt, gte, in, not_in, range (two values), isnull (True/False)
+
+        operator.query(city="tbilisi", age__gte=18, age__lt=30)
+        """
+        labels = self._labels([(*parse_lookup(key), value) for key, value in lookups.items()])
+        return self.df.loc[labels]
 
     def update_data(self, identifier_column, identifier_value, new_data: dict) -> None:
         """Find rows that match the identifier and update columns with kwargs"""
-        if identifier_column == "index":
-            matching_rows = self.df[self.df.index == identifier_value]
+        self.update_where({identifier_column: identifier_value}, new_data)
+
+    def update_where(self, conditions, new_data: dict) -> int:
+        """update columns of every row matching all conditions at once, see _mask for conditions
+
+        returns number of updated rows"""
+        labels = self._labels(self._lookups(conditions))
+        self._assign(labels, new_data)
+        return len(labels)
+
+    def update_many(self, rows, key_column) -> int:
+        """
+        apply different changes to many rows, e.g. 100k keyed updates, without a scan per key.
+        keys of all rows are resolved at once, by the index of key_column or one scan,
+        and every changed column is assigned once.
+
+        args:
+        - `rows`: list of dicts holding key_column and the new values, a dataframe with the same,
+           or a dict key -> new values. when a key is given twice the last changes win
+        - `key_column`: column identifying the rows, every row with the key gets the changes
+
+        returns number of updated rows
+        """
+        if isinstance(rows, dict):
+            rows = [{key_column: key, **changes} for key, changes in rows.items()]
+        if isinstance(rows, pd.DataFrame):
+            groups = [rows]
         else:
-            matching_rows = self.df[self.df[identifier_column] == identifier_value]
+            # rows changing different columns are applied separately, a missing column is not set to NaN
+            grouped = {}
+            for row in rows:
+                grouped.setdefault(tuple(row), []).append(row)
+            groups = [pd.DataFrame(group_rows) for group_rows in grouped.values()]
 
-        for index in matching_rows.index:
-            for key, val in new_data.items():
-                self.df.at[index, key] = val
+        updated_rows = 0
+        for changes in groups:
+            changes = changes.drop_duplicates(key_column, keep="last").set_index(key_column)
+            labels = self._labels([(key_column, "in", changes.index.tolist())])
+            new_values = changes.reindex(self.df.loc[labels, key_column].to_numpy())
+            self._assign(labels, {column: new_values[column].to_numpy() for column in changes.columns})
+            updated_rows += len(labels)
+        return updated_rows
 
     def delete_data(self, identifier_column, identifier_value) -> None:
         """remove data from self.df, original file not affected unitll commiting to it"""
-        self.df = self.df[self.df[identifier_column] != identifier_value]
+        self.delete_where({identifier_column: identifier_value})
+
+    def delete_where(self, conditions) -> int:
+        """remove every row matching all conditions, see _mask for conditions
+
+        returns number of deleted rows"""
+        labels = self._labels(self._lookups(conditions))
+        df = self.df
+        for column, index in self._indexes.items():
+            if column in df:
+                index.remove(labels, df.loc[labels, column].to_numpy())
+        self._df = df.drop(labels)
+        self._update_file_metadata()
+        return len(labels)
+
+    def _append(self, new_data: pd.DataFrame) -> None:
+        """add rows to the dataframe under new labels and to the indexes"""
+        new_data = new_data.set_axis(pd.RangeIndex(self._next_label, self._next_label + len(new_data)))
+        self._next_label += len(new_data)
+        self._df = new_data if self._df.empty else pd.concat((self._df, new_data))
+        for column, index in self._indexes.items():
+            if column in new_data:
+                index.add(new_data.index, new_data[column].to_numpy())
+
+    def _assign(self, labels: pd.Index, new_data: dict) -> None:
+        """set columns of the labelled rows, values are scalars or arrays in the order of labels"""
+        if not len(labels):
+            return  # df.loc[[], "new"] = value would still add an empty column
+        df = self.df
+        changed_indexes = [(column, index) for column, index in self._indexes.items() if column in new_data]
+        for column, index in changed_indexes:
+            if column in df:
+                index.remove(labels, df.loc[labels, column].to_numpy())
+        for key, val in new_data.items():
+            df.loc[labels, key] = val
+        for column, index in changed_indexes:
+            index.add(labels, df.loc[labels, column].to_numpy())
+        self._update_file_metadata()
+
+    def _lookups(self, conditions):
+        """conditions of update_where and delete_where as (column, lookup, value), functions are kept as they are"""
+        if callable(conditions):
+            return conditions
+        return [(column, "in" if isinstance(value, (list, tuple, set)) else "eq", value)
+                for column, value in conditions.items()]
+
+    def _labels(self, lookups) -> pd.Index:
+        """labels of rows matching all (column, lookup, value) lookups, or a function like in _mask.
+        indexed columns narrow the rows down first, other lookups are checked on those rows only"""
+        df = self.df
+        if callable(lookups):
+            return df.index[self._mask(lookups, df).to_numpy()]
+
+        candidates = None
+        remaining = []
+        for column, lookup, value in lookups:
+            index = self._indexes.get(column)
+            if index is None or lookup not in index.lookups:
+                remaining.append((column, lookup, value))
+                continue
+            labels = index.lookup(df, lookup, value)
+            candidates = labels if candidates is None else candidates.intersection(labels)
+
+        if candidates is not None:
+            # rows found by indexes are returned in label order, that is the order they were added in
+            candidates = candidates.unique().sort_values()
+            if not remaining:
+                return candidates
+        rows = df if candidates is None else df.loc[candidates]
+        mask = pd.Series(True, index=rows.index)
+        for column, lookup, value in remaining:
+            values = rows.index.to_series() if column == "index" else rows[column]
+            mask &= lookup_mask(values, lookup, value)
+        return rows.index[mask.to_numpy()]
 
+    def _mask(self, conditions, df: pd.DataFrame = None) -> pd.Series:
+        """boolean series of rows of df (self.df by default) matching all conditions
+
+        conditions is a dict column -> value, lists, tuples and sets match any of their values,
+        "index" matches the dataframe index. or a function taking the dataframe and returning a mask
+
+        {"name": "dato", "age": [20, 21]} -> name is dato and age is 20 or 21"""
+        if df is None:
+            df = self.df
+        if callable(conditions):
+            return pd.Series(conditions(df), index=df.index, dtype=bool)
+
+        mask = pd.Series(True, index=df.index)
+        for column, value in conditions.items():
+            values = df.index.to_series() if column == "index" else df[column]
+            if isinstance(value, (list, tuple, set)):
+                mask &= values.isin(value)
+            else:
+                mask &= values == value
+        return mask
+
+    @contextmanager
+    def _atomic_writer(self, path, mode="w"):
+        """file in the same directory as path, renamed over path when the block finishes without errors,
+        so the file is never left half written and readers (or memory maps) of the old one are not affected"""
+        directory = os.path.dirname(os.path.abspath(path))
+        file = tempfile.NamedTemporaryFile(mode, dir=directory, suffix=".tmp", delete=False,
+                                           newline="" if "b" not in mode else None)
+        try:
+            with file:
+                yield file
+            if os.path.exists(path):
+                shutil.copymode(path, file.name)
+            os.replace(file.name, path)
+        except BaseException:
+            os.unlink(file.name)
+            raise
 
     def _df_headers_types(self):
         """to get headers and types of the dataframe"""
@@ -56,14 +280,7 @@ class BaseDataOperator(ABC):
         return headers_and_types
 
     def _update_file_metadata(self) -> None:
-        """assign the actual metadata to self.df
-
-        will be called after the initial creation of the file"""
-        # since the first variable is directory path, no need for it
-        _, file_name, file_extension = parse_file_path(self.file_path)
-        file_info = get_metadata(self.file_path)
-        self.file_metadata = BaseFileInfo(file_name=file_name, file_extension=file_extension, **file_info)
-        self.file_metadata.headers_and_types = self._df_headers_types()
-
-
+        """mark metadata as outdated, it is read again (file stats and df headers) on the next access
 
+        will be called after the initial creation of the file and after changes"""
+        self._metadata_outdated = True
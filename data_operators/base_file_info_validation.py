@@ -2,16 +2,17 @@ from pydantic import BaseModel, Field, field_validator
 from typing import Literal, Dict
 from datetime import datetime
 import re
-from utils.orm_logger import setup_logging
 import logging
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
 
+FILE_EXTENSIONS = ["csv", "json", "ndjson", "jsonl", "parquet", "feather", "arrow"]
+
+
 class BaseFileInfo(BaseModel):
     file_name: str
-    file_extension: Literal["csv", "json"]
+    file_extension: Literal["csv", "json", "ndjson", "jsonl", "parquet", "feather", "arrow"]
     file_size: float = 0
     date_created: datetime = Field(default_factory=lambda: datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
     headers_and_types: Dict[str, str] = {}  # if file is not empty, will contain column/types, key/types
@@ -28,11 +29,11 @@ class BaseFileInfo(BaseModel):
 
     @field_validator("file_extension")
     def valid_file_extension(cls, value: str):
-        """if the extension is not csv or json, raises error
+        """if the extension is not one of FILE_EXTENSIONS, raises error
 
         cant be forced to validate"""
-        if not value or value not in ["csv", "json"]:
-            logger.error(f"file should either be csv or json")
+        if not value or value not in FILE_EXTENSIONS:
+            logger.error(f"file should be one of {', '.join(FILE_EXTENSIONS)}")
             raise ValueError("not valid file extension")
         return value
 
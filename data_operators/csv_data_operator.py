@@ -2,10 +2,8 @@ import os
 from data_operators.base_data_operator import BaseDataOperator
 import pandas as pd
 from utils.helpers import create_data_file, validate_file_path
-from utils.orm_logger import setup_logging
 import logging
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
 class CSVDataOperator(BaseDataOperator):
@@ -43,6 +41,121 @@ class CSVDataOperator(BaseDataOperator):
         """saves modified self.df  to the file"""
         self.df.to_csv(self.file_path, index=False)
 
+    # streaming, for files bigger than memory. these work on the file directly, not on self.df,
+    # only one chunk of rows is in memory at a time
+
+    def iter_chunks(self, chunksize=100_000, columns=None, dtype=None, conditions=None):
+        """generator of dataframes of at most chunksize rows read from the file
+
+        args:
+        - `columns`: read only these columns
+        - `dtype`: dict column -> type, skips type inference and keeps it the same in every chunk
+        - `conditions`: only rows matching them, same conditions as update_where"""
+        usecols = columns
+        if columns is not None and conditions is not None:
+            # conditions are checked before the projection, so their columns are read too,
+            # a function can look at any column, so then the whole row is read
+            usecols = None if callable(conditions) else list(dict.fromkeys(
+                [*columns, *(column for column in conditions if column != "index")]))
+        try:
+            reader = pd.read_csv(self.file_path, chunksize=chunksize, usecols=usecols, dtype=dtype)
+        except pd.errors.EmptyDataError:
+            logger.error(f'file at {self.file_path} is empty')
+            return
+        with reader:
+            for chunk in reader:
+                if conditions is not None:
+                    chunk = chunk.loc[self._mask(conditions, chunk)]
+                if usecols is not columns:
+                    chunk = chunk[list(columns)]
+                yield chunk
+
+    def stream_filter(self, conditions, output_path, columns=None, chunksize=100_000, dtype=None) -> int:
+        """write rows matching conditions (only given columns) to another csv file
+
+        returns number of written rows"""
+        output_path = validate_file_path(output_path)
+        written_rows = 0
+        with self._atomic_writer(output_path) as file:
+            for number, chunk in enumerate(self.iter_chunks(chunksize, columns, dtype, conditions)):
+                chunk.to_csv(file, header=number == 0, index=False)
+                written_rows += len(chunk)
+        return written_rows
+
+    def stream_update(self, conditions, new_data: dict, chunksize=100_000, dtype=None) -> int:
+        """update_where on the file itself, chunk by chunk
+
+        returns number of updated rows"""
+        def update(chunk):
+            # new columns go into every chunk, the header is written from the first one,
+            # which may have no matching rows
+            for key in new_data:
+                if key not in chunk:
+                    chunk[key] = None  # object column, takes values of any type
+            mask = self._mask(conditions, chunk)
+            for key, val in new_data.items():
+                chunk.loc[mask, key] = val
+            return chunk, int(mask.sum())
+
+        return self._rewrite(update, chunksize, dtype)
+
+    def stream_delete(self, conditions, chunksize=100_000, dtype=None) -> int:
+        """delete_where on the file itself, chunk by chunk
+
+        returns number of deleted rows"""
+        def delete(chunk):
+            mask = self._mask(conditions, chunk)
+            return chunk.loc[~mask], int(mask.sum())
+
+        return self._rewrite(delete, chunksize, dtype)
+
+    def append_rows(self, rows) -> int:
+        """write rows (list of dicts or a dataframe) to the end of the file without reading it,
+        columns are put in the order of the file header, columns the file does not have are left out.
+        a missing or empty file gets the columns of the rows as its header
+
+        returns number of appended rows"""
+        new_data = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+        if new_data.empty:
+            return 0
+        if not os.path.exists(self.file_path):
+            create_data_file(self.file_path)
+        header = self._read_header()
+        if header:
+            missing_columns = set(new_data.columns) - set(header)
+            if missing_columns:
+                logger.warning(f"columns {sorted(missing_columns)} not in csv header, left out")
+            new_data = new_data.reindex(columns=header)
+
+        with open(self.file_path, "a+b") as file:
+            if file.tell() > 0:  # a file saved by an editor might not end with a newline
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    file.write(b"\n")
+        with open(self.file_path, "a", newline="") as file:
+            new_data.to_csv(file, header=not header, index=False)
+        self._update_file_metadata()
+        return len(new_data)
+
+    def _read_header(self) -> list:
+        """column names from the first line of the file, empty list for an empty file"""
+        try:
+            return list(pd.read_csv(self.file_path, nrows=0).columns)
+        except pd.errors.EmptyDataError:
+            return []
+
+    def _rewrite(self, transform, chunksize, dtype) -> int:
+        """pass every chunk through transform(chunk) -> (chunk, affected rows) into a temporary file,
+        which then replaces the original, so the file is never left half written"""
+        affected_rows = 0
+        with self._atomic_writer(self.file_path) as file:
+            for number, chunk in enumerate(self.iter_chunks(chunksize, dtype=dtype)):
+                chunk, affected = transform(chunk)
+                chunk.to_csv(file, header=number == 0, index=False)
+                affected_rows += affected
+        self._update_file_metadata()
+        return affected_rows
+
     def write_data_into_json(self, path_to_json_location):
         """convert dataframe to json and save to json
 
@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+
+INDEX_KINDS = ("hash", "sorted")
+
+# lookups of BaseDataOperator.query, same names as postgres_orm Query.filter
+LOOKUPS = ("eq", "ne", "lt", "lte", "gt", "gte", "in", "not_in", "range", "isnull")
+HASH_LOOKUPS = ("eq", "in")
+SORTED_LOOKUPS = ("eq", "in", "lt", "lte", "gt", "gte", "range")
+
+
+def parse_lookup(key: str):
+    """"age__gte" -> ("age", "gte"), "name" -> ("name", "eq")"""
+    column, _, lookup = key.partition("__")
+    lookup = lookup or "eq"
+    if lookup not in LOOKUPS:
+        raise ValueError(f"unknown lookup {lookup}, use one of {', '.join(LOOKUPS)}")
+    return column, lookup
+
+
+def lookup_mask(values: pd.Series, lookup: str, value) -> pd.Series:
+    """boolean series of values matching the lookup, used for columns without a usable index"""
+    if lookup == "isnull":
+        return values.isna() if value else values.notna()
+    if lookup == "range":
+        low, high = value
+        return (values >= low) & (values <= high)
+    if lookup in ("in", "not_in"):
+        matches = values.isin(list(value))
+        return matches if lookup == "in" else ~matches
+    return {"eq": values.__eq__, "ne": values.__ne__, "lt": values.__lt__, "lte": values.__le__,
+            "gt": values.__gt__, "gte": values.__ge__}[lookup](value)
+
+
+class HashIndex:
+    """
+    equality lookups on one column, value -> set of row labels.
+    built on first lookup, rows that are inserted, updated or deleted afterwards are applied to it one by one.
+    missing values (NaN, None) are not indexed, they never equal anything
+    """
+    kind = "hash"
+    lookups = HASH_LOOKUPS
+
+    def __init__(self, column: str) -> None:
+        self.column = column
+        self._groups = None  # None until built
+
+    def invalidate(self) -> None:
+        """forget the content, it is built again from the dataframe on the next lookup"""
+        self._groups = None
+
+    def lookup(self, df: pd.DataFrame, lookup: str, value) -> pd.Index:
+        """labels of rows matching the lookup, in no particular order"""
+        self._build(df)
+        keys = value if lookup == "in" else (value,)
+        labels = [label for key in keys for label in self._groups.get(key, ())]
+        return pd.Index(labels, dtype=df.index.dtype)
+
+    def add(self, labels, values) -> None:
+        if self._groups is None:
+            return
+        for label, value in zip(labels, values):
+            if not pd.isna(value):
+                self._groups.setdefault(value, set()).add(label)
+
+    def remove(self, labels, values) -> None:
+        if self._groups is None:
+            return
+        for label, value in zip(labels, values):
+            group = self._groups.get(value)
+            if group is not None:
+                group.discard(label)
+                if not group:
+                    del self._groups[value]
+
+    def _build(self, df: pd.DataFrame) -> None:
+        if self._groups is not None:
+            return
+        if self.column not in df:
+            self._groups = {}
+            return
+        try:
+            groups = df.groupby(self.column, sort=False).groups
+        except TypeError as e:
+            raise ValueError(f"column {self.column} has values that can't be hashed, {e}")
+        self._groups = {value: set(labels) for value, labels in groups.items()}
+
+
+class SortedIndex:
+    """
+    equality and range lookups on one column, values sorted with the row labels next to them,
+    lookups are binary searches. sorted on first lookup, afterwards added rows are sorted on their own and
+    merged in and removed rows are filtered out, so a change costs O(n + k log k) for k changed rows
+    instead of sorting all n again
+    """
+    kind = "sorted"
+    lookups = SORTED_LOOKUPS
+
+    def __init__(self, column: str) -> None:
+        self.column = column
+        self._values = None  # sorted values, None until built
+        self._labels = None  # row label of every sorted value
+
+    def invalidate(self) -> None:
+        self._values = None
+        self._labels = None
+
+    def lookup(self, df: pd.DataFrame, lookup: str, value) -> pd.Index:
+        """labels of rows matching the lookup, in no particular order"""
+        self._build(df)
+        if lookup == "in":
+            return pd.Index(np.concatenate([self._between(key, key) for key in value] or [self._labels[:0]]),
+                            dtype=df.index.dtype)
+        if lookup == "range":
+            low, high = value
+            return pd.Index(self._between(low, high), dtype=df.index.dtype)
+        bounds = {"eq": (value, value, True, True), "lt": (None, value, True, False),
+                  "lte": (None, value, True, True), "gt": (value, None, False, True),
+                  "gte": (value, None, True, True)}[lookup]
+        return pd.Index(self._between(*bounds), dtype=df.index.dtype)
+
+    def add(self, labels, values) -> None:
+        if self._values is None:
+            return
+        values = np.asarray(values)
+        labels = np.asarray(labels)
+        indexed = ~pd.isna(values)
+        values, labels = values[indexed], labels[indexed]
+        if not len(values):
+            return
+        try:
+            order = np.argsort(values, kind="stable")
+            values, labels = values[order], labels[order]
+            # final position of every new value, the ones before it plus the new values before it
+            positions = np.searchsorted(self._values, values, "right") + np.arange(len(values))
+        except TypeError:
+            self.invalidate()  # not comparable with the indexed values, the next lookup reports it
+            return
+        is_new = np.zeros(len(self._values) + len(values), dtype=bool)
+        is_new[positions] = True
+        self._values = self._merged(self._values, values, is_new)
+        self._labels = self._merged(self._labels, labels, is_new)
+
+    def remove(self, labels, values) -> None:
+        if self._values is None or not len(labels):
+            return
+        kept = ~np.isin(self._labels, np.asarray(labels))
+        self._values = self._values[kept]
+        self._labels = self._labels[kept]
+
+    @staticmethod
+    def _merged(current, new, is_new):
+        merged = np.empty(len(is_new), dtype=np.result_type(current, new))
+        merged[is_new] = new
+        merged[~is_new] = current
+        return merged
+
+    def _between(self, low, high, include_low=True, include_high=True):
+        start = 0 if low is None else np.searchsorted(self._values, low, "left" if include_low else "right")
+        end = len(self._values) if high is None else np.searchsorted(self._values, high,
+                                                                     "right" if include_high else "left")
+        return self._labels[start:end]
+
+    def _build(self, df: pd.DataFrame) -> None:
+        if self._values is not None:
+            return
+        values = df[self.column].dropna() if self.column in df else pd.Series(dtype=object)
+        try:
+            order = np.argsort(values.to_numpy(), kind="stable")
+        except TypeError as e:
+            raise ValueError(f"column {self.column} has values that can't be compared, {e}")
+        self._values = values.to_numpy()[order]
+        self._labels = values.index.to_numpy()[order]
+
+
+INDEX_CLASSES = {index_class.kind: index_class for index_class in (HashIndex, SortedIndex)}
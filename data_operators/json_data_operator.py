@@ -1,45 +1,203 @@
 from data_operators.base_data_operator import BaseDataOperator
-from utils.helpers import create_data_file, validate_file_path
-from utils.orm_logger import setup_logging
+from utils.helpers import create_data_file, validate_file_path, parse_file_path
 import logging
 import os
 import pandas as pd
 import json
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
+LINES_EXTENSIONS = ("ndjson", "jsonl")
+WHITESPACE = " \t\r\n"
+NUMBER_CHARACTERS = "0123456789+-.eE"
+
 
 class JsonDataOperator(BaseDataOperator):
+    """json files, either one array of records or NDJSON (JSON Lines), one record per line.
+
+    NDJSON is used for .ndjson and .jsonl files or with lines=True. both are read chunk by chunk,
+    big arrays are parsed record by record, and written compact unless an indent is given"""
     CURRENT_WORKING_DIRECTORY = os.getcwd()
     BACKUP_FILE_PATH = os.path.join(CURRENT_WORKING_DIRECTORY, "this_is_a_backup_file.json")
 
-    def __init__(self, file_path=BACKUP_FILE_PATH):
+    def __init__(self, file_path=BACKUP_FILE_PATH, lines=None, indent=None):
         super().__init__(file_path=file_path)
+        self.lines = parse_file_path(file_path)[2] in LINES_EXTENSIONS if lines is None else lines
+        self.indent = indent
 
-    def get_data(self):
+    def get_data(self, chunksize=10_000):
+        """read the file into self.df, nested data is normalized (address.city), chunksize records at a time"""
         try:
-            # to handle json files that might have nested data
-            with open(self.file_path, 'r') as file:
-                data = json.load(file)
-            # Normalize the JSON data into a DataFrame
-            self.df = pd.json_normalize(data)  # to try to normalize all the nested json data
+            chunks = list(self.iter_chunks(chunksize))
+            if chunks:
+                self.df = pd.concat(chunks, ignore_index=True)
+            else:
+                logger.info(f"file {validate_file_path(self.file_path)} is empty")
         except FileNotFoundError:
             self.file_path = validate_file_path(self.file_path)  # to update new file path if name validated
             create_data_file(self.file_path)
 
-        except json.decoder.JSONDecodeError:  # happens when file is empty
-            logger.info(f"file {validate_file_path(self.file_path)} is empty")
+        except json.decoder.JSONDecodeError as e:
+            logger.error(f"file {validate_file_path(self.file_path)} is not valid json: {e}")
         finally:
             self._update_file_metadata()
 
+    def iter_chunks(self, chunksize=10_000):
+        """generator of normalized dataframes of at most chunksize records, without reading the whole file"""
+        chunk = []
+        for record in self.iter_records():
+            chunk.append(record)
+            if len(chunk) == chunksize:
+                yield pd.json_normalize(chunk)
+                chunk = []
+        if chunk:
+            yield pd.json_normalize(chunk)
+
+    def iter_records(self, block_size=1 << 20):
+        """generator of records of the file, one line at a time for NDJSON,
+        for arrays block_size characters are read and parsed at a time"""
+        with open(self.file_path, "r", encoding="utf-8") as file:
+            if self.lines:
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+                return
+            yield from self._iter_array(file, block_size)
+
+    @staticmethod
+    def _iter_array(file, block_size):
+        """records of a top level json array, decoded one by one with raw_decode while reading the file
+        in blocks. a file with anything else than an array is read whole.
+        values have to be separated by exactly one comma, anything json.loads rejects raises JSONDecodeError"""
+        decoder = json.JSONDecoder()
+        buffer = ""
+        while not buffer:
+            block = file.read(block_size)
+            if not block:
+                return
+            buffer = block.lstrip(WHITESPACE)
+        if not buffer.startswith("["):
+            data = json.loads(buffer + file.read())
+            yield from (data if isinstance(data, list) else [data])
+            return
+
+        position = 1
+        expecting = "first value"  # or "value" after a comma, "delimiter" after a value
+        end_of_file = False
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                character = buffer[position]
+                if expecting == "delimiter":
+                    if character == ",":
+                        expecting = "value"
+                        position += 1
+                        continue
+                    if character == "]":
+                        JsonDataOperator._check_end(file, buffer[position + 1:], block_size)
+                        return
+                    raise json.decoder.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+                if character == "]" and expecting == "first value":
+                    JsonDataOperator._check_end(file, buffer[position + 1:], block_size)
+                    return
+                if character in ",]":  # [1,,2] or [1,]
+                    raise json.decoder.JSONDecodeError("Expecting value", buffer, position)
+                try:
+                    record, end = decoder.raw_decode(buffer, position)
+                    # a number may continue in the next block, "-6." decodes as -6 until "5e3" is read
+                    complete = end_of_file or (end < len(buffer) and buffer[end] not in NUMBER_CHARACTERS)
+                except json.decoder.JSONDecodeError:
+                    if end_of_file:
+                        raise
+                    complete = False
+                if complete:
+                    yield record
+                    position = end
+                    expecting = "delimiter"
+                    continue
+            elif end_of_file:
+                message = "Expecting ',' delimiter" if expecting == "delimiter" else "Expecting value"
+                raise json.decoder.JSONDecodeError(message, buffer, position)
+            more = file.read(block_size)
+            end_of_file = not more
+            buffer = buffer[position:] + more
+            position = 0
+
+    @staticmethod
+    def _check_end(file, rest, block_size):
+        """only whitespace may follow the closing bracket"""
+        while True:
+            extra = rest.lstrip(WHITESPACE)
+            if extra:
+                raise json.decoder.JSONDecodeError("Extra data", rest, len(rest) - len(extra))
+            rest = file.read(block_size)
+            if not rest:
+                return
+
+    def append_records(self, records) -> int:
+        """write records (list of dicts or a dataframe) to the end of the file without reading it.
+        NDJSON gets new lines, in an array file they are written in front of the closing bracket
+
+        returns number of appended records"""
+        if isinstance(records, pd.DataFrame):
+            records = json.loads(records.to_json(orient="records"))
+        encoded = [json.dumps(record, default=str) for record in records]
+        if not encoded:
+            return 0
+        if not os.path.exists(self.file_path):
+            create_data_file(self.file_path)
+
+        with open(self.file_path, "r+b") as file:
+            end = file.seek(0, os.SEEK_END)
+            if self.lines:
+                if end:  # a file saved by an editor might not end with a newline
+                    file.seek(end - 1)
+                    if file.read(1) != b"\n":
+                        file.write(b"\n")
+                file.write(("\n".join(encoded) + "\n").encode("utf-8"))
+            else:
+                self._append_to_array(file, end, encoded)
+        self._update_file_metadata()
+        return len(encoded)
+
+    @staticmethod
+    def _last_character(file, end):
+        """last character before position end that is not whitespace and its position, (b"", -1) if there is none"""
+        position = end
+        while position > 0:
+            block_start = max(0, position - 4096)
+            file.seek(block_start)
+            stripped = file.read(position - block_start).rstrip(WHITESPACE.encode())
+            if stripped:
+                return stripped[-1:], block_start + len(stripped) - 1
+            position = block_start
+        return b"", -1
+
+    def _append_to_array(self, file, end, encoded) -> None:
+        records = ",".join(encoded).encode("utf-8")
+        last_character, closing_bracket = self._last_character(file, end)
+        if not last_character:  # empty file
+            file.seek(0)
+            file.truncate()
+            file.write(b"[" + records + b"]")
+            return
+        if last_character != b"]":
+            raise ValueError(f"file {self.file_path} is not a json array, can't append to it")
+        empty_array = self._last_character(file, closing_bracket)[0] == b"["
+        file.seek(closing_bracket)
+        file.truncate()
+        file.write((b"" if empty_array else b",") + records + b"]")
+
     def commit_to_file(self) -> None:
-        """saves modified self.df  to the file"""
-        self.df.to_json(self.file_path, index=False, orient="records", indent=4)
+        """saves modified self.df to the file, compact unless indent was given"""
+        with self._atomic_writer(self.file_path) as file:
+            self.df.to_json(file, index=False, orient="records", lines=self.lines,
+                            indent=None if self.lines else self.indent)
 
     def write_data_into_csv(self, path_to_json_location):
         """convert dataframe to json and save to json
 
         if json does not exist, create with validating the name"""
         validated_json_csv = validate_file_path(path_to_json_location)
-        self.df.to_csv(validated_json_csv, index=False)
\ No newline at end of file
+        self.df.to_csv(validated_json_csv, index=False)
@@ -0,0 +1,141 @@
+import os
+from data_operators.base_data_operator import BaseDataOperator
+from utils.helpers import parse_file_path, validate_file_path
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as pa_dataset
+    import pyarrow.feather as feather
+    import pyarrow.fs
+    import pyarrow.parquet as pq
+except ImportError:  # columnar files are optional, csv and json work without pyarrow
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# extension -> pyarrow dataset format, feather v2 is the arrow ipc file format
+FORMATS = {"parquet": "parquet", "feather": "ipc", "arrow": "ipc"}
+
+
+def _arrow_filters(conditions):
+    """conditions like in update_where ({column: value or list of values}) as pyarrow filters,
+    pyarrow filters ([(column, op, value)]) are passed as they are"""
+    if conditions is None or isinstance(conditions, list):
+        return conditions
+    return [(column, "in", list(value)) if isinstance(value, (list, tuple, set)) else (column, "==", value)
+            for column, value in conditions.items()]
+
+
+class ParquetDataOperator(BaseDataOperator):
+    """
+    parquet, feather and arrow files through pyarrow.
+
+    only the requested columns are read, and with parquet only the row groups whose statistics can match
+    the filters, so rereading a part of a big file is fast. feather and arrow files are memory mapped.
+    written files are compressed, zstd by default.
+    """
+    CURRENT_WORKING_DIRECTORY = os.getcwd()
+    BACKUP_FILE_PATH = os.path.join(CURRENT_WORKING_DIRECTORY, "this_is_a_backup_file.parquet")
+
+    def __init__(self, file_path=BACKUP_FILE_PATH, compression="zstd", memory_map=True):
+        if pa is None:
+            raise ImportError("ParquetDataOperator needs pyarrow, install it with `pip install pyarrow`")
+        super().__init__(file_path=file_path)
+        _, _, file_extension = parse_file_path(file_path)
+        if file_extension not in FORMATS:
+            raise ValueError(f"file should be one of {', '.join(FORMATS)}, got {file_extension}")
+        self.file_format = FORMATS[file_extension]
+        self.compression = compression
+        self.memory_map = memory_map
+
+    def get_data(self, columns=None, conditions=None):
+        """read the file into self.df, if not found create an empty one
+
+        args:
+        - `columns`: read only these columns
+        - `conditions`: only rows matching them, dict column -> value (lists match any of their values)
+           or pyarrow filters like [("age", ">", 30)]. with parquet, row groups that can't match are skipped"""
+        try:
+            self.df = self.read_table(columns, conditions).to_pandas()
+        except FileNotFoundError:
+            logger.error("file at given path does not exist, creating new one")
+            self.file_path = validate_file_path(self.file_path)
+            self._write_table(pa.table({}))
+        finally:
+            self._update_file_metadata()
+
+    def read_table(self, columns=None, conditions=None):
+        """pyarrow table with given columns and rows, see get_data"""
+        filters = _arrow_filters(conditions)
+        if self.file_format == "parquet":
+            return pq.read_table(self.file_path, columns=columns, filters=filters, memory_map=self.memory_map)
+        # filtered as a dataset, the filter can use columns that are not in the projection
+        dataset = pa_dataset.dataset(self.file_path, format=self.file_format,
+                                     filesystem=pa.fs.LocalFileSystem(use_mmap=self.memory_map))
+        return dataset.to_table(columns=columns, filter=pq.filters_to_expression(filters) if filters else None)
+
+    def iter_batches(self, batch_size=100_000, columns=None, conditions=None):
+        """generator of dataframes of at most batch_size rows, for files bigger than memory"""
+        dataset = pa_dataset.dataset(self.file_path, format=self.file_format)
+        filters = _arrow_filters(conditions)
+        expression = pq.filters_to_expression(filters) if filters else None
+        for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_size):
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+    def commit_to_file(self) -> None:
+        """saves modified self.df to the file"""
+        self._write_table(pa.Table.from_pandas(self.df, preserve_index=False))
+
+    def _write_table(self, table) -> None:
+        # through a temporary file, the old file may still be memory mapped by self.df
+        with self._atomic_writer(self.file_path, mode="wb") as file:
+            if self.file_format == "parquet":
+                pq.write_table(table, file, compression=self.compression)
+            else:
+                feather.write_feather(table, file, compression=self.compression)
+
+    @classmethod
+    def from_data_operator(cls, data_operator, file_path, block_size=16 << 20, **options):
+        """
+        convert the data of a csv or json operator to a parquet, feather or arrow file and return its operator.
+
+        the dataframe of the operator is used when it is loaded, otherwise a csv file is converted
+        block_size bytes at a time without reading it whole, a json file is read with get_data.
+        """
+        operator = cls(validate_file_path(file_path), **options)
+        source_extension = parse_file_path(data_operator.file_path)[2]
+        if data_operator.df.empty and source_extension == "csv" and os.path.getsize(data_operator.file_path):
+            operator._convert_csv(data_operator.file_path, block_size)
+            operator._update_file_metadata()
+            return operator
+
+        if data_operator.df.empty:
+            data_operator.get_data()
+        operator.df = data_operator.df
+        operator.commit_to_file()
+        operator._update_file_metadata()
+        return operator
+
+    def _convert_csv(self, csv_path, block_size) -> None:
+        """stream csv into the file, column types are inferred from the first block"""
+        reader = pa_csv.open_csv(csv_path, read_options=pa_csv.ReadOptions(block_size=block_size))
+        with self._atomic_writer(self.file_path, mode="wb") as file:
+            if self.file_format == "parquet":
+                writer = pq.ParquetWriter(file, reader.schema, compression=self.compression)
+            else:
+                writer = pa.ipc.new_file(file, reader.schema,
+                                         options=pa.ipc.IpcWriteOptions(compression=self.compression))
+            with writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+
+    def write_data_into_csv(self, path_to_csv_location):
+        """save dataframe to csv"""
+        self.df.to_csv(validate_file_path(path_to_csv_location), index=False)
+
+    def write_data_into_json(self, path_to_json_location):
+        """save dataframe to json"""
+        self.df.to_json(validate_file_path(path_to_json_location), index=False, orient="records", force_ascii=False)
@@ -1,4 +1,27 @@
+import importlib
+
 from .base_connector_manager import BaseConnectorManager
 from .base_database_manager import BaseManager
 from . import columns
-from .model_manager import BaseModel
\ No newline at end of file
+from .connection_pool import ConnectionPool, PoolTimeout, get_pool, close_all_pools
+from .model_manager import BaseModel
+from .session import Session
+from .query import Query
+from .indexes import Index, RangePartition, HashPartition
+from .cached_manager import CachedManager
+from .parallel import ParallelManager, Shard, ShardError
+
+# imported on first use, asyncpg and asyncio are only needed by async code
+_LAZY_EXPORTS = {"AsyncBaseManager": ".async_database_manager"}
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        value = getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted([*globals(), *_LAZY_EXPORTS])
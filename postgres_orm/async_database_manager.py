@@ -0,0 +1,212 @@
+import logging
+import time
+from utils.event_loops import loop_state
+from utils.instrumentation import instrumentation, OperationEvent
+from . import bulk_load
+from . import columns
+
+try:
+    import asyncpg
+except ImportError:  # async manager is optional, the rest of the orm works without asyncpg
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+
+async def _close_pools(state: dict) -> None:
+    """close the pools of an event loop that shuts down"""
+    for pool in state["pools"].values():
+        if not pool.is_closing():
+            await pool.close()
+
+
+def _asyncpg_settings(database_settings: dict) -> dict:
+    """same settings dict as the sync manager, psycopg2 calls the database `dbname`, asyncpg `database`"""
+    settings = dict(database_settings)
+    if "dbname" in settings:
+        settings["database"] = settings.pop("dbname")
+    return settings
+
+
+def _report_query(record) -> None:
+    """asyncpg query logger, reports every query of the pool to utils.instrumentation"""
+    if instrumentation.enabled:
+        instrumentation.emit(OperationEvent("postgres", "execute", record.query, len(record.args or ()),
+                                            duration=record.elapsed, error=record.exception))
+
+
+def _instrumented_init(init=None):
+    """connection init for asyncpg pools, adds the query logger and runs the init given in pool options"""
+    async def instrumented_init(connection):
+        connection.add_query_logger(_report_query)
+        if init is not None:
+            await init(connection)
+    return instrumented_init
+
+
+class AsyncBaseManager:
+    """
+    asyncio version of BaseManager, works with the same BaseModel classes and columns.
+
+    every method borrows its own connection from an asyncpg pool, so independent queries started
+    together with asyncio.gather run concurrently on different connections.
+    """
+    def __init__(self, model_class_instance):
+        self.model_class_name = model_class_instance.__class__.__name__
+        self.model_fields = getattr(model_class_instance, "fields", {})
+        self.pool = None
+
+    async def set_connection(self, database_settings: dict, min_size: int = 1, max_size: int = 10,
+                             **pool_options) -> None:
+        """
+        create (or reuse) the connection pool for the given settings.
+        pool options are passed to asyncpg.create_pool when the first manager creates the pool.
+        """
+        if asyncpg is None:
+            raise ImportError("AsyncBaseManager needs asyncpg, install it with `pip install asyncpg`")
+
+        # asyncpg pools belong to the event loop they were created on, managers connected with
+        # the same settings on one loop share the pool, it is closed when asyncio.run closes the loop
+        state = loop_state(__name__, close=_close_pools)
+        pools = state.setdefault("pools", {})
+        key = tuple(sorted((key, str(value)) for key, value in database_settings.items()))
+        async with state["lock"]:
+            pool = pools.get(key)
+            if pool is None or pool.is_closing():
+                pool_options["init"] = _instrumented_init(pool_options.get("init"))
+                pool = await asyncpg.create_pool(min_size=min_size, max_size=max_size,
+                                                 **pool_options, **_asyncpg_settings(database_settings))
+                pools[key] = pool
+        self.pool = pool
+
+    async def close(self) -> None:
+        """close the pool, every manager sharing it loses its connection"""
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def create_table(self, model_class_instance):
+        """
+        creates a table base on the class name that inherits from BaseModel,
+        with the indexes, composite primary key and partitioning declared on the model.
+
+        args:
+        - `model_class_instance`: an instance of class representing the table in the db.
+        """
+        fields = [f"{field} {data_type}" for field, data_type in model_class_instance.fields.items()]
+        primary_key = getattr(model_class_instance, "__primary_key__", None)
+        if primary_key:
+            fields.append(f"PRIMARY KEY ({', '.join(primary_key)})")
+        query = f"CREATE TABLE IF NOT EXISTS {self.model_class_name} ({', '.join(fields)})"
+
+        partition_by = getattr(model_class_instance, "__partition_by__", None)
+        if partition_by is not None:
+            query += f" {partition_by.sql()}"
+
+        async with self.pool.acquire() as connection:
+            await connection.execute(query)
+            for index in getattr(model_class_instance, "__indexes__", ()):
+                await connection.execute(index.sql(self.model_class_name))
+
+    async def select(self, *field_names, batch_size=1000):
+        """
+        select data from the database, can select custom fields and sizes
+
+        args:
+        - `field_names`: list of fields to be selected, if not specified, select all
+        - `batch_size`: size of the batch to be selected, if not specified, select first 1000
+
+        returns:
+        - list of the rows selected by the query, as tuples like the sync manager"""
+        select_fields = ", ".join(field_names or ["*"])
+        query = f"SELECT {select_fields} FROM {self.model_class_name} LIMIT $1"
+        records = await self.pool.fetch(query, batch_size)
+        return [tuple(record) for record in records]
+
+    async def stream(self, *field_names, prefetch: int = 2000):
+        """
+        async generator over the whole table, reads through a server side cursor,
+        `prefetch` rows are fetched from the server at once.
+
+        the connection stays borrowed until the generator is exhausted or closed.
+
+        yields:
+        - rows one by one, as tuples
+        """
+        select_fields = ", ".join(field_names or ["*"])
+        query = f"SELECT {select_fields} FROM {self.model_class_name}"
+        async with self.pool.acquire() as connection:
+            async with connection.transaction(readonly=True):
+                async for record in connection.cursor(query, prefetch=prefetch):
+                    yield tuple(record)
+
+    async def batch_insert(self, rows, use_copy: bool = False, chunk_size: int = 1000) -> int:
+        """
+        insert single or multiple rows of data in the table.
+
+        args:
+        - `rows`: list or generator of dictionaries, or a pandas DataFrame.
+        - `use_copy`: load rows with binary COPY (copy_records_to_table) instead of INSERT statements.
+        - `chunk_size`: number of rows sent to the server at once.
+
+        returns:
+        - number of rows inserted
+        """
+        fields, row_tuples = bulk_load.prepare_rows(self.model_fields, rows)
+        if not fields:
+            return 0
+
+        placeholders = ", ".join(f"${position}" for position in range(1, len(fields) + 1))
+        insert_query = f"INSERT INTO {self.model_class_name} ({', '.join(fields)}) VALUES ({placeholders})"
+
+        inserted_rows = 0
+        started = time.perf_counter()
+        async with self.pool.acquire() as connection:
+            try:
+                for chunk in bulk_load.iter_chunks(row_tuples, chunk_size):
+                    if use_copy:
+                        await connection.copy_records_to_table(self.model_class_name.lower(),
+                                                               records=chunk, columns=fields)
+                    else:
+                        # asyncpg pipelines executemany, the whole chunk goes in one round trip
+                        await connection.executemany(insert_query, chunk)
+                    inserted_rows += len(chunk)
+            except KeyError as e:
+                logger.error(f"trying to insert with invalid key {e}, {inserted_rows} rows were inserted before it")
+
+        elapsed = time.perf_counter() - started
+        rows_per_second = inserted_rows / elapsed if elapsed else float(inserted_rows)
+        logger.info(f"inserted {inserted_rows} rows into {self.model_class_name} in {elapsed:.3f}s "
+                    f"({rows_per_second:.0f} rows/s)")
+        return inserted_rows
+
+    async def update(self, new_data: dict, identifier_column_name, identifier_value):
+        """
+        update single or many rows of data.
+
+        args:
+        - `new_data`: dict of the column-value pairs to be updated.
+        - `identifier_column_name`: column name to identify which columns to update.
+        - `identifier_value`: find the columns that have given value to update them.
+        """
+        set_values = ", ".join(f"{key} = ${position}" for position, key in enumerate(new_data, start=1))
+        query = (f"UPDATE {self.model_class_name} SET {set_values} "
+                 f"WHERE {identifier_column_name} = ${len(new_data) + 1}")
+        await self.pool.execute(query, *new_data.values(), identifier_value)
+
+    async def delete(self, identifier_column_name, column_value):
+        """
+        based on identifier provided, delete a row or rows from the table.
+
+        args
+        identifier_column_name: column name to identify row with
+        column_value: value of the given column name to select single or multiple rows
+        """
+        query = f"DELETE FROM {self.model_class_name} WHERE {identifier_column_name} = $1"
+        await self.pool.execute(query, column_value)
+
+    async def add_column_to_table(self, column_name, column_class) -> None:
+        if not isinstance(column_class, columns.Column):
+            logger.error(f"Column class: {column_class} not a valid column")
+
+        query = f"ALTER TABLE {self.model_class_name} ADD COLUMN {column_name} {column_class.type}"
+        await self.pool.execute(query)
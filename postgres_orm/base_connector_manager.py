@@ -1,4 +1,6 @@
-import psycopg2
+from contextlib import contextmanager
+from .connection_pool import get_pool
+from .instrumented_cursor import connect
 
 
 class BaseConnectorManager:
@@ -9,10 +11,57 @@ class BaseConnectorManager:
 
         will be used to get the class attributes and turn them into iterable fields"""
         self.model_class_name = model_class_instance.__class__.__name__  # from  <class '__main__.Employee'> get employee as a table name
+        self.model_class = model_class_instance.__class__
+        self.model_fields = getattr(model_class_instance, "fields", {})  # column name -> column instance, keeps declaration order
+        self.connection = None
+        self.pool = None
+        self.database_settings = None  # kept so parallel workers can open connections of their own
+        self.statement_cache_options = None  # set by enable_statement_cache
 
-    def set_connection(self, database_settings: dict) -> None:
-        self.connection = psycopg2.connect(**database_settings)
-        self.connection.autocommit = True
+    def set_connection(self, database_settings: dict, pooled: bool = False, **pool_options) -> None:
+        """
+        connect to the database.
 
-    def _get_cursor(self):
-        return self.connection.cursor()
\ No newline at end of file
+        with `pooled` the manager borrows connections from a pool shared by every manager
+        connected with the same settings, instead of holding one connection of its own.
+        pool_options (min_size, max_size, idle_timeout, max_lifetime, checkout_timeout, health_check)
+        are used when the pool is created by the first manager.
+        """
+        self.database_settings = database_settings
+        if pooled:
+            self.pool = get_pool(database_settings, **pool_options)
+            return
+
+        self.connection = connect(database_settings)
+
+    def share_connection(self, other_manager) -> None:
+        """use the connection (or pool) of another manager, so both can take part in one transaction"""
+        self.connection = other_manager.connection
+        self.pool = other_manager.pool
+        self.database_settings = other_manager.database_settings
+
+    def pool_stats(self) -> dict:
+        """statistics of the shared pool (wait time, in use, created...), empty if the manager isn't pooled"""
+        return self.pool.stats() if self.pool is not None else {}
+
+    @contextmanager
+    def borrow_connection(self, pin: bool = True):
+        """
+        connection to run queries on for the duration of the block.
+
+        pooled managers borrow one from the pool and give it back at the end, nested blocks in the
+        same thread reuse it, so wrapping several operations in one block runs them on one connection.
+        """
+        if self.pool is None:
+            yield self.connection
+            return
+
+        with self.pool.connection(pin=pin) as connection:
+            yield connection
+
+    @contextmanager
+    def _get_cursor(self, **cursor_kwargs):
+        """cursor_kwargs are passed to psycopg2, e.g. name= for server side cursor"""
+        with self.borrow_connection() as connection:
+            with connection.cursor(**cursor_kwargs) as cursor:
+                yield cursor
@@ -1,32 +1,82 @@
-import pandas as pd
 import logging
+import struct
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+from itertools import chain
+import psycopg2
+from psycopg2.extras import execute_values
 from .base_connector_manager import BaseConnectorManager
+from .instrumented_cursor import connect
+from . import bulk_load
+from . import export_utils
+from . import statement_cache
+from .query import Query
+from .parallel import ParallelManager
+from .indexes import Index
 from . import columns
-from utils.orm_logger import setup_logging
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
+MAX_STATEMENT_PARAMETERS = 65535
+
+# connection -> callbacks to run when its outermost transaction() block ends, see on_transaction_end
+_transaction_callbacks = weakref.WeakKeyDictionary()
+
 
 class BaseManager(BaseConnectorManager):
+    def enable_statement_cache(self, max_size: int = 128, prepare: bool = True) -> None:
+        """
+        cache statements of select, batch_insert, update and delete per connection.
+
+        with `prepare` repeated operations with the same model and column set are sent as EXECUTE of a
+        server side prepared statement, so postgres doesn't parse and plan them again.
+        least recently used statements are deallocated once there are more than `max_size` of them.
+        `SELECT *` statements are never prepared, their result columns would change with the table.
+
+        the cache belongs to the connection, managers sharing a connection or a pool share it, and the
+        options of the manager that first used the connection are the ones it keeps.
+        """
+        self.statement_cache_options = {"max_size": max_size, "prepare": prepare}
+
+    def statement_cache_stats(self) -> dict:
+        """hits, misses, evictions and hit ratio summed over all connections of the process,
+        not only the ones of this manager"""
+        return statement_cache.caches_stats()
+
     def create_table(self, model_class_instance):
         """
         creates a table base on the class name that inherits from BaseModel.
         -------
         class Example(BaseManager): -> creates example table
 
+        indexes (__indexes__), composite primary key (__primary_key__) and partitioning (__partition_by__)
+        declared on the model are created with it.
+
         args:
         - `model_class_instance`: an instance of class representing the table in the db.
         """
         table_name = self.model_class_name
         fields = [f"{field} {data_type}" for field, data_type in model_class_instance.fields.items()]
+        # composite primary key declared on the model as __primary_key__ = ("a", "b")
+        primary_key = getattr(model_class_instance, "__primary_key__", None)
+        if primary_key:
+            fields.append(f"PRIMARY KEY ({', '.join(primary_key)})")
         # construct create table query
         field_definitions = ", ".join(fields)
         query = f"CREATE TABLE IF NOT EXISTS {table_name} ({field_definitions})"
 
+        partition_by = getattr(model_class_instance, "__partition_by__", None)
+        if partition_by is not None:
+            query += f" {partition_by.sql()}"
+
         # I'll use cursor with "with" to make sure it is closed at the end
         with self._get_cursor() as cursor:
             cursor.execute(query)
+            for index in getattr(model_class_instance, "__indexes__", ()):
+                cursor.execute(index.sql(table_name))
+        statement_cache.invalidate_all()
 
     def select(self, *field_names, batch_size=1000):
         """
@@ -38,39 +88,257 @@ class BaseManager(BaseConnectorManager):
 
         returns:
         - list of the rows selected by the query"""
+        # SELECT * is not prepared, a prepared plan keeps the columns the table had when it was prepared
+        cacheable = bool(field_names)
         if not field_names:
             field_names = ["*"]  # if field names are not specified, select all
 
         # construct select query
         select_fields = ", ".join(field_names)
-        query = f"SELECT {select_fields} FROM {self.model_class_name} LIMIT {batch_size}"
 
         with self._get_cursor() as cursor:
-            cursor.execute(query)
+            self._execute(cursor, ("select", tuple(field_names)),
+                          lambda: f"SELECT {select_fields} FROM {self.model_class_name} LIMIT %s", (batch_size,),
+                          cacheable=cacheable)
             rows = cursor.fetchall()
             return rows
 
-    def batch_insert(self, rows: list[dict]):
+    def query(self) -> Query:
+        """
+        chainable query over the table, filters, sorting and paging run in postgres.
+
+        manager.query().filter(salary__gte=100).order_by("-salary").limit(10).all()
+        """
+        return Query(self)
+
+    def parallel(self, workers: int = 4, **options) -> ParallelManager:
+        """
+        exports and batch insert running on `workers` connections at once, see ParallelManager for options
+
+        manager.parallel(workers=8).export_data_as_csv("employee.csv")
+        """
+        return ParallelManager(self, workers, **options)
+
+    def filter(self, **lookups) -> Query:
+        """shortcut for query().filter(...)"""
+        return Query(self).filter(**lookups)
+
+    def iter_select(self, *field_names, itersize: int = 2000):
+        """
+        generator version of select, reads the whole table through a server side (named) cursor,
+        only `itersize` rows are held in client memory at once.
+
+        the cursor needs a transaction. inside transaction() it runs in that transaction, otherwise
+        on a connection of its own whose read only transaction ends with the scan, so writes made
+        while iterating are committed as usual.
+
+        args:
+        - `field_names`: fields to be selected, if not specified, select all
+        - `itersize`: number of rows fetched from the server per network round trip
+
+        yields:
+        - rows one by one
+        """
+        select_fields = ", ".join(field_names or ["*"])
+        query = f"SELECT {select_fields} FROM {self.model_class_name}"
+        with self._server_side_cursor(query, itersize) as cursor:
+            yield from cursor
+
+    def stream(self, *field_names, batch_size: int = 1000, start_after=None):
+        """
+        walk the table in primary key order with keyset pagination, every batch is a separate
+        `WHERE pk > last_key ORDER BY pk LIMIT batch_size` query, so no transaction is kept open and
+        a scan that failed can be restarted from the last key it has seen.
+
+        primary key is always selected, if it is not in `field_names` it is added as the first column.
+
+        args:
+        - `field_names`: fields to be selected, if not specified, select all
+        - `batch_size`: number of rows read per query
+        - `start_after`: primary key value to resume from, rows with bigger keys are returned
+
+        yields:
+        - rows one by one
+        """
+        key_column = self._primary_key_column()
+        if field_names and key_column not in field_names:
+            field_names = (key_column, *field_names)
+
+        select_fields = ", ".join(field_names or ["*"])
+        base_query = f"SELECT {select_fields} FROM {self.model_class_name}"
+
+        last_key = start_after
+        while True:
+            with self._get_cursor() as cursor:
+                if last_key is None:
+                    cursor.execute(f"{base_query} ORDER BY {key_column} LIMIT %s", (batch_size,))
+                else:
+                    cursor.execute(f"{base_query} WHERE {key_column} > %s ORDER BY {key_column} LIMIT %s",
+                                   (last_key, batch_size))
+                rows = cursor.fetchall()
+                key_index = [desc[0] for desc in cursor.description].index(key_column)
+
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_key = rows[-1][key_index]
+
+    def batch_insert(self, rows, use_copy: bool = False, copy_format: str = "text", chunk_size: int = 1000) -> int:
         """
         insert single or multiple rows of data in the table.
 
+        rows are sent in chunks, either as multi-row INSERT ... VALUES statements or, with `use_copy`,
+        streamed through COPY FROM STDIN which is much faster for large loads. if COPY can't be used
+        (e.g. binary format for a column type without binary encoding) the chunk falls back to VALUES.
+
         args:
-        - `rows`: list containing dictionaries of individual data instances. even if inserting single data.
-        dict should be wrapped in the list.
+        - `rows`: list or generator of dictionaries of individual data instances, or a pandas DataFrame.
+        even if inserting single data, dict should be wrapped in the list.
+        - `use_copy`: load the rows with COPY instead of INSERT statements.
+        - `copy_format`: "text" or "binary", format of the COPY stream.
+        - `chunk_size`: number of rows sent to the server at once.
+
+        returns:
+        - number of rows inserted
         """
-        if not rows:
-            return
+        if copy_format not in ("text", "binary"):
+            raise ValueError(f"copy format should be either text or binary, got {copy_format}")
+
+        fields, row_tuples = bulk_load.prepare_rows(self.model_fields, rows)
+        if not fields:
+            return 0
 
-        fields = list(rows[0].keys())  # row headers
-        values_template = ", ".join(["%s"] * len(fields))  # the values to insert
-        insert_query = f"INSERT INTO {self.model_class_name} ({', '.join(fields)}) VALUES ({values_template})"
+        column_names = ", ".join(fields)
+        copy_query = f"COPY {self.model_class_name} ({column_names}) FROM STDIN WITH (FORMAT {copy_format})"
 
+        inserted_rows = 0
+        started = time.perf_counter()
         with self._get_cursor() as cursor:
             try:
-                rows_to_insert = [[row[field] for field in fields] for row in rows]
-                cursor.executemany(insert_query, rows_to_insert)
+                for chunk in bulk_load.iter_chunks(row_tuples, chunk_size):
+                    if use_copy:
+                        use_copy = self._copy_chunk(cursor, copy_query, copy_format, fields, chunk)
+                    if not use_copy:
+                        self._insert_chunk(cursor, fields, chunk)
+                    inserted_rows += len(chunk)
             except KeyError as e:
-                logger.error(f"trying to insert with invalid key")
+                logger.error(f"trying to insert with invalid key {e}, {inserted_rows} rows were inserted before it")
+
+        self._after_write("insert")
+        elapsed = time.perf_counter() - started
+        rows_per_second = inserted_rows / elapsed if elapsed else float(inserted_rows)
+        logger.info(f"inserted {inserted_rows} rows into {self.model_class_name} in {elapsed:.3f}s "
+                    f"({rows_per_second:.0f} rows/s)")
+        return inserted_rows
+
+    def bulk_update(self, rows, key_column: str, chunk_size: int = 1000, use_copy: bool = False) -> dict:
+        """
+        apply different changes to many rows at once, everything runs in a single transaction.
+
+        every chunk is one `UPDATE ... FROM (VALUES ...)` statement joined on key_column. with `use_copy`
+        all rows are first copied into a temporary table and the table is updated with one statement,
+        which is faster for very large syncs. if a key appears more than once only one of its changes is applied.
+
+        args:
+        - `rows`: list, generator or DataFrame of dicts, each has key_column and the columns to change.
+        columns are taken from the first row.
+        - `key_column`: column identifying the row to update, usually the primary key.
+        - `chunk_size`: number of rows per statement (or per COPY with `use_copy`).
+
+        returns:
+        - dict with affected_rows, chunks and elapsed seconds
+        """
+        fields, row_tuples = bulk_load.prepare_rows(self.model_fields, rows)
+        if not fields:
+            return {"affected_rows": 0, "chunks": 0, "elapsed": 0.0}
+        if key_column not in fields:
+            raise ValueError(f"rows should contain key column {key_column}")
+
+        set_columns = [field for field in fields if field != key_column]
+        if not set_columns:
+            logger.warning(f"rows for bulk update of {self.model_class_name} have only {key_column}, nothing to update")
+            return {"affected_rows": 0, "chunks": 0, "elapsed": 0.0}
+        updated_keys = []  # keys of the chunks sent so far, for _after_write
+        key_index = fields.index(key_column)
+        set_values = ", ".join(f"{field} = source.{field}" for field in set_columns)
+        join_condition = f"target.{key_column} = source.{key_column}"
+
+        affected_rows = chunks = 0
+        started = time.perf_counter()
+        with self.transaction() as connection, connection.cursor() as cursor:
+            if use_copy:
+                temp_table = f"{self.model_class_name}_bulk_update_{uuid.uuid4().hex[:8]}".lower()
+                cursor.execute(f"CREATE TEMP TABLE {temp_table} ON COMMIT DROP AS "
+                               f"SELECT {', '.join(fields)} FROM {self.model_class_name} WITH NO DATA")
+                for chunk in bulk_load.iter_chunks(row_tuples, chunk_size):
+                    cursor.copy_expert(f"COPY {temp_table} ({', '.join(fields)}) FROM STDIN",
+                                       bulk_load.format_text_copy(chunk))
+                    updated_keys.extend(row[key_index] for row in chunk)
+                    chunks += 1
+                cursor.execute(f"UPDATE {self.model_class_name} AS target SET {set_values} "
+                               f"FROM {temp_table} AS source WHERE {join_condition}")
+                affected_rows = cursor.rowcount
+            else:
+                # values in VALUES lists have no type of their own, cast them to the column types
+                template = "(" + ", ".join(f"%s::{self._sql_type(field)}" if field in self.model_fields else "%s"
+                                           for field in fields) + ")"
+                query = (f"UPDATE {self.model_class_name} AS target SET {set_values} "
+                         f"FROM (VALUES %s) AS source ({', '.join(fields)}) WHERE {join_condition}")
+                for chunk in bulk_load.iter_chunks(row_tuples, chunk_size):
+                    execute_values(cursor, query, chunk, template=template, page_size=len(chunk))
+                    updated_keys.extend(row[key_index] for row in chunk)
+                    affected_rows += cursor.rowcount
+                    chunks += 1
+
+        self._after_write("update", key_column, updated_keys)
+        return self._bulk_result("updated", affected_rows, chunks, started)
+
+    def upsert(self, rows, conflict_columns, update_columns=None, chunk_size: int = 1000) -> dict:
+        """
+        insert rows, rows that clash with existing ones on conflict_columns are updated instead
+        (INSERT ... ON CONFLICT DO UPDATE). all chunks run in a single transaction.
+
+        conflict_columns need a unique index or constraint, and a key can appear only once per chunk.
+
+        args:
+        - `rows`: list, generator or DataFrame of dicts, columns are taken from the first row.
+        - `conflict_columns`: column name or list of column names of the unique constraint.
+        - `update_columns`: columns overwritten on conflict, by default all non conflict columns,
+        DO NOTHING when there is none (empty list, or rows with only conflict columns).
+        - `chunk_size`: number of rows per statement.
+
+        returns:
+        - dict with affected_rows (inserted + updated), chunks and elapsed seconds
+        """
+        if isinstance(conflict_columns, str):
+            conflict_columns = [conflict_columns]
+
+        fields, row_tuples = bulk_load.prepare_rows(self.model_fields, rows)
+        if not fields:
+            return {"affected_rows": 0, "chunks": 0, "elapsed": 0.0}
+
+        if update_columns is None:
+            update_columns = fields
+        update_columns = [column for column in update_columns if column not in conflict_columns]
+        if update_columns:
+            set_values = ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+            conflict_action = f"DO UPDATE SET {set_values}"
+        else:
+            conflict_action = "DO NOTHING"
+
+        query = (f"INSERT INTO {self.model_class_name} ({', '.join(fields)}) VALUES %s "
+                 f"ON CONFLICT ({', '.join(conflict_columns)}) {conflict_action}")
+
+        affected_rows = chunks = 0
+        started = time.perf_counter()
+        with self.transaction() as connection, connection.cursor() as cursor:
+            for chunk in bulk_load.iter_chunks(row_tuples, chunk_size):
+                execute_values(cursor, query, chunk, page_size=len(chunk))
+                affected_rows += cursor.rowcount
+                chunks += 1
+
+        self._after_write("upsert")
+        return self._bulk_result("upserted", affected_rows, chunks, started)
 
     def update(self, new_data: dict, identifier_column_name, identifier_value):
         """
@@ -92,8 +360,8 @@ class BaseManager(BaseConnectorManager):
             values_to_update = list(new_data.values())
             values_to_update.append(identifier_value)
 
-            cursor.execute(query, values_to_update)
-            self.connection.commit()
+            self._execute(cursor, ("update", tuple(new_data), identifier_column_name), lambda: query, values_to_update)
+        self._after_write("update", identifier_column_name, [identifier_value])
 
     def delete(self, identifier_column_name, column_value):
         """
@@ -106,32 +374,156 @@ class BaseManager(BaseConnectorManager):
         query = f"DELETE FROM {self.model_class_name} WHERE {identifier_column_name} = %s"
 
         with self._get_cursor() as cursor:
-            cursor.execute(query, (column_value,))
-            self.connection.commit()
+            self._execute(cursor, ("delete", identifier_column_name), lambda: query, (column_value,))
+        self._after_write("delete", identifier_column_name, [column_value])
+
+    def delete_many(self, identifier_column_name, column_values) -> int:
+        """
+        delete every row whose column has one of the given values, in one statement.
+
+        args
+        identifier_column_name: column name to identify rows with
+        column_values: list of values, rows matching any of them are deleted
+
+        returns number of deleted rows
+        """
+        query = f"DELETE FROM {self.model_class_name} WHERE {identifier_column_name} = ANY(%s)"
+
+        with self._get_cursor() as cursor:
+            self._execute(cursor, ("delete_many", identifier_column_name), lambda: query, (list(column_values),))
+            deleted_rows = cursor.rowcount
+        self._after_write("delete", identifier_column_name, list(column_values))
+        return deleted_rows
+
+    @contextmanager
+    def transaction(self):
+        """
+        run the operations inside the block in one transaction, committed when the block ends
+        and rolled back if it raises.
+
+        nested blocks become savepoints, so an inner failure can be caught without losing the outer work.
+        pooled managers sharing the pool join the same transaction in this thread,
+        managers with their own connection have to share it (see share_connection).
 
-    def export_data_as_csv(self, path_to_csv_file):
+        yields:
+        - the connection running the transaction
+        """
+        with self.borrow_connection() as connection:
+            if not connection.autocommit:
+                savepoint = f"dattyorm_savepoint_{uuid.uuid4().hex[:8]}"
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SAVEPOINT {savepoint}")
+                try:
+                    yield connection
+                except Exception:
+                    with connection.cursor() as cursor:
+                        # ROLLBACK TO keeps the savepoint, release it so failed blocks don't pile up
+                        cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                        cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+                    raise
+                with connection.cursor() as cursor:
+                    cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+                return
+
+            connection.autocommit = False
+            committed = False
+            try:
+                yield connection
+                connection.commit()
+                committed = True
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                connection.autocommit = True
+                for callback in _transaction_callbacks.pop(connection, []):
+                    try:
+                        callback(committed)
+                    except Exception as e:
+                        logger.error(f"callback after transaction failed: {e}")
+
+    def on_transaction_end(self, callback) -> bool:
+        """
+        call `callback(committed)` once the transaction() open on the manager's connection in this thread
+        has committed or rolled back. savepoints don't count, only the outermost block.
+
+        returns:
+        - False without registering the callback if no transaction is open, changes are already committed
+        """
+        connection = self._transaction_connection()
+        if connection is None:
+            return False
+        _transaction_callbacks.setdefault(connection, []).append(callback)
+        return True
+
+    def _transaction_connection(self):
+        """connection of the transaction() open in this thread, None when statements run in autocommit"""
+        connection = self.pool.pinned_connection() if self.pool is not None else self.connection
+        if connection is None or connection.autocommit:
+            return None
+        return connection
+
+    def export_data_as_csv(self, path_to_csv_file, compression=None, progress=None, progress_every: int = 10000):
         """
         export all the data from table to a csv file
 
+        data is streamed with COPY ... TO STDOUT straight into the file, nothing is kept in memory.
+
         args
         path_to_csv_file: absolute or relative path to the csv file
-        """
-        df = self._get_data_for_export()
-        # export the current dataframe to csv file
-        df.to_csv(path_to_csv_file, index=False)
-        logger.info(f"Data exported to {path_to_csv_file} successfully.")
+        compression: None, "gzip" or "zstd", guessed from .gz / .zst suffix if not given
+        progress: function called with the number of rows written every `progress_every` rows
 
-    def export_data_as_json(self, path_to_json_file):
+        returns number of rows exported
+        """
+        query = f"COPY (SELECT * FROM {self.model_class_name}) TO STDOUT WITH (FORMAT csv, HEADER)"
+        compression = export_utils.infer_compression(path_to_csv_file, compression)
+
+        with export_utils.open_export_file(path_to_csv_file, compression) as file:
+            writer = export_utils.CopyProgressWriter(file, progress, every=progress_every)
+            with self._get_cursor() as cursor:
+                cursor.copy_expert(query, writer)
+                rows_exported = cursor.rowcount
+
+        if progress is not None:
+            progress(rows_exported)
+        logger.info(f"{rows_exported} rows exported to {path_to_csv_file} successfully.")
+        return rows_exported
+
+    def export_data_as_json(self, path_to_json_file, lines: bool = False, chunk_size: int = 10000,
+                            compression=None, progress=None, indent=4):
         """
         export all the data from table to a json file
 
+        rows are read through a server side cursor `chunk_size` at a time and written as they arrive,
+        peak memory depends on chunk size, not on the table size.
+
         args
-        path_to_csv_file: absolute or relative path to the json file
+        path_to_json_file: absolute or relative path to the json file
+        lines: write NDJSON, one record per line, instead of a json array
+        chunk_size: number of rows fetched and written at once
+        compression: None, "gzip" or "zstd", guessed from .gz / .zst suffix if not given
+        progress: function called with the number of rows written after every chunk
+        indent: indent of the records inside the json array
+
+        returns number of rows exported
         """
-        df = self._get_data_for_export()
-
-        df.to_json(path_to_json_file, orient="records", indent=4)
-        logger.info(f"data successfully exported to {path_to_json_file}")
+        query = f"SELECT * FROM {self.model_class_name}"
+        compression = export_utils.infer_compression(path_to_json_file, compression)
+
+        with export_utils.open_export_file(path_to_json_file, compression) as file:
+            with self._server_side_cursor(query, itersize=chunk_size) as cursor:
+                first_chunk = cursor.fetchmany(chunk_size)
+                column_names = [desc[0] for desc in cursor.description]
+                chunks = chain([first_chunk] if first_chunk else [],
+                               iter(lambda: cursor.fetchmany(chunk_size), []))
+                rows_exported = export_utils.write_json_records(file, column_names, chunks, lines=lines,
+                                                                indent=indent, progress=progress)
+
+        if not rows_exported:
+            logger.info(f"no data in the table {self.model_class_name}")
+        logger.info(f"{rows_exported} rows successfully exported to {path_to_json_file}")
+        return rows_exported
 
     def add_column_to_table(self, column_name, column_class) -> None:
         if not isinstance(column_class, columns.Column):
@@ -141,25 +533,177 @@ class BaseManager(BaseConnectorManager):
 
         with self._get_cursor() as cursor:
             cursor.execute(query)
+        statement_cache.invalidate_all()
 
+    def add_index(self, index: Index, concurrently: bool = False) -> None:
+        """
+        create an index on existing table.
 
-    def _get_data_for_export(self) -> pd.DataFrame:
+        args:
+        - `index`: Index declaration, e.g. Index("last_name") or Index("tags", method="gin")
+        - `concurrently`: build without locking writes to the table, for live tables.
+        can't be used inside a transaction
         """
-        select all the data from table and return them as pandas Dataframe
+        with self.borrow_connection() as connection:
+            if concurrently and not connection.autocommit:
+                raise ValueError("CREATE INDEX CONCURRENTLY can't run inside a transaction")
+            with connection.cursor() as cursor:
+                cursor.execute(index.sql(self.model_class_name, concurrently=concurrently))
+        statement_cache.invalidate_all()
+        logger.info(f"index {index.index_name(self.model_class_name)} created on {self.model_class_name}")
+
+    def drop_index(self, index_name: str, concurrently: bool = False) -> None:
+        query = f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {index_name}"
+        with self._get_cursor() as cursor:
+            cursor.execute(query)
+        statement_cache.invalidate_all()
+
+    def create_partition(self, partition_name: str, **bounds) -> None:
         """
-        cursor = self._get_cursor()
-        cursor.execute(f"SELECT * FROM {self.model_class_name}")
-        rows = cursor.fetchall()
+        create a partition of a table declared with __partition_by__.
 
-        if not rows:
-            logger.info(f"no data in the table {self.model_class_name}")
+        RangePartition: create_partition("employee_2024", from_value="2024-01-01", to_value="2025-01-01")
+        HashPartition: create_partition("employee_p0", modulus=4, remainder=0)
+        """
+        partition_by = getattr(self.model_class, "__partition_by__", None)
+        if partition_by is None:
+            raise ValueError(f"model {self.model_class_name} is not partitioned, declare __partition_by__")
+
+        query, params = partition_by.partition_sql(self.model_class_name, partition_name, **bounds)
+        with self._get_cursor() as cursor:
+            cursor.execute(query, params)
+        statement_cache.invalidate_all()
+
+    def _copy_chunk(self, cursor, copy_query, copy_format, fields, chunk) -> bool:
+        """
+        stream one chunk to the table with COPY.
+
+        returns False when COPY can't be used for this data, so caller inserts the chunk with VALUES instead
+        """
+        try:
+            if copy_format == "binary":
+                encoders = bulk_load.binary_encoders(self.model_fields, fields)
+                buffer = bulk_load.format_binary_copy(chunk, encoders)
+            else:
+                buffer = bulk_load.format_text_copy(chunk)
+        except (TypeError, ValueError, struct.error) as e:
+            logger.warning(f"COPY not possible for {self.model_class_name}, falling back to VALUES: {e}")
+            return False
+
+        # inside a transaction a failed COPY would abort it, savepoint lets the fallback run
+        in_transaction = not cursor.connection.autocommit
+        if in_transaction:
+            cursor.execute("SAVEPOINT dattyorm_copy")
+        try:
+            cursor.copy_expert(copy_query, buffer)
+        except psycopg2.NotSupportedError as e:
+            if in_transaction:
+                cursor.execute("ROLLBACK TO SAVEPOINT dattyorm_copy")
+            logger.warning(f"COPY not possible for {self.model_class_name}, falling back to VALUES: {e}")
+            return False
+        if in_transaction:
+            cursor.execute("RELEASE SAVEPOINT dattyorm_copy")
+        return True
+
+    def _primary_key_column(self) -> str:
+        """name of the PrimaryKey column declared on the model"""
+        for field_name, column in self.model_fields.items():
+            if isinstance(column, columns.PrimaryKey):
+                return field_name
+        logger.error(f"model {self.model_class_name} has no primary key column")
+        raise ValueError(f"model {self.model_class_name} has no primary key column")
+
+    @contextmanager
+    def _server_side_cursor(self, query, itersize: int = 2000, params=None):
+        """
+        named cursor executing the query, rows are kept on the server and fetched `itersize` at a time.
+
+        a named cursor only lives inside a transaction. an open transaction() of this thread is used
+        as it is, it sees the changes made in it and is committed or rolled back by its owner.
+        otherwise the cursor gets a connection of its own and a transaction that is rolled back at the end,
+        other operations of this thread (e.g. updates while iterating) keep running in autocommit.
+        """
+        cursor_name = f"{self.model_class_name}_iter_{uuid.uuid4().hex}".lower()
+        with self._streaming_connection() as (connection, own_transaction):
+            if own_transaction:
+                connection.autocommit = False
+            try:
+                with connection.cursor(name=cursor_name) as cursor:
+                    cursor.itersize = itersize
+                    cursor.execute(query, params)
+                    yield cursor
+            finally:
+                if own_transaction and not connection.closed:
+                    connection.rollback()
+                    connection.autocommit = True
+
+    @contextmanager
+    def _streaming_connection(self):
+        """
+        yields (connection, own transaction) for a named cursor, the open transaction of this thread
+        with False, or a connection no other operation uses with True
+        """
+        transaction_connection = self._transaction_connection()
+        if transaction_connection is not None:
+            yield transaction_connection, False
+            return
+        if self.pool is not None:
+            with self.pool.connection(pin=False) as connection:
+                yield connection, True
             return
 
-        # Get column names from the cursor description
-        columns = [desc[0] for desc in cursor.description]
+        if self.database_settings is None:
+            raise ValueError("streaming needs database settings to open its own connection, "
+                             "connect with set_connection or run it inside transaction()")
+        connection = connect(self.database_settings)
+        try:
+            yield connection, True
+        finally:
+            connection.close()
 
-        # Convert rows to a DataFrame using pandas
-        df = pd.DataFrame(rows, columns=columns)
+    def _after_write(self, operation: str, key_column=None, key_values=None) -> None:
+        """
+        called after every write with the operation (insert, update, upsert, delete) and, when known,
+        the column and values identifying the changed rows. does nothing here, caching managers
+        use it to invalidate what they have cached
+        """
 
-        return df
+    def _execute(self, cursor, key: tuple, build_query, params=(), cacheable: bool = True) -> None:
+        """
+        execute the query built by build_query, through the statement cache if it is enabled.
+        key is the operation and column set, model name is added here
+        """
+        if self.statement_cache_options is None or not cacheable:
+            cursor.execute(build_query(), params)
+            return
+        cache = statement_cache.cache_for(cursor.connection, **self.statement_cache_options)
+        cache.execute(cursor, (self.model_class_name, *key), build_query, params)
+
+    def _insert_chunk(self, cursor, fields: list, chunk: list) -> None:
+        """insert chunk of row tuples with multi-row INSERT ... VALUES"""
+        column_names = ", ".join(fields)
+        if self.statement_cache_options is None:
+            insert_query = f"INSERT INTO {self.model_class_name} ({column_names}) VALUES %s"
+            execute_values(cursor, insert_query, chunk, page_size=len(chunk))
+            return
 
+        # prepared statement has fixed number of rows, postgres allows at most 65535 parameters in it
+        row_template = f"({', '.join(['%s'] * len(fields))})"
+        rows_per_statement = max(1, min(len(chunk), MAX_STATEMENT_PARAMETERS // len(fields)))
+        for part in bulk_load.iter_chunks(chunk, rows_per_statement):
+            values = ", ".join([row_template] * len(part))
+            self._execute(cursor, ("insert", tuple(fields), len(part)),
+                          lambda: f"INSERT INTO {self.model_class_name} ({column_names}) VALUES {values}",
+                          [value for row in part for value in row])
+
+    def _sql_type(self, field_name: str) -> str:
+        """column type usable in casts, serial types are only valid in table definitions"""
+        column_type = self.model_fields[field_name].type
+        return {"BIGSERIAL": "BIGINT", "SERIAL": "INTEGER"}.get(column_type, column_type)
+
+    def _bulk_result(self, action: str, affected_rows: int, chunks: int, started: float) -> dict:
+        elapsed = time.perf_counter() - started
+        rows_per_second = affected_rows / elapsed if elapsed else float(affected_rows)
+        logger.info(f"{action} {affected_rows} rows of {self.model_class_name} in {chunks} chunks, "
+                    f"{elapsed:.3f}s ({rows_per_second:.0f} rows/s)")
+        return {"affected_rows": affected_rows, "chunks": chunks, "elapsed": elapsed}
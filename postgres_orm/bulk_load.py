@@ -0,0 +1,150 @@
+import io
+import struct
+import sys
+from datetime import date, datetime
+from itertools import chain, islice
+
+# COPY text format has to escape these, everything else can be written as is
+TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+TEXT_NULL = "\\N"
+
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+BINARY_TRAILER = struct.pack("!h", -1)
+POSTGRES_EPOCH_DATE = date(2000, 1, 1)
+POSTGRES_EPOCH_DATETIME = datetime(2000, 1, 1)
+
+
+def infer_column_order(model_fields: dict, row_columns) -> list:
+    """
+    order the columns of the incoming rows the same way they are declared on the model.
+    columns that the model does not know about (added with add_column_to_table) go to the end.
+
+    args:
+    - `model_fields`: fields of the model class, {column name: column instance}
+    - `row_columns`: column names found in the first row or in the dataframe
+    """
+    row_columns = list(row_columns)
+    ordered = [field for field in model_fields if field in row_columns]
+    return ordered + [column for column in row_columns if column not in model_fields]
+
+
+def peek_rows(rows):
+    """
+    returns the first row and an iterator that still yields every row, works for lists and generators.
+    first row is None if there is nothing to insert
+    """
+    iterator = iter(rows)
+    first_row = next(iterator, None)
+    if first_row is None:
+        return None, iterator
+    return first_row, chain([first_row], iterator)
+
+
+def prepare_rows(model_fields: dict, rows):
+    """
+    works out the column order from the model fields and returns it with an iterator of row tuples.
+    accepts list of dicts, generator of dicts or a pandas DataFrame, nothing is materialized here.
+    missing keys in later rows raise KeyError while iterating.
+    """
+    # pandas is not imported for this check, if it was never imported rows can't be a DataFrame
+    pd = sys.modules.get("pandas")
+    if pd is not None and isinstance(rows, pd.DataFrame):
+        if rows.empty:
+            return [], iter(())
+        fields = infer_column_order(model_fields, rows.columns)
+        # NaN and NaT become NULL in the database
+        row_tuples = (tuple(None if pd.isna(value) else value for value in row)
+                      for row in rows[fields].itertuples(index=False, name=None))
+        return fields, row_tuples
+
+    first_row, rows = peek_rows(rows)
+    if first_row is None:
+        return [], iter(())
+
+    fields = infer_column_order(model_fields, first_row.keys())  # row headers
+    return fields, (tuple(row[field] for field in fields) for row in rows)
+
+
+def iter_chunks(row_tuples, chunk_size: int):
+    """split an iterable of row tuples into lists of chunk_size rows"""
+    iterator = iter(row_tuples)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _text_value(value) -> str:
+    if value is None:
+        return TEXT_NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value).translate(TEXT_ESCAPES)
+
+
+def format_text_copy(chunk: list) -> io.StringIO:
+    """turn a chunk of row tuples into a buffer in COPY text format"""
+    buffer = io.StringIO()
+    for row in chunk:
+        buffer.write("\t".join(_text_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def _binary_encoder(column_type: str):
+    """
+    returns function that turns python value into COPY binary field for given sql type.
+    raises TypeError for types that don't have binary encoding here, caller falls back to other path
+    """
+    column_type = column_type.upper()
+    if column_type in ("BIGSERIAL", "BIGINT"):
+        return lambda value: struct.pack("!q", int(value))
+    if column_type in ("SERIAL", "INTEGER"):
+        return lambda value: struct.pack("!i", int(value))
+    if column_type in ("FLOAT", "DOUBLE", "DOUBLE PRECISION"):
+        return lambda value: struct.pack("!d", float(value))
+    if column_type == "BOOLEAN":
+        return lambda value: struct.pack("!?", bool(value))
+    if column_type == "TEXT" or column_type.startswith("VARCHAR"):
+        return lambda value: str(value).encode("utf-8")
+    if column_type == "DATE":
+        return lambda value: struct.pack("!i", (value - POSTGRES_EPOCH_DATE).days)
+    if column_type in ("DATETIME", "TIMESTAMP"):
+        def encode_timestamp(value):
+            delta = value - POSTGRES_EPOCH_DATETIME
+            return struct.pack("!q", (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+        return encode_timestamp
+    raise TypeError(f"no binary COPY encoding for column type {column_type}")
+
+
+def binary_encoders(model_fields: dict, columns: list) -> list:
+    """one encoder per column, raises TypeError if any column can't be encoded in binary format"""
+    encoders = []
+    for column in columns:
+        if column not in model_fields:
+            raise TypeError(f"column {column} is not declared on the model, its type is unknown")
+        encoders.append(_binary_encoder(model_fields[column].type))
+    return encoders
+
+
+def format_binary_copy(chunk: list, encoders: list) -> io.BytesIO:
+    """turn a chunk of row tuples into a buffer in COPY binary format"""
+    buffer = io.BytesIO()
+    buffer.write(BINARY_HEADER)
+    field_count = struct.pack("!h", len(encoders))
+    for row in chunk:
+        buffer.write(field_count)
+        for encode, value in zip(encoders, row):
+            if value is None:
+                buffer.write(struct.pack("!i", -1))
+                continue
+            data = encode(value)
+            buffer.write(struct.pack("!i", len(data)))
+            buffer.write(data)
+    buffer.write(BINARY_TRAILER)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,369 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from .base_database_manager import BaseManager
+
+logger = logging.getLogger(__name__)
+
+WRITE_POLICIES = ("invalidate", "write_through")
+
+# sets the entry only if the guard key (row version or query generation) still has the value read before
+# loading, a reader that loaded before a write can't put the old value back after the write invalidated it
+STORE_SCRIPT = """
+if (tonumber(redis.call('GET', KEYS[2])) or 0) ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class LocalCache:
+    """thread safe in-process LRU with per entry ttl, the tier in front of redis"""
+    def __init__(self, max_size: int = 1024, ttl: float = 5) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """returns (found, value)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value) -> None:
+        if not self.max_size:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self, kind=None) -> None:
+        """remove everything, or only the entries whose key starts with kind ("row" or "query")"""
+        with self._lock:
+            if kind is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == kind]:
+                del self._entries[key]
+
+
+class CacheMetrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "coalesced": 0,
+                         "invalidations": 0, "load_seconds_total": 0.0, "load_seconds_max": 0.0}
+
+    def increment(self, counter: str, amount=1) -> None:
+        with self._lock:
+            self.counters[counter] += amount
+
+    def record_load(self, seconds: float, misses: int = 1) -> None:
+        with self._lock:
+            self.counters["misses"] += misses
+            self.counters["load_seconds_total"] += seconds
+            self.counters["load_seconds_max"] = max(self.counters["load_seconds_max"], seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_ratio"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["load_seconds_avg"] = stats["load_seconds_total"] / stats["misses"] if stats["misses"] else 0.0
+        return stats
+
+
+class CachedManager(BaseManager):
+    """
+    BaseManager with a read-through cache: rows read by primary key (get, get_many) and query
+    results (cached_query) are served from an in-process LRU, then from redis, and only then from postgres.
+
+    every write of this manager invalidates what it could have changed. rows changed by primary key are
+    dropped from the cache or, with write_policy="write_through", reloaded into it, and their version
+    counter is bumped, a reader that loaded the row before the write then can't store it anymore.
+    other writes bump a generation counter in redis, which makes every older entry of the model stale in one step.
+    other processes see the change right away in redis, their local tier can lag up to local_ttl seconds.
+
+    inside a transaction reads go straight to postgres and nothing is cached, the rows may not be committed.
+    writes invalidate right away and once more when the transaction ends, write through waits for the commit.
+
+    concurrent misses of the same key are coalesced, only one of them goes to postgres.
+
+    values go through the redis_orm codec, json codecs can't encode dates and decimals, rows with them
+    are then only kept in the local tier. use RedisORM(codec="pickle") to cache them in redis too.
+    """
+    def __init__(self, model_class_instance, redis_orm, ttl: int = 300, local_size: int = 1024,
+                 local_ttl: float = 5, write_policy: str = "invalidate", key_prefix: str = "dattyorm") -> None:
+        super().__init__(model_class_instance)
+        if write_policy not in WRITE_POLICIES:
+            raise ValueError(f"write policy should be one of {WRITE_POLICIES}, got {write_policy}")
+        self.redis_orm = redis_orm
+        self.ttl = ttl
+        self.write_policy = write_policy
+        self.key_prefix = f"{key_prefix}:{self.model_class_name}"
+        self.local_cache = LocalCache(local_size, local_ttl)
+        self.metrics = CacheMetrics()
+        self._inflight = {}  # key -> event of the load in progress
+        self._inflight_lock = threading.Lock()
+        self._store_if_current = self.redis_client.register_script(STORE_SCRIPT)
+
+    @property
+    def redis_client(self):
+        return self.redis_orm.redis_client
+
+    def cache_stats(self) -> dict:
+        """hits per tier, misses, coalesced waits, invalidations and postgres load latency"""
+        return self.metrics.snapshot()
+
+    def get(self, key_value):
+        """row with the given primary key as dict column -> value, or None if it does not exist"""
+        return self._read_through(("row", key_value), lambda: self._load_row(key_value))
+
+    def get_many(self, key_values) -> dict:
+        """primary key -> row for every key that exists, rows missing from the local tier are read
+        from redis with one MGET, the ones missing there too from postgres with one query"""
+        key_values = list(dict.fromkeys(key_values))
+        if self._transaction_connection() is not None:
+            rows = self._load_rows(key_values)
+            return {key_value: rows[key_value] for key_value in key_values if key_value in rows}
+
+        rows = {}
+        misses = []
+        for key_value in key_values:
+            found, row = self.local_cache.get(("row", key_value))
+            if found:
+                self.metrics.increment("local_hits")
+                rows[key_value] = row
+            else:
+                misses.append(key_value)
+
+        if misses:
+            cache_keys = [("row", key_value) for key_value in misses]
+            generation, *values = self.redis_client.mget(self._generation_key("row"),
+                                                         *[self._redis_key(cache_key) for cache_key in cache_keys],
+                                                         *[self._guard_key(cache_key) for cache_key in cache_keys])
+            generation = int(generation or 0)
+            guards = {}  # key -> row version read before loading
+            for key_value, serialized_entry, guard in zip(misses, values[:len(misses)], values[len(misses):]):
+                entry = self.redis_orm._deserialize_data(serialized_entry)
+                if entry is not None and entry["generation"] == generation:
+                    self.metrics.increment("redis_hits")
+                    self.local_cache.set(("row", key_value), entry["data"])
+                    rows[key_value] = entry["data"]
+                else:
+                    guards[key_value] = int(guard or 0)
+            if guards:
+                started = time.perf_counter()
+                rows.update(self._load_rows_into_cache(guards, generation))
+                self.metrics.record_load(time.perf_counter() - started, len(guards))
+
+        return {key_value: rows[key_value] for key_value in key_values if rows.get(key_value) is not None}
+
+    def cached_query(self, query, ttl: int = None) -> list:
+        """
+        result of query.all() served from the cache, any write to the model invalidates it.
+
+        args:
+        - `query`: Query built from this manager, e.g. manager.filter(grade="XII").order_by("id")
+        - `ttl`: seconds to keep the result in redis, manager ttl by default
+        """
+        sql, params = query.sql()
+        digest = hashlib.sha1(repr((sql, params)).encode("utf-8")).hexdigest()
+        rows = self._read_through(("query", digest), query.all, ttl=ttl)
+        return [tuple(row) for row in rows]
+
+    def _redis_key(self, cache_key) -> str:
+        kind, identifier = cache_key
+        return f"{self.key_prefix}:{kind}:{identifier}"
+
+    def _generation_key(self, kind: str) -> str:
+        return f"{self.key_prefix}:{kind}:generation"
+
+    def _guard_key(self, cache_key) -> str:
+        """key that has to keep its value between reading the entry and storing a loaded one,
+        the version of the row for rows and the generation for query results"""
+        if cache_key[0] == "row":
+            return f"{self._redis_key(cache_key)}:version"
+        return self._generation_key(cache_key[0])
+
+    def _read_through(self, cache_key, load, ttl: int = None):
+        if self._transaction_connection() is not None:
+            return load()  # sees uncommitted changes of the transaction, they must not reach the cache
+
+        found, value = self.local_cache.get(cache_key)
+        if found:
+            self.metrics.increment("local_hits")
+            return value
+
+        # generation, entry and guard in one round trip, entries from older generations are stale
+        generation, serialized_entry, guard = self.redis_client.mget(self._generation_key(cache_key[0]),
+                                                                     self._redis_key(cache_key),
+                                                                     self._guard_key(cache_key))
+        generation = int(generation or 0)
+        entry = self.redis_orm._deserialize_data(serialized_entry)
+        if entry is not None and entry["generation"] == generation:
+            self.metrics.increment("redis_hits")
+            self.local_cache.set(cache_key, entry["data"])
+            return entry["data"]
+
+        return self._load_once(cache_key, load, generation, int(guard or 0), ttl)
+
+    def _load_once(self, cache_key, load, generation: int, guard: int, ttl: int = None):
+        """single flight, the first caller loads from postgres, the others wait for its result"""
+        with self._inflight_lock:
+            inflight = self._inflight.get(cache_key)
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight[cache_key] = {"event": threading.Event(), "value": None, "error": None}
+
+        if not leader:
+            self.metrics.increment("coalesced")
+            inflight["event"].wait()
+            if inflight["error"] is not None:
+                raise inflight["error"]
+            return inflight["value"]
+
+        try:
+            started = time.perf_counter()
+            data = load()
+            self.metrics.record_load(time.perf_counter() - started)
+            value, = self._store_many([(cache_key, data, generation, guard)], ttl)
+            inflight["value"] = value
+            return value
+        except Exception as e:
+            inflight["error"] = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[cache_key]
+            inflight["event"].set()
+
+    def _store_many(self, entries, ttl: int = None) -> list:
+        """
+        put loaded data into redis and local tier, entries are (cache key, data, generation, guard) tuples.
+        an entry is only stored if its guard key still has the value read before loading, otherwise
+        a write happened in between and the data may be old.
+
+        returns the data of every entry the way it comes back from the cache, so hits and misses look
+        the same. missing rows are not cached, an insert would not invalidate them
+        """
+        values = [None] * len(entries)
+        pending = []  # (position, cache key, serialized entry, guard)
+        for position, (cache_key, data, generation, guard) in enumerate(entries):
+            if data is None:
+                continue
+            try:
+                serialized_entry = self.redis_orm._serialize_data({"generation": generation, "data": data})
+            except (TypeError, ValueError) as e:
+                logger.error(f"can't cache {cache_key} in redis with {self.redis_orm.serializer.codec.name} codec: {e}")
+                self.local_cache.set(cache_key, data)
+                values[position] = data
+                continue
+            values[position] = self.redis_orm._deserialize_data(serialized_entry)["data"]
+            pending.append((position, cache_key, serialized_entry, guard))
+        if not pending:
+            return values
+
+        with self.redis_client.pipeline(transaction=False) as pipeline:
+            for _, cache_key, serialized_entry, guard in pending:
+                self._store_if_current(keys=[self._redis_key(cache_key), self._guard_key(cache_key)],
+                                       args=[guard, serialized_entry, ttl or self.ttl], client=pipeline)
+            stored = pipeline.execute()
+        for (position, cache_key, _, _), was_stored in zip(pending, stored):
+            if was_stored:
+                self.local_cache.set(cache_key, values[position])
+        return values
+
+    def _load_rows_into_cache(self, guards: dict, generation: int) -> dict:
+        """load rows of primary key -> guard with one query and store them, returns primary key -> row"""
+        rows = self._load_rows(list(guards))
+        values = self._store_many([(("row", key_value), rows.get(key_value), generation, guard)
+                                   for key_value, guard in guards.items()])
+        return {key_value: value for key_value, value in zip(guards, values) if value is not None}
+
+    def _load_row(self, key_value):
+        key_column = self._primary_key_column()
+        with self._get_cursor() as cursor:
+            cursor.execute(f"SELECT * FROM {self.model_class_name} WHERE {key_column} = %s", (key_value,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([desc[0] for desc in cursor.description], row))
+
+    def _load_rows(self, key_values) -> dict:
+        """primary key -> row for the given keys that exist, one query"""
+        key_column = self._primary_key_column()
+        with self._get_cursor() as cursor:
+            cursor.execute(f"SELECT * FROM {self.model_class_name} WHERE {key_column} = ANY(%s)", (key_values,))
+            names = [desc[0] for desc in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        return {row[key_column]: row for row in rows}
+
+    def _bump_generation(self, kind: str) -> None:
+        self.redis_client.incr(self._generation_key(kind))
+        self.local_cache.clear(kind)
+        self.metrics.increment("invalidations")
+
+    def _after_write(self, operation: str, key_column=None, key_values=None) -> None:
+        cache_keys = self._invalidate(operation, key_column, key_values)
+        # other readers can cache the old rows again until the transaction commits, so they are invalidated
+        # once more when it ends. uncommitted rows must not be written through, that waits for the commit
+        registered = self.on_transaction_end(
+            lambda committed: self._invalidated_after_transaction(committed, operation, key_column, key_values))
+        if not registered:
+            self._write_through(operation, cache_keys)
+
+    def _invalidated_after_transaction(self, committed: bool, operation: str, key_column, key_values) -> None:
+        cache_keys = self._invalidate(operation, key_column, key_values)
+        if committed:
+            self._write_through(operation, cache_keys)
+
+    def _invalidate(self, operation: str, key_column=None, key_values=None) -> list:
+        """drop what the write could have changed, returns the row cache keys it dropped one by one"""
+        self._bump_generation("query")  # any write can change any query result
+        if operation == "insert":
+            return []  # new rows were not cached, missing rows never are
+
+        if key_column is None or key_values is None or key_column != self._primary_key_column():
+            self._bump_generation("row")
+            return []
+
+        cache_keys = [("row", key_value) for key_value in dict.fromkeys(key_values)]
+        if not cache_keys:
+            return []
+        # entry removed and version bumped together, loads that started before can't be stored anymore
+        with self.redis_client.pipeline(transaction=True) as pipeline:
+            for cache_key in cache_keys:
+                pipeline.unlink(self._redis_key(cache_key))
+                pipeline.incr(self._guard_key(cache_key))
+                pipeline.expire(self._guard_key(cache_key), self.ttl)
+            pipeline.execute()
+        for cache_key in cache_keys:
+            self.local_cache.delete(cache_key)
+        self.metrics.increment("invalidations", len(cache_keys))
+        return cache_keys
+
+    def _write_through(self, operation: str, cache_keys: list) -> None:
+        """reload updated rows into the cache, with write_policy="write_through" """
+        if self.write_policy != "write_through" or operation != "update" or not cache_keys:
+            return
+        generation, *guards = self.redis_client.mget(self._generation_key("row"),
+                                                     *[self._guard_key(cache_key) for cache_key in cache_keys])
+        self._load_rows_into_cache({identifier: int(guard or 0) for (_, identifier), guard
+                                    in zip(cache_keys, guards)}, int(generation or 0))
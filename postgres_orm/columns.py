@@ -30,6 +30,22 @@ class PrimaryKey(Column):
         return f'{self.type} {constraints}'
 
 
+class ForeignKey(Column):
+    def __init__(self, references: str, column: str = "id", on_delete: str = None,
+                 unique: bool = False, nullable: bool = True) -> None:
+        super().__init__(unique, nullable, default=None)
+        self.type = 'BIGINT'  # same as BIGSERIAL primary keys it usually points to
+        self.references = references  # name of the referenced table (model class name)
+        self.column = column
+        self.on_delete = on_delete  # CASCADE, SET NULL, RESTRICT...
+
+    def __repr__(self):
+        constraints = f'REFERENCES {self.references}({self.column})'
+        if self.on_delete:
+            constraints += f' ON DELETE {self.on_delete}'
+        return f'{super().__repr__().strip()} {constraints}'
+
+
 class Integer(Column):
     def __init__(self, unique: bool = False,
                  nullable: bool = True, default: int = None) -> None:
@@ -0,0 +1,257 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from utils.instrumentation import instrumentation
+from .instrumented_cursor import connect
+
+logger = logging.getLogger(__name__)
+
+# pools are shared between all managers that connect with the same settings
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    """raised when no connection became free within checkout_timeout"""
+
+
+class ConnectionPool:
+    """
+    thread safe pool of psycopg2 connections.
+
+    connections are created lazily up to `max_size`, `min_size` of them are kept open even when idle.
+    on checkout connections that are closed, too old or idle for too long are replaced and,
+    if `health_check` is on, a `SELECT 1` makes sure the server is still there.
+
+    a thread that already holds a connection (inside `connection()` block) gets the same one back,
+    so several managers can run in one transaction on one connection.
+    """
+    def __init__(self, database_settings: dict, min_size: int = 1, max_size: int = 10,
+                 idle_timeout: float = 300, max_lifetime: float = 3600,
+                 checkout_timeout: float = 30, health_check: bool = True) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"invalid pool size min={min_size} max={max_size}")
+
+        self.database_settings = database_settings
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+
+        self._condition = threading.Condition()
+        self._idle = []  # (connection, returned_at), most recently returned last
+        self._created_at = {}  # id(connection) -> creation time
+        self._in_use = 0
+        self._local = threading.local()
+        self._closed = False
+        self._stats = {"created": 0, "discarded": 0, "checkouts": 0, "timeouts": 0,
+                       "wait_time_total": 0.0, "wait_time_max": 0.0}
+
+        for _ in range(min_size):
+            connection = self._create_connection()
+            self._idle.append((connection, time.monotonic()))
+
+    def _create_connection(self):
+        connection = connect(self.database_settings)
+        self._created_at[id(connection)] = time.monotonic()
+        self._stats["created"] += 1
+        return connection
+
+    def _discard(self, connection) -> None:
+        self._created_at.pop(id(connection), None)
+        self._stats["discarded"] += 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_expired(self, connection, returned_at: float, now: float) -> bool:
+        if connection.closed:
+            return True
+        if self.max_lifetime and now - self._created_at.get(id(connection), now) > self.max_lifetime:
+            return True
+        # idle connections above min_size are dropped after idle_timeout
+        size = len(self._idle) + self._in_use
+        return bool(self.idle_timeout) and size > self.min_size and now - returned_at > self.idle_timeout
+
+    def _is_healthy(self, connection) -> bool:
+        if connection.closed or connection.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if not self.health_check:
+            return True
+        try:
+            # plain cursor, health checks are not reported to instrumentation
+            with connection.cursor(cursor_factory=extensions.cursor) as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """
+        borrow a connection, waits up to checkout_timeout for one to be returned if the pool is full.
+        every connection taken with getconn has to be given back with putconn
+        """
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        while True:
+            connection = self._reserve(deadline)
+            if connection is None:
+                # free slot reserved, connecting happens outside the lock
+                try:
+                    connection = connect(self.database_settings)
+                except psycopg2.Error:
+                    with self._condition:
+                        self._in_use -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._created_at[id(connection)] = time.monotonic()
+                    self._stats["created"] += 1
+                break
+            if self._is_healthy(connection):
+                break
+            logger.debug("discarding broken pooled connection")
+            with self._condition:
+                self._in_use -= 1
+                self._discard(connection)
+                self._condition.notify()
+
+        wait_time = time.monotonic() - started
+        with self._condition:
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += wait_time
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+        self._local.last_wait_time = wait_time
+        instrumentation.connection_waited(wait_time)
+        return connection
+
+    def _reserve(self, deadline: float):
+        """
+        takes a slot in the pool, returns an idle connection or None if a new one should be opened.
+        expired idle connections are closed on the way
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("pool is closed")
+
+                now = time.monotonic()
+                while self._idle:
+                    connection, returned_at = self._idle.pop()
+                    if self._is_expired(connection, returned_at, now):
+                        self._discard(connection)
+                        continue
+                    self._in_use += 1
+                    return connection
+
+                if self._in_use < self.max_size:
+                    self._in_use += 1
+                    return None
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"no free connection after {self.checkout_timeout}s "
+                                      f"(max_size={self.max_size})")
+                self._condition.wait(remaining)
+
+    def putconn(self, connection, discard: bool = False) -> None:
+        """give a borrowed connection back, unfinished transactions are rolled back"""
+        if not discard and not connection.closed:
+            try:
+                if connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                connection.autocommit = True
+            except psycopg2.Error:
+                discard = True
+
+        with self._condition:
+            self._in_use -= 1
+            now = time.monotonic()
+            if discard or self._closed or self._is_expired(connection, now, now):
+                self._discard(connection)
+            else:
+                self._idle.append((connection, now))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, pin: bool = True):
+        """
+        borrow a connection for the duration of the block.
+
+        with `pin` the connection is attached to the current thread, nested blocks in the
+        same thread get the same connection back instead of borrowing another one.
+        """
+        pinned = getattr(self._local, "connection", None)
+        if pin and pinned is not None:
+            yield pinned
+            return
+
+        connection = self.getconn()
+        if pin:
+            self._local.connection = connection
+        try:
+            yield connection
+        finally:
+            if pin:
+                self._local.connection = None
+            self.putconn(connection, discard=bool(connection.closed))
+
+    def pinned_connection(self):
+        """connection attached to the current thread by an open connection() block, or None"""
+        return getattr(self._local, "connection", None)
+
+    def last_wait_time(self) -> float:
+        """seconds the current thread waited for its last checkout"""
+        return getattr(self._local, "last_wait_time", 0.0)
+
+    def stats(self) -> dict:
+        """snapshot of the pool state, for monitoring"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats.update({"size": len(self._idle) + self._in_use, "idle": len(self._idle),
+                          "in_use": self._in_use, "min_size": self.min_size, "max_size": self.max_size})
+        stats["wait_time_avg"] = stats["wait_time_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+    def close(self) -> None:
+        """close idle connections, borrowed ones are closed when they are returned"""
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._discard(connection)
+            self._condition.notify_all()
+
+
+def _settings_key(database_settings: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in database_settings.items()))
+
+
+def get_pool(database_settings: dict, **pool_options) -> ConnectionPool:
+    """
+    returns the pool for the given settings, creating it on first use.
+    pool_options are only used when the pool is created
+    """
+    key = _settings_key(database_settings)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(database_settings, **pool_options)
+            _pools[key] = pool
+        return pool
+
+
+def close_all_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,98 @@
+import gzip
+import json
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+
+def infer_compression(file_path: str, compression=None):
+    """compression given explicitly wins, otherwise it is guessed from the file suffix (.gz, .zst)"""
+    if compression is not None:
+        return compression
+    for suffix, name in COMPRESSION_SUFFIXES.items():
+        if str(file_path).endswith(suffix):
+            return name
+    return None
+
+
+@contextmanager
+def open_export_file(file_path: str, compression=None):
+    """
+    open file for writing bytes, optionally compressed.
+
+    args:
+    - `compression`: None, "gzip" or "zstd" (needs zstandard package)
+    """
+    if compression is None:
+        with open(file_path, "wb") as file:
+            yield file
+    elif compression == "gzip":
+        with gzip.open(file_path, "wb") as file:
+            yield file
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression needs zstandard, install it with `pip install zstandard`")
+        with open(file_path, "wb") as raw_file:
+            with zstandard.ZstdCompressor().stream_writer(raw_file) as file:
+                yield file
+    else:
+        raise ValueError(f"compression should be gzip or zstd, got {compression}")
+
+
+class CopyProgressWriter:
+    """
+    file wrapper for COPY ... TO STDOUT, postgres sends one message per row and psycopg2 writes
+    each of them separately, so counting writes counts rows.
+    progress is called with the number of rows written every `every` rows.
+    """
+    def __init__(self, file, progress=None, every: int = 10000, header: bool = True) -> None:
+        self.file = file
+        self.progress = progress
+        self.every = every
+        self.rows_written = -1 if header else 0  # header line is not a row
+
+    def write(self, data) -> int:
+        written = self.file.write(data)
+        self.rows_written += 1
+        if self.progress is not None and self.rows_written > 0 and self.rows_written % self.every == 0:
+            self.progress(self.rows_written)
+        return written
+
+
+def write_json_records(file, column_names, chunks, lines: bool = False, indent=None, progress=None) -> int:
+    """
+    write rows to a binary file as json without holding more than one chunk in memory.
+
+    args:
+    - `column_names`: keys of every record
+    - `chunks`: iterable of lists of row tuples
+    - `lines`: write NDJSON (one record per line) instead of a json array
+    - `indent`: indent of records inside the array
+    - `progress`: called with the number of rows written after every chunk
+
+    returns:
+    - number of rows written
+    """
+    rows_written = 0
+    separator = b"\n" if lines else b",\n"
+    if not lines:
+        file.write(b"[\n")
+    for chunk in chunks:
+        records = [json.dumps(dict(zip(column_names, row)), default=str, indent=None if lines else indent)
+                   for row in chunk]
+        if rows_written and not lines:
+            file.write(separator)
+        file.write(separator.join(record.encode("utf-8") for record in records))
+        if lines:
+            file.write(b"\n")
+        rows_written += len(chunk)
+        if progress is not None:
+            progress(rows_written)
+    if not lines:
+        file.write(b"\n]")
+    return rows_written
@@ -0,0 +1,99 @@
+import re
+
+INDEX_METHODS = ("btree", "hash", "gin", "gist", "brin")
+
+
+class Index:
+    """
+    secondary index declared on a model with __indexes__, or added later with add_index.
+
+    class Employee(BaseModel):
+        __indexes__ = [
+            Index("last_name"),                                   # b-tree
+            Index("email", unique=True, where="deleted = false"), # partial unique index
+            Index("department_id", include=["salary"]),           # covering index
+            Index("tags", method="gin"),
+            Index("created_at", method="brin"),
+        ]
+    """
+    def __init__(self, *column_names, method: str = "btree", unique: bool = False,
+                 where: str = None, include=(), name: str = None) -> None:
+        if not column_names:
+            raise ValueError("index needs at least one column")
+        if method not in INDEX_METHODS:
+            raise ValueError(f"index method should be one of {', '.join(INDEX_METHODS)}, got {method}")
+        if unique and method != "btree":
+            raise ValueError("only btree indexes can be unique")
+        self.column_names = column_names  # columns or expressions like lower(email)
+        self.method = method
+        self.unique = unique
+        self.where = where
+        self.include = tuple(include)
+        self.name = name
+
+    def index_name(self, table_name: str) -> str:
+        """given name, or table_columns_method_idx"""
+        if self.name:
+            return self.name
+        columns_part = "_".join(re.sub(r"\W+", "_", column).strip("_") for column in self.column_names)
+        return f"{table_name}_{columns_part}_{self.method}_idx".lower()
+
+    def sql(self, table_name: str, concurrently: bool = False) -> str:
+        query = "CREATE UNIQUE INDEX" if self.unique else "CREATE INDEX"
+        if concurrently:
+            query += " CONCURRENTLY"
+        query += f" IF NOT EXISTS {self.index_name(table_name)} ON {table_name} USING {self.method} " \
+                 f"({', '.join(self.column_names)})"
+        if self.include:
+            query += f" INCLUDE ({', '.join(self.include)})"
+        if self.where:
+            query += f" WHERE {self.where}"
+        return query
+
+    def __repr__(self):
+        return f"Index({', '.join(self.column_names)}, method={self.method})"
+
+
+def _bound(value) -> str:
+    """MINVALUE / MAXVALUE are keywords, everything else is a parameter"""
+    return value if value in ("MINVALUE", "MAXVALUE") else "%s"
+
+
+class RangePartition:
+    """
+    partition the table by ranges of a column, declared on the model with __partition_by__.
+    partitions are created with create_partition(name, from_value=..., to_value=...)
+    """
+    strategy = "RANGE"
+
+    def __init__(self, *column_names) -> None:
+        self.column_names = column_names
+
+    def sql(self) -> str:
+        return f"PARTITION BY {self.strategy} ({', '.join(self.column_names)})"
+
+    def partition_sql(self, table_name: str, partition_name: str, from_value, to_value):
+        """returns query and parameters, to_value is exclusive"""
+        query = (f"CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name} "
+                 f"FOR VALUES FROM ({_bound(from_value)}) TO ({_bound(to_value)})")
+        params = [value for value in (from_value, to_value) if _bound(value) == "%s"]
+        return query, params
+
+
+class HashPartition:
+    """
+    spread rows over `modulus` partitions by hash of a column, declared on the model with __partition_by__.
+    partitions are created with create_partition(name, modulus=4, remainder=0..3)
+    """
+    strategy = "HASH"
+
+    def __init__(self, *column_names) -> None:
+        self.column_names = column_names
+
+    def sql(self) -> str:
+        return f"PARTITION BY {self.strategy} ({', '.join(self.column_names)})"
+
+    def partition_sql(self, table_name: str, partition_name: str, modulus: int, remainder: int):
+        query = (f"CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name} "
+                 f"FOR VALUES WITH (MODULUS %s, REMAINDER %s)")
+        return query, [int(modulus), int(remainder)]
@@ -0,0 +1,100 @@
+import logging
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from utils.instrumentation import instrumentation, OperationEvent
+
+logger = logging.getLogger(__name__)
+
+# statements longer than this are cut in events, execute_values sends whole chunks as text
+MAX_STATEMENT_LENGTH = 2000
+
+
+def _parameter_count(params) -> int:
+    try:
+        return len(params) if params is not None else 0
+    except TypeError:  # generator
+        return -1
+
+
+class InstrumentedCursor(extensions.cursor):
+    """
+    psycopg2 cursor reporting every execute, executemany and copy to utils.instrumentation.
+    every connection of the orm creates its cursors with it, when instrumentation is
+    disabled it costs one attribute check per call.
+    """
+    def execute(self, query, vars=None):
+        if not instrumentation.enabled:
+            return super().execute(query, vars)
+        with self._measure("execute", query, vars, _parameter_count(vars)):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        if not instrumentation.enabled:
+            return super().executemany(query, vars_list)
+        with self._measure("executemany", query, None, _parameter_count(vars_list)):
+            return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        if not instrumentation.enabled:
+            return super().copy_expert(sql, file, size)
+        with self._measure("copy", sql, None, 0):
+            return super().copy_expert(sql, file, size)
+
+    def _statement(self, query) -> str:
+        if isinstance(query, bytes):
+            return query.decode("utf-8", "replace")
+        if isinstance(query, str):
+            return query
+        return query.as_string(self)  # psycopg2.sql.Composable
+
+    @contextmanager
+    def _measure(self, operation: str, query, params, parameter_count: int):
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            statement = self._statement(query)
+            plan = None
+            if error is None and instrumentation.explain_slow_queries and instrumentation.is_slow(duration):
+                plan = self._explain(statement, params)
+            instrumentation.emit(OperationEvent("postgres", operation, statement[:MAX_STATEMENT_LENGTH],
+                                                parameter_count, self.rowcount, duration, error=error, plan=plan))
+
+    def _explain(self, statement: str, params):
+        """plan of a slow select, runs it again with EXPLAIN (ANALYZE, BUFFERS).
+        other statements are not explained, ANALYZE would apply their changes a second time"""
+        if self.name is not None or not statement.lstrip().lower().startswith("select"):
+            return None
+        # plain cursor, the explain itself is not reported. inside a transaction a savepoint
+        # keeps a failing explain from aborting it
+        in_transaction = not self.connection.autocommit
+        with self.connection.cursor(cursor_factory=extensions.cursor) as cursor:
+            try:
+                if in_transaction:
+                    cursor.execute("SAVEPOINT dattyorm_explain")
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", params)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                if in_transaction:
+                    cursor.execute("RELEASE SAVEPOINT dattyorm_explain")
+                return plan
+            except psycopg2.Error as e:
+                logger.error(f"could not explain slow query: {e}")
+                if in_transaction:
+                    cursor.execute("ROLLBACK TO SAVEPOINT dattyorm_explain")
+                return None
+
+
+def connect(database_settings: dict):
+    """autocommit connection whose cursors are instrumented"""
+    connection = psycopg2.connect(**{"cursor_factory": InstrumentedCursor, **database_settings})
+    connection.autocommit = True
+    return connection
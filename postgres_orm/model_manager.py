@@ -1,6 +1,9 @@
 class TableMeta(type):
     """this is a metaclass that will turn class variables to fields
-    so tht I can iterate over them and use them in a query"""
+    so tht I can iterate over them and use them in a query
+
+    dunder attributes are not fields, they hold table level declarations:
+    __indexes__, __primary_key__ and __partition_by__"""
     def __new__(cls, name, bases, dct):
         fields = {k: v for k, v in dct.items() if not k.startswith("__")}
         dct['fields'] = fields
@@ -0,0 +1,448 @@
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from itertools import chain
+
+import psycopg2
+
+from . import bulk_load
+from . import export_utils
+from .instrumented_cursor import connect
+
+logger = logging.getLogger(__name__)
+
+SHARD_METHODS = ("key", "ctid")
+EXECUTORS = ("thread", "process")
+
+
+class ShardError(Exception):
+    """raised when shards (or ingest chunks) still fail after all retries, `failed` is a list of (shard, error)"""
+    def __init__(self, failed) -> None:
+        self.failed = failed
+        super().__init__(f"{len(failed)} shards failed: " + "; ".join(f"{shard}: {error}" for shard, error in failed))
+
+
+class Shard:
+    """
+    part of the table, rows with `lower <= key < upper` for primary key shards,
+    or rows stored in pages `lower <= page < upper` for ctid shards. None means unbounded,
+    the first and the last shard are open ended so rows outside the planned range are not lost
+    """
+    def __init__(self, index: int, count: int, method: str, lower=None, upper=None) -> None:
+        self.index = index
+        self.count = count
+        self.method = method
+        self.lower = lower
+        self.upper = upper
+
+    def where(self, key_column: str):
+        """WHERE clause (or empty string) and its parameters"""
+        column, cast = (key_column, "") if self.method == "key" else ("ctid", "::tid")
+        bound = (lambda value: value) if self.method == "key" else (lambda page: f"({page},0)")
+        conditions, params = [], []
+        if self.lower is not None:
+            conditions.append(f"{column} >= %s{cast}")
+            params.append(bound(self.lower))
+        if self.upper is not None:
+            conditions.append(f"{column} < %s{cast}")
+            params.append(bound(self.upper))
+        return (f" WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+    def __repr__(self):
+        return f"Shard({self.index + 1}/{self.count} {self.method} [{self.lower}, {self.upper}))"
+
+
+def _split_range(lowest: int, highest: int, count: int, method: str) -> list:
+    """count shards of equal width covering lowest..highest"""
+    count = max(1, min(count, highest - lowest + 1))
+    width = (highest - lowest + 1) / count
+    bounds = [lowest + round(width * index) for index in range(count + 1)]
+    return [Shard(index, count, method, bounds[index] if index else None,
+                  bounds[index + 1] if index < count - 1 else None) for index in range(count)]
+
+
+def _shard_path(path: str, index: int) -> str:
+    """dump.csv.gz -> dump.0003.csv.gz"""
+    root, extension = os.path.splitext(path)
+    if extension in export_utils.COMPRESSION_SUFFIXES:
+        root, inner_extension = os.path.splitext(root)
+        extension = inner_extension + extension
+    return f"{root}.{index:04d}{extension}"
+
+
+def _compressed(data: bytes, compression) -> bytes:
+    """gzip members and zstd frames can be concatenated, so compressed pieces are glued to compressed shards"""
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.compress(data)
+    if export_utils.zstandard is None:
+        raise ImportError("zstd compression needs zstandard, install it with `pip install zstandard`")
+    return export_utils.zstandard.ZstdCompressor().compress(data)
+
+
+# workers keep one connection per thread (or process) for all the jobs they run
+_worker_state = threading.local()
+
+
+@contextmanager
+def _worker_connection(database_settings: dict):
+    """connection of this worker, replaced with a new one after a job failed on it"""
+    connection = getattr(_worker_state, "connection", None)
+    if connection is None or connection.closed:
+        connection = _worker_state.connection = connect(database_settings)
+    try:
+        yield connection
+    except Exception:
+        _worker_state.connection = None
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        raise
+
+
+@contextmanager
+def _shard_cursor(connection, snapshot=None, name=None):
+    """cursor in a read only transaction, on the exported snapshot when it is given"""
+    connection.autocommit = False
+    try:
+        if snapshot is not None:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+        with connection.cursor(name=name) as cursor:
+            yield cursor
+    finally:
+        connection.rollback()
+        connection.autocommit = True
+
+
+def _export_csv_shard(database_settings, table, key_column, shard, snapshot, path, compression, header) -> int:
+    where, params = shard.where(key_column)
+    with _worker_connection(database_settings) as connection:
+        with _shard_cursor(connection, snapshot) as cursor:
+            # COPY can't take parameters, they are inlined by psycopg2
+            select = cursor.mogrify(f"SELECT * FROM {table}{where}", params).decode()
+            options = "FORMAT csv, HEADER" if header else "FORMAT csv"
+            with export_utils.open_export_file(path, compression) as file:
+                cursor.copy_expert(f"COPY ({select}) TO STDOUT WITH ({options})", file)
+            return cursor.rowcount
+
+
+def _export_json_shard(database_settings, table, key_column, shard, snapshot, path, compression,
+                       lines, chunk_size, indent, fragment) -> int:
+    """with `fragment` the records are written without the array brackets, to be merged with other shards"""
+    where, params = shard.where(key_column)
+    cursor_name = f"{table}_shard_{uuid.uuid4().hex}".lower()
+    with _worker_connection(database_settings) as connection:
+        with _shard_cursor(connection, snapshot, name=cursor_name) as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(f"SELECT * FROM {table}{where}", params)
+            first_chunk = cursor.fetchmany(chunk_size)
+            column_names = [desc[0] for desc in cursor.description]
+            chunks = iter(lambda: cursor.fetchmany(chunk_size), [])
+            with export_utils.open_export_file(path, compression) as file:
+                if fragment and not lines:
+                    return _write_json_fragment(file, column_names, first_chunk, chunks, indent)
+                return export_utils.write_json_records(file, column_names,
+                                                       chain([first_chunk] if first_chunk else [], chunks),
+                                                       lines=lines, indent=indent)
+
+
+def _write_json_fragment(file, column_names, first_chunk, chunks, indent) -> int:
+    """records of a json array separated by commas, without the brackets"""
+    rows_written = 0
+    for chunk in chain([first_chunk] if first_chunk else [], chunks):
+        records = b",\n".join(json.dumps(dict(zip(column_names, row)), default=str, indent=indent).encode("utf-8")
+                               for row in chunk)
+        file.write((b",\n" if rows_written else b"") + records)
+        rows_written += len(chunk)
+    return rows_written
+
+
+def _insert_chunk(database_settings, model_class, fields, chunk, use_copy, copy_format) -> int:
+    from .base_database_manager import BaseManager
+    manager = BaseManager(model_class())
+    with _worker_connection(database_settings) as connection:
+        manager.connection = connection
+        column_names = ", ".join(fields)
+        copy_query = f"COPY {manager.model_class_name} ({column_names}) FROM STDIN WITH (FORMAT {copy_format})"
+        with connection.cursor() as cursor:
+            if not (use_copy and manager._copy_chunk(cursor, copy_query, copy_format, fields, chunk)):
+                manager._insert_chunk(cursor, fields, chunk)
+    return len(chunk)
+
+
+class ParallelManager:
+    """
+    exports and loads a table on several connections at once, so a big dump or load is not limited
+    by one backend and one cpu core. get it from the manager:
+
+    manager.parallel(workers=8).export_data_as_csv("employee.csv.gz")
+    manager.parallel(workers=4, executor="process").batch_insert(rows, chunk_size=50_000)
+
+    exports split the table into `workers * shards_per_worker` shards, by primary key ranges of equal width
+    (`method="key"`, sparse keys give uneven shards) or by ranges of table pages (`method="ctid"`, even
+    sizes, fast on postgres 14+ with tid range scans, not for partitioned tables). with `consistent` all
+    shards read one snapshot exported by the coordinator, the dump is the same as a single connection one.
+
+    every shard or chunk runs on a worker with its own connection, in a thread pool or, with
+    `executor="process"`, a process pool (the model class has to be importable then). jobs that fail
+    are retried up to `retries` times, finished ones are not run again, ShardError lists what is left.
+    `progress(shard, rows)` is called in the calling thread when a shard or chunk is done.
+    """
+    def __init__(self, manager, workers: int = 4, executor: str = "thread", shards_per_worker: int = 4,
+                 retries: int = 2, progress=None) -> None:
+        if manager.database_settings is None:
+            raise ValueError("parallel mode needs a manager connected with set_connection")
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor should be one of {EXECUTORS}, got {executor}")
+        if workers < 1:
+            raise ValueError(f"workers should be at least 1, got {workers}")
+        self.manager = manager
+        self.workers = workers
+        self.executor = executor
+        self.shards_per_worker = shards_per_worker
+        self.retries = retries
+        self.progress = progress
+
+    def plan_shards(self, method: str = "key", cursor=None) -> list:
+        """split the table into shards, see ParallelManager"""
+        if method not in SHARD_METHODS:
+            raise ValueError(f"shard method should be one of {SHARD_METHODS}, got {method}")
+        if cursor is None:
+            with self.manager._get_cursor() as cursor:
+                return self.plan_shards(method, cursor)
+
+        count = self.workers * self.shards_per_worker
+        table = self.manager.model_class_name
+        if method == "key":
+            key_column = self.manager._primary_key_column()
+            cursor.execute(f"SELECT min({key_column}), max({key_column}) FROM {table}")
+            lowest, highest = cursor.fetchone()
+        else:
+            cursor.execute("SELECT pg_relation_size(%s::regclass) / current_setting('block_size')::int", (table,))
+            lowest, highest = 0, cursor.fetchone()[0]
+        if lowest is None:
+            return [Shard(0, 1, method)]
+        return _split_range(lowest, highest, count, method)
+
+    def export_data_as_csv(self, path_to_csv_file, merge: bool = True, method: str = "key",
+                           compression=None, consistent: bool = True, shards=None) -> dict:
+        """
+        export the table to csv with one COPY per shard.
+
+        args:
+        - `merge`: write one file, shards are glued in key (or page) order. otherwise every shard goes
+           to its own file with a header, dump.csv -> dump.0000.csv, dump.0001.csv...
+        - `method`: "key" or "ctid", how the table is split
+        - `compression`: None, "gzip" or "zstd", guessed from the suffix. shards are compressed by the workers
+        - `consistent`: all shards read the same snapshot
+        - `shards`: run only these shards (e.g. ShardError.failed of an earlier run), per shard files only
+
+        returns:
+        - dict with rows, shards, files and elapsed seconds
+        """
+        compression = export_utils.infer_compression(path_to_csv_file, compression)
+        table = self.manager.model_class_name
+
+        def job(shard, path, snapshot):
+            return (_export_csv_shard, self.manager.database_settings, table, self._key_column(method),
+                    shard, snapshot, path, compression, not merge or shard.index == 0)
+
+        return self._export(path_to_csv_file, job, merge, method, consistent, shards, compression)
+
+    def export_data_as_json(self, path_to_json_file, lines: bool = False, merge: bool = True, method: str = "key",
+                            chunk_size: int = 10000, compression=None, indent=4, consistent: bool = True,
+                            shards=None) -> dict:
+        """
+        export the table to json, every shard is read through its own server side cursor
+        `chunk_size` rows at a time. arguments are the same as export_data_as_csv, with `lines` for NDJSON.
+        merged arrays are built from shard fragments, per shard files are complete json documents
+        """
+        compression = export_utils.infer_compression(path_to_json_file, compression)
+        table = self.manager.model_class_name
+
+        def job(shard, path, snapshot):
+            return (_export_json_shard, self.manager.database_settings, table, self._key_column(method),
+                    shard, snapshot, path, compression, lines, chunk_size, indent, merge)
+
+        brackets = None if lines else (b"[\n", b",\n", b"\n]")
+        return self._export(path_to_json_file, job, merge, method, consistent, shards, compression, brackets)
+
+    def batch_insert(self, rows, chunk_size: int = 10000, use_copy: bool = True, copy_format: str = "text") -> int:
+        """
+        load rows with `workers` connections at once, each chunk is one COPY (or INSERT ... VALUES)
+        committed on its own. at most two chunks per worker are held in memory, so generators of any
+        size can be loaded. rows are not inserted in order, serial keys follow the order chunks finished.
+        chunks that failed are retried, a chunk is atomic so a retry never duplicates rows
+
+        args are the same as BaseManager.batch_insert
+
+        returns:
+        - number of rows inserted
+        """
+        if copy_format not in ("text", "binary"):
+            raise ValueError(f"copy format should be either text or binary, got {copy_format}")
+        fields, row_tuples = bulk_load.prepare_rows(self.manager.model_fields, rows)
+        if not fields:
+            return 0
+
+        started = time.perf_counter()
+        inserted_rows = 0
+        failed = []
+        with self._executor_pool() as executor:
+            running = {}  # future -> (chunk number, chunk, attempt)
+
+            def submit(index, chunk, attempt):
+                future = executor.submit(_insert_chunk, self.manager.database_settings, self.manager.model_class,
+                                         fields, chunk, use_copy, copy_format)
+                running[future] = (index, chunk, attempt)
+
+            def collect(futures):
+                nonlocal inserted_rows
+                for future in futures:
+                    index, chunk, attempt = running.pop(future)
+                    try:
+                        inserted_rows += future.result()
+                    except Exception as e:
+                        if attempt < self.retries:
+                            logger.warning(f"chunk {index} of {self.manager.model_class_name} failed, retrying: {e}")
+                            submit(index, chunk, attempt + 1)
+                        else:
+                            logger.error(f"chunk {index} of {self.manager.model_class_name} failed: {e}")
+                            failed.append((f"chunk {index}", e))
+                        continue
+                    if self.progress is not None:
+                        self.progress(index, len(chunk))
+
+            try:
+                for index, chunk in enumerate(bulk_load.iter_chunks(row_tuples, chunk_size)):
+                    while len(running) >= self.workers * 2:
+                        collect(wait(running, return_when=FIRST_COMPLETED).done)
+                    submit(index, chunk, 0)
+            except KeyError as e:
+                logger.error(f"trying to insert with invalid key {e}, chunks before it are inserted")
+            while running:
+                collect(wait(running, return_when=FIRST_COMPLETED).done)
+
+        self.manager._after_write("insert")
+        elapsed = time.perf_counter() - started
+        rows_per_second = inserted_rows / elapsed if elapsed else float(inserted_rows)
+        logger.info(f"inserted {inserted_rows} rows into {self.manager.model_class_name} with {self.workers} "
+                    f"workers in {elapsed:.3f}s ({rows_per_second:.0f} rows/s)")
+        if failed:
+            raise ShardError(failed)
+        return inserted_rows
+
+    def _key_column(self, method: str):
+        return self.manager._primary_key_column() if method == "key" else None
+
+    def _export(self, path, job, merge, method, consistent, shards, compression, brackets=None) -> dict:
+        if merge and shards is not None:
+            raise ValueError("running only some shards is possible with per shard files (merge=False)")
+        started = time.perf_counter()
+        # the snapshot id stays local, exports running at the same time each pass their own to the workers
+        with self._exported_snapshot(consistent) as (cursor, snapshot):
+            if shards is None:
+                shards = self.plan_shards(method, cursor)
+            if not merge:
+                files = {shard.index: _shard_path(path, shard.index) for shard in shards}
+                rows = self._run_shards(shards, lambda shard: job(shard, files[shard.index], snapshot))
+                files = [files[index] for index in sorted(files)]
+            else:
+                directory = tempfile.mkdtemp(prefix=".dattyorm_shards_", dir=os.path.dirname(path) or ".")
+                try:
+                    parts = {shard.index: os.path.join(directory, f"{shard.index:04d}") for shard in shards}
+                    rows = self._run_shards(shards, lambda shard: job(shard, parts[shard.index], snapshot))
+                    self._merge(path, [(parts[index], rows[index]) for index in sorted(parts)],
+                                compression, brackets)
+                finally:
+                    shutil.rmtree(directory, ignore_errors=True)
+                files = [path]
+
+        total_rows = sum(rows.values())
+        elapsed = time.perf_counter() - started
+        logger.info(f"{total_rows} rows of {self.manager.model_class_name} exported to {path} in {len(shards)} "
+                    f"shards by {self.workers} workers, {elapsed:.3f}s")
+        return {"rows": total_rows, "shards": len(shards), "files": files, "elapsed": elapsed}
+
+    @contextmanager
+    def _exported_snapshot(self, consistent: bool):
+        """
+        (cursor of the coordinator, snapshot id). with `consistent` its transaction exports a snapshot that
+        the workers import, it stays open (and the snapshot valid) until the block ends, otherwise the id is None
+        """
+        if not consistent:
+            with self.manager._get_cursor() as cursor:
+                yield cursor, None
+            return
+        connection = connect(self.manager.database_settings)
+        try:
+            connection.autocommit = False
+            connection.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_export_snapshot()")
+                yield cursor, cursor.fetchone()[0]
+        finally:
+            connection.rollback()
+            connection.close()
+
+    def _run_shards(self, shards, job) -> dict:
+        """run job(shard) for every shard, retrying only the failed ones. returns shard index -> rows"""
+        rows = {}
+        pending = list(shards)
+        for attempt in range(self.retries + 1):
+            failed = []
+            # new pool for every round, a crashed worker process breaks the whole pool
+            with self._executor_pool() as executor:
+                futures = {}
+                for shard in pending:
+                    function, *arguments = job(shard)
+                    futures[executor.submit(function, *arguments)] = shard
+                for future in as_completed(futures):
+                    shard = futures[future]
+                    try:
+                        rows[shard.index] = future.result()
+                    except Exception as e:
+                        logger.error(f"{shard} of {self.manager.model_class_name} failed (attempt {attempt + 1}): {e}")
+                        failed.append((shard, e))
+                        continue
+                    if self.progress is not None:
+                        self.progress(shard, rows[shard.index])
+            if not failed:
+                return rows
+            pending = [shard for shard, _ in failed]
+        raise ShardError(sorted(failed, key=lambda failure: failure[0].index))
+
+    def _merge(self, path, parts, compression, brackets=None) -> None:
+        """glue shard files in order, json arrays get brackets and commas between non empty shards"""
+        opening, separator, closing = brackets or (b"", b"", b"")
+        with open(path, "wb") as file:
+            file.write(_compressed(opening, compression) if opening else b"")
+            written = False
+            for part, rows in parts:
+                if not rows and brackets:
+                    continue
+                if written and separator:
+                    file.write(_compressed(separator, compression))
+                with open(part, "rb") as shard_file:
+                    shutil.copyfileobj(shard_file, file, 1 << 20)
+                written = True
+            file.write(_compressed(closing, compression) if closing else b"")
+
+    def _executor_pool(self):
+        if self.executor == "process":
+            # spawned, forked workers would share the libpq sockets of this process
+            return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return ThreadPoolExecutor(self.workers, thread_name_prefix="dattyorm-parallel")
@@ -0,0 +1,199 @@
+import re
+
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# lookup -> sql template for `column__lookup=value` filters
+LOOKUPS = {
+    "eq": "{column} = %s",
+    "ne": "{column} <> %s",
+    "lt": "{column} < %s",
+    "lte": "{column} <= %s",
+    "gt": "{column} > %s",
+    "gte": "{column} >= %s",
+    "in": "{column} = ANY(%s)",
+    "not_in": "NOT ({column} = ANY(%s))",
+    "like": "{column} LIKE %s",
+    "ilike": "{column} ILIKE %s",
+    "range": "{column} BETWEEN %s AND %s",
+}
+AGGREGATES = ("count", "sum", "avg", "min", "max")
+
+
+def _identifier(name: str) -> str:
+    """column names go into the sql text, only plain identifiers are accepted"""
+    if not IDENTIFIER.match(name):
+        raise ValueError(f"invalid column name {name}")
+    return name
+
+
+class Query:
+    """
+    chainable select over a manager's table, compiled to one parameterized statement so that
+    filtering, sorting and paging happen in postgres (and on its indexes) instead of in python.
+    every method returns a new query, the original one is not changed.
+
+    manager.query().filter(salary__gte=1000, last_name__in=["doe", "smith"]).order_by("-salary").limit(10).all()
+
+    filters: eq (default), ne, lt, lte, gt, gte, in, not_in, like, ilike, range (two values), isnull (True/False)
+    """
+    def __init__(self, manager) -> None:
+        self.manager = manager
+        self._fields = ()
+        self._conditions = ()  # (sql, params) pairs joined with AND
+        self._ordering = ()
+        self._limit = None
+        self._offset = None
+
+    def _clone(self, **changes) -> "Query":
+        query = Query.__new__(Query)
+        query.__dict__.update(self.__dict__)
+        query.__dict__.update(changes)
+        return query
+
+    def filter(self, **lookups) -> "Query":
+        """add conditions, `column=value` or `column__lookup=value`, all of them have to match"""
+        conditions = list(self._conditions)
+        for key, value in lookups.items():
+            column, _, lookup = key.partition("__")
+            column = _identifier(column)
+            lookup = lookup or "eq"
+            if lookup == "isnull":
+                conditions.append((f"{column} IS {'' if value else 'NOT '}NULL", ()))
+            elif lookup == "eq" and value is None:
+                conditions.append((f"{column} IS NULL", ()))
+            elif lookup == "range":
+                low, high = value
+                conditions.append((LOOKUPS[lookup].format(column=column), (low, high)))
+            elif lookup in ("in", "not_in"):
+                conditions.append((LOOKUPS[lookup].format(column=column), (list(value),)))
+            elif lookup in LOOKUPS:
+                conditions.append((LOOKUPS[lookup].format(column=column), (value,)))
+            else:
+                raise ValueError(f"unknown lookup {lookup}, use one of {', '.join([*LOOKUPS, 'isnull'])}")
+        return self._clone(_conditions=tuple(conditions))
+
+    def values(self, *field_names) -> "Query":
+        """select only given columns, all columns by default"""
+        return self._clone(_fields=tuple(_identifier(field) for field in field_names))
+
+    def order_by(self, *field_names) -> "Query":
+        """sort by columns, `-column` sorts descending"""
+        ordering = []
+        for field in field_names:
+            if field.startswith("-"):
+                ordering.append(f"{_identifier(field[1:])} DESC")
+            else:
+                ordering.append(_identifier(field))
+        return self._clone(_ordering=tuple(ordering))
+
+    def limit(self, limit: int) -> "Query":
+        return self._clone(_limit=int(limit))
+
+    def offset(self, offset: int) -> "Query":
+        """
+        skip rows, postgres still reads the skipped rows, so for deep pages
+        prefer after() which starts right at the key through the primary key index
+        """
+        return self._clone(_offset=int(offset))
+
+    def after(self, key_value) -> "Query":
+        """keyset page, rows with primary key bigger than key_value in primary key order"""
+        key_column = self.manager._primary_key_column()
+        query = self.filter(**{f"{key_column}__gt": key_value})
+        return query._clone(_ordering=(key_column,))
+
+    def _where(self):
+        if not self._conditions:
+            return "", []
+        params = [param for _, condition_params in self._conditions for param in condition_params]
+        return " WHERE " + " AND ".join(sql for sql, _ in self._conditions), params
+
+    def sql(self):
+        """the select statement and its parameters"""
+        where, params = self._where()
+        query = f"SELECT {', '.join(self._fields) or '*'} FROM {self.manager.model_class_name}{where}"
+        if self._ordering:
+            query += f" ORDER BY {', '.join(self._ordering)}"
+        if self._limit is not None:
+            query += " LIMIT %s"
+            params.append(self._limit)
+        if self._offset is not None:
+            query += " OFFSET %s"
+            params.append(self._offset)
+        return query, params
+
+    def _fetch(self, query, params, fetch_one: bool = False, cacheable: bool = True):
+        with self.manager._get_cursor() as cursor:
+            self.manager._execute(cursor, ("query", query), lambda: query, params, cacheable)
+            return cursor.fetchone() if fetch_one else cursor.fetchall()
+
+    def all(self) -> list:
+        """list of the matching rows"""
+        return self._fetch(*self.sql(), cacheable=bool(self._fields))  # SELECT * is not prepared
+
+    def first(self):
+        """first matching row or None"""
+        return self._fetch(*self.limit(1).sql(), fetch_one=True, cacheable=bool(self._fields))
+
+    def iterator(self, itersize: int = 2000):
+        """generator over matching rows through a server side cursor, for big results"""
+        query, params = self.sql()
+        with self.manager._server_side_cursor(query, itersize, params) as cursor:
+            yield from cursor
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def count(self) -> int:
+        """number of matching rows, limit and offset are ignored"""
+        where, params = self._where()
+        query = f"SELECT COUNT(*) FROM {self.manager.model_class_name}{where}"
+        return self._fetch(query, params, fetch_one=True)[0]
+
+    def exists(self) -> bool:
+        """True if at least one row matches, stops at the first one"""
+        where, params = self._where()
+        query = f"SELECT EXISTS (SELECT 1 FROM {self.manager.model_class_name}{where})"
+        return self._fetch(query, params, fetch_one=True)[0]
+
+    def aggregate(self, **aggregates) -> dict:
+        """
+        compute aggregates over matching rows in one query.
+
+        query.aggregate(total=("sum", "salary"), employees=("count", "*"))
+        -> {"total": 1200, "employees": 4}
+        """
+        expressions = []
+        for alias, (function, column) in aggregates.items():
+            if function.lower() not in AGGREGATES:
+                raise ValueError(f"unknown aggregate {function}, use one of {', '.join(AGGREGATES)}")
+            column = column if column == "*" else _identifier(column)
+            expressions.append(f"{function.upper()}({column}) AS {_identifier(alias)}")
+
+        where, params = self._where()
+        query = f"SELECT {', '.join(expressions)} FROM {self.manager.model_class_name}{where}"
+        row = self._fetch(query, params, fetch_one=True)
+        return dict(zip(aggregates, row))
+
+    def update(self, new_data: dict) -> int:
+        """update matching rows, returns number of updated rows"""
+        if not new_data:
+            raise ValueError("nothing to update, new_data is empty")
+        where, params = self._where()
+        set_values = ", ".join(f"{_identifier(key)} = %s" for key in new_data)
+        query = f"UPDATE {self.manager.model_class_name} SET {set_values}{where}"
+        with self.manager._get_cursor() as cursor:
+            self.manager._execute(cursor, ("query", query), lambda: query, [*new_data.values(), *params])
+            updated_rows = cursor.rowcount
+        self.manager._after_write("update")
+        return updated_rows
+
+    def delete(self) -> int:
+        """delete matching rows, returns number of deleted rows"""
+        where, params = self._where()
+        query = f"DELETE FROM {self.manager.model_class_name}{where}"
+        with self.manager._get_cursor() as cursor:
+            self.manager._execute(cursor, ("query", query), lambda: query, params)
+            deleted_rows = cursor.rowcount
+        self.manager._after_write("delete")
+        return deleted_rows
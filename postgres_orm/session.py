@@ -0,0 +1,154 @@
+import logging
+from . import columns
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """
+    unit of work over one or more managers.
+
+    inserts, updates and deletes are only collected until flush, then they are sent as batched
+    statements (batch_insert, bulk_update, delete_many) inside one transaction:
+    inserts and updates parents first, deletes children first, parents being tables that other
+    models point to with columns.ForeignKey.
+
+    used as a context manager the session flushes at the end of the block and discards pending
+    work if the block raises. all managers have to use the same connection or the same pool.
+
+    session = Session()
+    session.add(employee_manager, {"first_name": "john"})
+    session.update(employee_manager, {"salary": 10}, "id", 6)
+    session.delete(department_manager, "id", 3)
+    session.flush()
+    """
+    def __init__(self) -> None:
+        self._managers = {}  # table name -> manager, in the order they were first used
+        self._connection_owner = None  # first registered manager, every other one has to use its connection
+        self._inserts = {}  # table name -> list of rows
+        self._updates = {}  # table name -> {(identifier column, identifier value): new data}
+        self._deletes = {}  # table name -> {identifier column: list of values}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.rollback()
+
+    def _register(self, manager) -> str:
+        table_name = manager.model_class_name
+        owner = self._connection_owner
+        if owner is None:
+            self._connection_owner = owner = manager
+        if manager.connection is not owner.connection or manager.pool is not owner.pool:
+            raise ValueError(f"manager of {table_name} uses a different connection or pool than "
+                             f"{owner.model_class_name}, the session runs everything in one transaction, "
+                             f"see share_connection")
+        self._managers.setdefault(table_name, manager)
+        return table_name
+
+    def add(self, manager, row: dict) -> None:
+        """insert row on flush"""
+        self._inserts.setdefault(self._register(manager), []).append(row)
+
+    def add_all(self, manager, rows) -> None:
+        """insert rows on flush"""
+        self._inserts.setdefault(self._register(manager), []).extend(rows)
+
+    def update(self, manager, new_data: dict, identifier_column_name, identifier_value) -> None:
+        """update rows on flush, changes to the same row are merged, later values win"""
+        updates = self._updates.setdefault(self._register(manager), {})
+        updates.setdefault((identifier_column_name, identifier_value), {}).update(new_data)
+
+    def delete(self, manager, identifier_column_name, column_value) -> None:
+        """delete rows on flush"""
+        deletes = self._deletes.setdefault(self._register(manager), {})
+        deletes.setdefault(identifier_column_name, []).append(column_value)
+
+    def rollback(self) -> None:
+        """forget everything that was not flushed yet"""
+        self._inserts.clear()
+        self._updates.clear()
+        self._deletes.clear()
+
+    def flush(self) -> dict:
+        """
+        send all pending work in one transaction.
+
+        returns:
+        - dict with number of inserted, updated and deleted rows
+        """
+        counts = {"inserted": 0, "updated": 0, "deleted": 0}
+        if not self._managers:
+            return counts
+
+        order = self._dependency_order()
+        first_manager = self._managers[order[0]]
+        with first_manager.transaction():
+            for table_name in order:
+                counts["inserted"] += self._flush_inserts(table_name)
+            for table_name in order:
+                counts["updated"] += self._flush_updates(table_name)
+            for table_name in reversed(order):
+                counts["deleted"] += self._flush_deletes(table_name)
+
+        self.rollback()
+        logger.info(f"session flushed {counts}")
+        return counts
+
+    def _flush_inserts(self, table_name: str) -> int:
+        manager = self._managers[table_name]
+        # batch_insert takes columns from the first row, rows with different columns go separately
+        groups = {}
+        for row in self._inserts.get(table_name, []):
+            groups.setdefault(tuple(row), []).append(row)
+        return sum(manager.batch_insert(rows) for rows in groups.values())
+
+    def _flush_updates(self, table_name: str) -> int:
+        manager = self._managers[table_name]
+        groups = {}
+        updated_rows = 0
+        for (identifier_column, identifier_value), new_data in self._updates.get(table_name, {}).items():
+            if identifier_column in new_data:
+                # the key itself changes, can't be joined on
+                manager.update(new_data, identifier_column, identifier_value)
+                continue
+            group = groups.setdefault((identifier_column, tuple(new_data)), [])
+            group.append({identifier_column: identifier_value, **new_data})
+
+        for (identifier_column, _), rows in groups.items():
+            updated_rows += manager.bulk_update(rows, key_column=identifier_column)["affected_rows"]
+        return updated_rows
+
+    def _flush_deletes(self, table_name: str) -> int:
+        manager = self._managers[table_name]
+        return sum(manager.delete_many(identifier_column, values)
+                   for identifier_column, values in self._deletes.get(table_name, {}).items())
+
+    def _dependency_order(self) -> list:
+        """table names ordered so that referenced tables come before the ones pointing to them"""
+        references = {}
+        for table_name, manager in self._managers.items():
+            references[table_name] = {column.references.lower() for column in manager.model_fields.values()
+                                      if isinstance(column, columns.ForeignKey)}
+
+        ordered = []
+        visiting = set()
+
+        def visit(table_name):
+            if table_name in ordered or table_name in visiting:
+                return  # already placed, or a cycle which the order can't solve anyway
+            visiting.add(table_name)
+            for referenced in sorted(references[table_name]):
+                for candidate in self._managers:
+                    if candidate.lower() == referenced and candidate != table_name:
+                        visit(candidate)
+            visiting.discard(table_name)
+            ordered.append(table_name)
+
+        for table_name in self._managers:
+            visit(table_name)
+        return ordered
@@ -0,0 +1,133 @@
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+
+# one cache per connection, prepared statements only exist in the session that prepared them
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+_statement_names = itertools.count(1)
+
+
+def to_positional(query: str) -> str:
+    """turn psycopg2 %s placeholders into $1, $2... that PREPARE expects"""
+    parts = query.split("%s")
+    positional = [parts[0]]
+    for position, part in enumerate(parts[1:], start=1):
+        positional.append(f"${position}{part}")
+    return "".join(positional)
+
+
+class StatementCache:
+    """
+    LRU cache of server side prepared statements of one connection.
+
+    key identifies the statement (model, operation, column set...), on a miss the query is built,
+    sent with PREPARE and remembered, on a hit only EXECUTE goes to the server, so postgres
+    skips parsing and planning. statements pushed out of the cache are DEALLOCATEd.
+
+    with `prepare` off only the sql text is cached.
+
+    a prepared statement keeps the result columns it was planned with, once the table changes (ALTER TABLE,
+    new indexes...) the cache is marked stale and its statements are deallocated before the next statement.
+    """
+    def __init__(self, max_size: int = 128, prepare: bool = True) -> None:
+        self.max_size = max_size
+        self.prepare = prepare
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._statements = OrderedDict()  # key -> (statement name, sql text)
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def mark_stale(self) -> None:
+        """forget every statement, they are deallocated on the connection with the next execute,
+        the connection may be in use by another thread right now"""
+        self._stale = True
+
+    def execute(self, cursor, key: tuple, build_query, params=()) -> None:
+        """
+        run the statement identified by key on the cursor.
+
+        args:
+        - `key`: hashable identifier of the statement
+        - `build_query`: function returning the sql with %s placeholders, only called on a miss
+        - `params`: values for the placeholders
+        """
+        with self._lock:
+            if self._stale:
+                self._clear(cursor)
+            name, query = self._lookup(cursor, key, build_query)
+            if not self.prepare:
+                cursor.execute(query, params)
+            elif params:
+                cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cursor.execute(f"EXECUTE {name}")
+
+    def _lookup(self, cursor, key, build_query):
+        cached = self._statements.get(key)
+        if cached is not None:
+            self._statements.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        query = build_query()
+        name = f"dattyorm_{next(_statement_names)}"
+        if self.prepare:
+            cursor.execute(f"PREPARE {name} AS {to_positional(query)}")
+        self._statements[key] = (name, query)
+
+        if len(self._statements) > self.max_size:
+            _, (evicted_name, _) = self._statements.popitem(last=False)
+            self.evictions += 1
+            if self.prepare:
+                cursor.execute(f"DEALLOCATE {evicted_name}")
+        return name, query
+
+    def _clear(self, cursor) -> None:
+        if self.prepare and self._statements:
+            cursor.execute("; ".join(f"DEALLOCATE {name}" for name, _ in self._statements.values()))
+        self._statements.clear()
+        self._stale = False
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self._statements), "max_size": self.max_size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+
+def cache_for(connection, max_size: int = 128, prepare: bool = True) -> StatementCache:
+    """returns the statement cache of the connection, created on first use"""
+    with _caches_lock:
+        cache = _caches.get(connection)
+        if cache is None:
+            cache = StatementCache(max_size=max_size, prepare=prepare)
+            _caches[connection] = cache
+        return cache
+
+
+def invalidate_all() -> None:
+    """mark the cache of every connection stale, called after statements that change tables"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.mark_stale()
+
+
+def caches_stats() -> dict:
+    """hits, misses and evictions summed over every connection's cache in the process"""
+    totals = {"connections": 0, "size": 0, "hits": 0, "misses": 0, "evictions": 0}
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        stats = cache.stats()
+        totals["connections"] += 1
+        for counter in ("size", "hits", "misses", "evictions"):
+            totals[counter] += stats[counter]
+    lookups = totals["hits"] + totals["misses"]
+    totals["hit_ratio"] = totals["hits"] / lookups if lookups else 0.0
+    return totals
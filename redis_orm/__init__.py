@@ -1 +1,2 @@
-from .redis_orm import RedisORM
\ No newline at end of file
+from .redis_orm import RedisORM
+from .async_redis_orm import AsyncRedisORM
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import redis.asyncio as aioredis
+from utils.event_loops import loop_state
+from utils.instrumentation import instrument_redis
+from .base_redis_orm import BaseRedisORM, CsvExportWriter, JsonExportWriter, UPDATE_HASH_SCRIPT, _batches
+
+logger = logging.getLogger(__name__)
+
+
+async def _disconnect_pools(state: dict) -> None:
+    """disconnect the pools of an event loop that shuts down"""
+    pools = state.pop("pools", {})
+    for pool in pools.values():
+        await pool.disconnect()
+
+
+def get_pool(host='localhost', port=6379, db=0, max_connections=50, timeout=20, **connection_options):
+    """bounded pool, when all connections are busy callers wait up to `timeout` seconds for a free one.
+    pools are shared per event loop, they are disconnected when asyncio.run closes the loop"""
+    pools = loop_state(__name__, close=_disconnect_pools).setdefault("pools", {})
+    key = (host, port, db, max_connections,
+           tuple(sorted((name, str(value)) for name, value in connection_options.items())))
+    pool = pools.get(key)
+    if pool is None:
+        pool = pools[key] = aioredis.BlockingConnectionPool(host=host, port=port, db=db,
+                                                            max_connections=max_connections,
+                                                            timeout=timeout, **connection_options)
+    return pool
+
+
+async def close_all_pools():
+    """disconnect every shared pool of the running event loop"""
+    await _disconnect_pools(loop_state(__name__, close=_disconnect_pools))
+
+
+async def _abatches(async_iterable, batch_size):
+    """split async iterable into lists of batch_size items"""
+    batch = []
+    async for item in async_iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class AsyncRedisORM(BaseRedisORM):
+    """asyncio version of RedisORM, same storage modes, codecs and stored format, so both can read each other's keys
+
+    connections come from a bounded pool shared by every AsyncRedisORM with the same host, port, db and
+    max_connections, so many coroutines can use the cache at once without opening a connection each.
+    bulk methods send `concurrency` pipelined batches at the same time
+
+    the pool belongs to the event loop it was created on, create the orm inside the running loop
+
+    redis_orm = AsyncRedisORM(max_connections=100)
+    await redis_orm.insert_into_redis("user:1", {"name": "john"})
+    users = await asyncio.gather(*(redis_orm.select_from_redis(f"user:{i}") for i in range(1000)))"""
+    def __init__(self, host='localhost', port=6379, db=0, storage="json", codec="json", compression=None,
+                 compress_threshold=1024, max_connections=50, timeout=20, **connection_options):
+        super().__init__(storage, codec, compression, compress_threshold)
+        self.pool = get_pool(host, port, db, max_connections, timeout, **connection_options)
+        self.redis_client = instrument_redis(aioredis.Redis(connection_pool=self.pool))
+        self._update_hash = self.redis_client.register_script(UPDATE_HASH_SCRIPT)
+
+    async def close(self):
+        """close this client, the shared pool stays open for the others, see close_all_pools"""
+        await self.redis_client.aclose(close_connection_pool=False)
+
+    async def _run_batches(self, batches, run_batch, concurrency):
+        """run coroutine run_batch for every batch, at most `concurrency` of them at once, results in order.
+        batches are taken from the iterable only when there is room, so big inputs are not all held in memory"""
+        results = {}
+        pending = set()
+
+        async def indexed(index, batch):
+            results[index] = await run_batch(batch)
+
+        try:
+            for index, batch in enumerate(batches):
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()  # raises the error of a failed batch
+                pending.add(asyncio.ensure_future(indexed(index, batch)))
+            if pending:
+                await asyncio.gather(*pending)
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            raise
+        return [results[index] for index in sorted(results)]
+
+    async def insert_into_redis(self, key, data, ttl=None):
+        """store data under key, ttl in seconds"""
+        if self.storage == "hash":
+            async with self.redis_client.pipeline(transaction=True) as pipeline:
+                self._queue_hash_insert(pipeline, key, data, ttl)
+                await pipeline.execute()
+            return
+        await self.redis_client.set(key, self._serialize_data(data), ex=ttl)
+
+    async def select_from_redis(self, key):
+        """select specifc values based on the key"""
+        if self.storage == "hash":
+            return self._deserialize_hash(await self.redis_client.hgetall(key))
+        return self._deserialize_data(await self.redis_client.get(key))
+
+    async def select_fields(self, key, *fields):
+        """select only some fields of a record, with hash storage only these fields are read (HMGET)
+
+        returns dict field -> value, None for missing fields, or None if the key does not exist"""
+        if self.storage == "hash":
+            async with self.redis_client.pipeline(transaction=False) as pipeline:
+                pipeline.exists(key)
+                pipeline.hmget(key, fields)
+                exists, values = await pipeline.execute()
+            if not exists:
+                return None
+            return {field: self._deserialize_data(value) for field, value in zip(fields, values)}
+        data = await self.select_from_redis(key)
+        if data is None:
+            return None
+        return {field: data.get(field) for field in fields}
+
+    async def insert_many(self, items, batch_size=1000, ttl=None, concurrency=4):
+        """insert many values, one pipeline per batch, `concurrency` batches in flight
+
+        items is a dict key -> data or iterable of (key, data) pairs
+        ttl in seconds is applied to every key of the batch
+
+        returns number of inserted keys"""
+        if isinstance(items, dict):
+            items = items.items()
+
+        async def insert_batch(batch):
+            async with self.redis_client.pipeline(transaction=False) as pipeline:
+                for key, data in batch:
+                    if self.storage == "hash":
+                        self._queue_hash_insert(pipeline, key, data, ttl)
+                    else:
+                        pipeline.set(key, self._serialize_data(data), ex=ttl)
+                await pipeline.execute()
+            return len(batch)
+
+        return sum(await self._run_batches(_batches(items, batch_size), insert_batch, concurrency))
+
+    async def select_many(self, keys, batch_size=1000, concurrency=4):
+        """select values of many keys, one MGET (pipeline of HGETALL with hash storage) per batch
+
+        returns dict key -> data, None for keys that do not exist"""
+        async def select_batch(batch):
+            if self.storage == "hash":
+                async with self.redis_client.pipeline(transaction=False) as pipeline:
+                    for key in batch:
+                        pipeline.hgetall(key)
+                    values = [self._deserialize_hash(fields) for fields in await pipeline.execute()]
+            else:
+                values = [self._deserialize_data(value) for value in await self.redis_client.mget(batch)]
+            return zip(batch, values)
+
+        data = {}
+        for pairs in await self._run_batches(_batches(keys, batch_size), select_batch, concurrency):
+            for key, value in pairs:
+                data[key.decode('utf-8') if isinstance(key, bytes) else key] = value
+        return data
+
+    async def delete_many(self, keys, batch_size=1000, concurrency=4):
+        """delete many keys, one UNLINK per batch
+
+        returns number of deleted keys"""
+        async def delete_batch(batch):
+            return await self.redis_client.unlink(*batch)
+
+        return sum(await self._run_batches(_batches(keys, batch_size), delete_batch, concurrency))
+
+    async def iter_items(self, pattern='*', count=1000):
+        """async generator of (key, data) pairs for keys matching the pattern, keys are walked with SCAN
+
+        async for key, data in redis_orm.iter_items("user*"):
+            ..."""
+        keys = self.redis_client.scan_iter(match=pattern, count=count)
+        async for batch in _abatches(keys, count):
+            for key, data in (await self.select_many(batch, batch_size=count)).items():
+                if data is not None:
+                    yield key, data
+
+    async def select_all(self, pattern='*', batch_size=1000):
+        """select all values with keys matching the pattern, verify the pattern, redis can have other data as well"""
+        try:
+            return {key: data async for key, data in self.iter_items(pattern, count=batch_size)}
+        except json.decoder.JSONDecodeError:
+            logger.error("patterns does not match, please specify")
+
+    async def update_data(self, key, new_data):
+        """change some fields of a stored record atomically, see RedisORM.update_data"""
+        if not new_data:
+            return
+        if self.storage == "hash":
+            updated = await self._update_hash(keys=[key], args=self._hash_update_arguments(new_data))
+        else:
+            updated = await self.redis_client.transaction(
+                lambda pipeline: self._merge_watched(pipeline, key, new_data), key, value_from_callable=True)
+        if not updated:
+            logger.info(f"No data found for key {key}")
+
+    async def _merge_watched(self, pipeline, key, new_data):
+        """runs inside redis transaction with key watched, returns False if there is nothing to update"""
+        merged = self._merged(await pipeline.get(key), new_data)
+        if merged is None:
+            return False
+        pipeline.multi()
+        pipeline.set(key, merged, keepttl=True)
+        return True
+
+    async def delete(self, key):
+        if not await self.redis_client.delete(key):
+            logger.info(f"No data found for key {key}")
+
+    async def export_all_to_csv(self, pattern='*', file_path="redis_data.csv", chunk_size=1000, dedupe=False):
+        """write values matching the pattern to csv chunk by chunk while scanning, see RedisORM.export_all_to_csv
+
+        returns number of exported keys"""
+        with open(file_path, "w", newline="") as file:
+            writer = CsvExportWriter(file, dedupe)
+            async for chunk in _abatches(self.iter_items(pattern, count=chunk_size), chunk_size):
+                writer.write(chunk)
+            writer.close()
+        logger.info(f"{writer.exported} keys exported to {file_path}")
+        return writer.exported
+
+    async def export_all_to_json(self, pattern='*', file_path="redis_data.json", lines=False, chunk_size=1000,
+                                 dedupe=False):
+        """write values matching the pattern to json chunk by chunk while scanning, see RedisORM.export_all_to_json
+
+        returns number of exported keys"""
+        with open(file_path, "w") as file:
+            writer = JsonExportWriter(file, lines, dedupe)
+            async for chunk in _abatches(self.iter_items(pattern, count=chunk_size), chunk_size):
+                writer.write(chunk)
+            writer.close()
+        logger.info(f"{writer.exported} keys exported to {file_path}")
+        return writer.exported
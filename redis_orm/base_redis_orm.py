@@ -0,0 +1,161 @@
+import csv
+import json
+import pickle
+import tempfile
+from abc import ABC, abstractmethod
+from itertools import islice
+from .codecs import Serializer
+
+# sets hash fields only if the record exists, ARGV is field, value, field, value...
+UPDATE_HASH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+STORAGE_MODES = ("json", "hash")
+
+
+def _batches(iterable, batch_size):
+    """split iterable into lists of batch_size items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def export_record(key, data) -> dict:
+    """flat record of an exported key, values that are not dicts go to "value" column"""
+    return {"Key": key, **(data if isinstance(data, dict) else {"value": data})}
+
+
+class _ExportWriter(ABC):
+    """writes chunks of (key, data) pairs to an open file.
+
+    SCAN can return a key more than once (when redis resizes its keyspace during the scan), with `dedupe`
+    keys already written are skipped. that keeps every exported key in memory until the export ends,
+    so it is off by default"""
+    def __init__(self, file, dedupe: bool = False) -> None:
+        self.file = file
+        self.exported = 0
+        self._seen_keys = set() if dedupe else None
+
+    def write(self, chunk) -> None:
+        if self._seen_keys is not None:
+            chunk = [(key, data) for key, data in chunk if key not in self._seen_keys]
+            self._seen_keys.update(key for key, _ in chunk)
+        if chunk:
+            self._write(chunk)
+            self.exported += len(chunk)
+
+    @abstractmethod
+    def _write(self, chunk) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class CsvExportWriter(_ExportWriter):
+    """
+    csv with a column for every field any record has. the header can only be written once all records
+    are seen, so chunks go to a temporary file first (pickled, values stay as they are) and are copied
+    into the csv on close, one chunk in memory at a time
+    """
+    def __init__(self, file, dedupe: bool = False) -> None:
+        super().__init__(file, dedupe)
+        self._columns = {}  # ordered set, first seen first
+        self._spool = tempfile.TemporaryFile()
+
+    def _write(self, chunk) -> None:
+        records = [export_record(key, data) for key, data in chunk]
+        self._columns.update(dict.fromkeys(column for record in records for column in record))
+        pickle.dump(records, self._spool, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def close(self) -> None:
+        with self._spool:
+            writer = csv.DictWriter(self.file, fieldnames=list(self._columns))
+            if self._columns:
+                writer.writeheader()
+            self._spool.seek(0)
+            while True:
+                try:
+                    writer.writerows(pickle.load(self._spool))
+                except EOFError:
+                    return
+
+
+class JsonExportWriter(_ExportWriter):
+    """one {key: data} object, or NDJSON with `lines`"""
+    def __init__(self, file, lines: bool = False, dedupe: bool = False) -> None:
+        super().__init__(file, dedupe)
+        self.lines = lines
+        if not lines:
+            file.write("{")
+
+    def _write(self, chunk) -> None:
+        if self.lines:
+            self.file.writelines(json.dumps(export_record(key, data), default=str) + "\n" for key, data in chunk)
+        else:
+            entries = ",\n    ".join(f"{json.dumps(key)}: {json.dumps(data, default=str)}" for key, data in chunk)
+            self.file.write(("," if self.exported else "") + "\n    " + entries)
+
+    def close(self) -> None:
+        if not self.lines:
+            self.file.write("\n}")
+
+
+class BaseRedisORM:
+    """
+    storage format shared by RedisORM and AsyncRedisORM: storage mode, codec and the way records
+    are turned into redis values. nothing here talks to redis, the subclasses only add the I/O,
+    so both read and write exactly the same keys
+    """
+    def __init__(self, storage="json", codec="json", compression=None, compress_threshold=1024) -> None:
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"storage should be one of {STORAGE_MODES}, got {storage}")
+        self.storage = storage
+        self.serializer = Serializer(codec, compression, compress_threshold)
+
+    def _serialize_data(self, data):
+        """turn class object into bytes with the configured codec"""
+        return self.serializer.dumps(data)
+
+    def _deserialize_data(self, serialized_data):
+        """get class object from serialized_dat, whatever codec wrote it"""
+        if serialized_data:
+            return self.serializer.loads(serialized_data)
+        return None
+
+    def _serialize_hash(self, data: dict):
+        """record as hash fields, every value stays json so types survive"""
+        return {field: self._serialize_data(value) for field, value in data.items()}
+
+    def _deserialize_hash(self, serialized_fields: dict):
+        if not serialized_fields:
+            return None
+        return {field.decode('utf-8'): self._deserialize_data(value) for field, value in serialized_fields.items()}
+
+    def _hash_update_arguments(self, new_data: dict) -> list:
+        """field, value, field, value... for UPDATE_HASH_SCRIPT"""
+        return [item for field_value in self._serialize_hash(new_data).items() for item in field_value]
+
+    def _queue_hash_insert(self, pipeline, key, data, ttl=None):
+        """replace the whole hash, old fields that are not in data are removed"""
+        pipeline.delete(key)
+        if data:
+            pipeline.hset(key, mapping=self._serialize_hash(data))
+            if ttl is not None:
+                pipeline.expire(key, ttl)
+
+    def _merged(self, serialized_data, new_data: dict):
+        """stored record with new_data applied, None if there is no record"""
+        current = self._deserialize_data(serialized_data)
+        if current is None:
+            return None
+        current.update(new_data)
+        return self._serialize_data(current)
@@ -0,0 +1,168 @@
+import json
+import pickle
+import zlib
+from abc import ABC, abstractmethod
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# tagged values start with this byte, a json document never does, so untagged values are plain json
+TAG_MARKER = b"\x00"
+
+
+class Codec(ABC):
+    """turns python data into bytes and back, `tag` identifies the codec inside stored values"""
+    tag = None
+    name = None
+
+    @abstractmethod
+    def encode(self, data) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, payload: bytes):
+        pass
+
+
+class JsonCodec(Codec):
+    tag = 1
+    name = "json"
+
+    def encode(self, data) -> bytes:
+        return json.dumps(data).encode("utf-8")
+
+    def decode(self, payload: bytes):
+        return json.loads(payload)
+
+
+class OrjsonCodec(Codec):
+    """json, several times faster than stdlib, needs orjson"""
+    tag = 2
+    name = "orjson"
+
+    def __init__(self) -> None:
+        if orjson is None:
+            raise ImportError("orjson codec needs orjson, install it with `pip install orjson`")
+
+    def encode(self, data) -> bytes:
+        return orjson.dumps(data)
+
+    def decode(self, payload: bytes):
+        return orjson.loads(payload)
+
+
+class MsgpackCodec(Codec):
+    """compact binary format, needs msgpack"""
+    tag = 3
+    name = "msgpack"
+
+    def __init__(self) -> None:
+        if msgpack is None:
+            raise ImportError("msgpack codec needs msgpack, install it with `pip install msgpack`")
+
+    def encode(self, data) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, payload: bytes):
+        return msgpack.unpackb(payload, raw=False)
+
+
+class PickleCodec(Codec):
+    """any python object, protocol 5. only for data written by trusted code, unpickling can run code"""
+    tag = 4
+    name = "pickle"
+
+    def encode(self, data) -> bytes:
+        return pickle.dumps(data, protocol=5)
+
+    def decode(self, payload: bytes):
+        return pickle.loads(payload)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec, PickleCodec)}
+CODECS_BY_TAG = {codec.tag: codec for codec in CODECS.values()}
+
+
+def _zlib():
+    return zlib.compress, zlib.decompress
+
+
+def _lz4():
+    if lz4 is None:
+        raise ImportError("lz4 compression needs lz4, install it with `pip install lz4`")
+    return lz4.frame.compress, lz4.frame.decompress
+
+
+def _zstd():
+    if zstandard is None:
+        raise ImportError("zstd compression needs zstandard, install it with `pip install zstandard`")
+    return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+
+
+# name -> (tag, factory returning compress and decompress functions), tag 0 means not compressed
+COMPRESSIONS = {"zlib": (1, _zlib), "lz4": (2, _lz4), "zstd": (3, _zstd)}
+COMPRESSIONS_BY_TAG = {tag: factory for tag, factory in COMPRESSIONS.values()}
+
+
+class Serializer:
+    """
+    encodes values with the chosen codec, compresses the ones bigger than compress_threshold bytes
+    and prefixes them with marker, codec tag and compression tag.
+
+    uncompressed stdlib json is written as plain json without a tag, so existing values and
+    other clients keep working. loads reads every format, whatever the serializer was configured with.
+    """
+    def __init__(self, codec="json", compression=None, compress_threshold: int = 1024) -> None:
+        self.codec = CODECS[codec]() if isinstance(codec, str) else codec
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        if compression is not None:
+            if compression not in COMPRESSIONS:
+                raise ValueError(f"compression should be one of {', '.join(COMPRESSIONS)}, got {compression}")
+            self.compression_tag, factory = COMPRESSIONS[compression]
+            self._compress, _ = factory()
+        self._codecs = {}  # decoders created on first use, per tag
+        self._decompressors = {}
+
+    def dumps(self, data) -> bytes:
+        payload = self.codec.encode(data)
+        compression_tag = 0
+        if self.compression is not None and len(payload) >= self.compress_threshold:
+            payload = self._compress(payload)
+            compression_tag = self.compression_tag
+        if compression_tag == 0 and isinstance(self.codec, JsonCodec):
+            return payload
+        return TAG_MARKER + bytes((self.codec.tag, compression_tag)) + payload
+
+    def loads(self, value):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        if not value.startswith(TAG_MARKER):
+            return json.loads(value)  # untagged, plain json
+
+        codec_tag, compression_tag = value[1], value[2]
+        payload = value[3:]
+        if compression_tag:
+            decompress = self._decompressors.get(compression_tag)
+            if decompress is None:
+                _, decompress = COMPRESSIONS_BY_TAG[compression_tag]()
+                self._decompressors[compression_tag] = decompress
+            payload = decompress(payload)
+        codec = self._codecs.get(codec_tag)
+        if codec is None:
+            codec = self._codecs[codec_tag] = CODECS_BY_TAG[codec_tag]()
+        return codec.decode(payload)
@@ -1,27 +1,24 @@
 import redis
 import json
-import pandas as pd
-from utils.orm_logger import setup_logging
+from .base_redis_orm import BaseRedisORM, CsvExportWriter, JsonExportWriter, UPDATE_HASH_SCRIPT, _batches
+from utils.instrumentation import instrument_redis
 import logging
 
-
-setup_logging()
 logger = logging.getLogger(__name__)
 
 
-class RedisORM:
-    def __init__(self, host='localhost', port=6379):
-        self.redis_client = redis.Redis(host=host, port=port)
-
-    def _serialize_data(self, data):
-        """turn class object into json"""
-        return json.dumps(data)
+class RedisORM(BaseRedisORM):
+    def __init__(self, host='localhost', port=6379, storage="json", codec="json",
+                 compression=None, compress_threshold=1024):
+        """storage decides how records are kept in redis
+        json -> whole record is one value, partial updates are merged client side under WATCH
+        hash -> record is a redis hash, every field is a separate value, partial updates only send changed fields
 
-    def _deserialize_data(self, serialized_data):
-        """get class object from serialized_dat"""
-        if serialized_data:
-            return json.loads(serialized_data)
-        return None
+        codec (json, orjson, msgpack, pickle) encodes the values, compression (zlib, lz4, zstd) is applied
+        to values of at least compress_threshold bytes. values of any format can be read back"""
+        super().__init__(storage, codec, compression, compress_threshold)
+        self.redis_client = instrument_redis(redis.Redis(host=host, port=port))
+        self._update_hash = self.redis_client.register_script(UPDATE_HASH_SCRIPT)
 
     def insert_into_redis(self, key, data):
         """key could be automatically generated, but then user would not be able to find them,
@@ -29,15 +26,105 @@ class RedisORM:
 
         for instance
         person:1 -> {"name": "john", "age": 32}"""
+        if self.storage == "hash":
+            with self.redis_client.pipeline(transaction=True) as pipeline:
+                self._queue_hash_insert(pipeline, key, data)
+                pipeline.execute()
+            return
         serialized_data = self._serialize_data(data)
         self.redis_client.set(key, serialized_data)
 
     def select_from_redis(self, key):
         """select specifc values based on the key"""
+        if self.storage == "hash":
+            return self._deserialize_hash(self.redis_client.hgetall(key))
         serialized_data = self.redis_client.get(key)
         return self._deserialize_data(serialized_data)
 
-    def select_all(self, pattern='*'):
+    def select_fields(self, key, *fields):
+        """select only some fields of a record, with hash storage only these fields are read (HMGET)
+
+        returns dict field -> value, None for missing fields, or None if the key does not exist"""
+        if self.storage == "hash":
+            if not self.redis_client.exists(key):
+                return None
+            values = self.redis_client.hmget(key, fields)
+            return {field: self._deserialize_data(value) for field, value in zip(fields, values)}
+        data = self.select_from_redis(key)
+        if data is None:
+            return None
+        return {field: data.get(field) for field in fields}
+
+    def insert_many(self, items, batch_size=1000, ttl=None):
+        """insert many values, one MSET (or pipeline of SETs when ttl is given) per batch
+
+        items is a dict key -> data or iterable of (key, data) pairs
+        ttl in seconds is applied to every key of the batch
+
+        returns number of inserted keys"""
+        if isinstance(items, dict):
+            items = items.items()
+
+        inserted = 0
+        for batch in _batches(items, batch_size):
+            if self.storage == "hash":
+                with self.redis_client.pipeline(transaction=False) as pipeline:
+                    for key, data in batch:
+                        self._queue_hash_insert(pipeline, key, data, ttl)
+                    pipeline.execute()
+                inserted += len(batch)
+                continue
+
+            mapping = {key: self._serialize_data(data) for key, data in batch}
+            if ttl is None:
+                self.redis_client.mset(mapping)
+            else:
+                with self.redis_client.pipeline(transaction=False) as pipeline:
+                    for key, serialized_data in mapping.items():
+                        pipeline.set(key, serialized_data, ex=ttl)
+                    pipeline.execute()
+            inserted += len(mapping)
+        return inserted
+
+    def select_many(self, keys, batch_size=1000):
+        """select values of many keys with one MGET per batch
+
+        returns dict key -> data, None for keys that do not exist"""
+        data = {}
+        for batch in _batches(keys, batch_size):
+            if self.storage == "hash":
+                with self.redis_client.pipeline(transaction=False) as pipeline:
+                    for key in batch:
+                        pipeline.hgetall(key)
+                    values = [self._deserialize_hash(fields) for fields in pipeline.execute()]
+            else:
+                values = [self._deserialize_data(value) for value in self.redis_client.mget(batch)]
+            for key, value in zip(batch, values):
+                data[key.decode('utf-8') if isinstance(key, bytes) else key] = value
+        return data
+
+    def delete_many(self, keys, batch_size=1000):
+        """delete many keys, one UNLINK per batch, memory is freed in the background by redis
+
+        returns number of deleted keys"""
+        deleted = 0
+        for batch in _batches(keys, batch_size):
+            deleted += self.redis_client.unlink(*batch)
+        return deleted
+
+    def iter_items(self, pattern='*', count=1000):
+        """generator of (key, data) pairs for keys matching the pattern
+
+        keys are walked with SCAN, which unlike KEYS does not block redis, and values
+        of every `count` keys are fetched with one MGET. SCAN can return a key twice
+        if the keyspace is resized while iterating, keys deleted meanwhile are skipped"""
+        keys = self.redis_client.scan_iter(match=pattern, count=count)
+        for batch in _batches(keys, count):
+            for key, data in self.select_many(batch, batch_size=count).items():
+                if data is not None:
+                    yield key, data
+
+    def select_all(self, pattern='*', batch_size=1000):
         """select all
         TO KEEP IN MIND !!!!!!!
         since redis can have other data as well
@@ -46,39 +133,68 @@ class RedisORM:
         pattern=person*
         """
         try:
-            keys = self.redis_client.keys(pattern)
-            data = {}
-            for key in keys:
-                decoded_key = key.decode('utf-8')
-                data[decoded_key] = self.select_from_redis(decoded_key)
-            return data
+            return dict(self.iter_items(pattern, count=batch_size))
         except json.decoder.JSONDecodeError: # happens when trying to select all the keys but their patter does not match
             logger.error("patterns does not match, please specify")
 
     def update_data(self, key, new_data):
-        current = self.select_from_redis(key)
-        if current:
-            current.update(new_data)
-            self.insert_into_redis(key, current)
+        """change some fields of a stored record atomically, other fields are left as they are
+
+        hash storage sets only the changed fields with a lua script. json storage merges the record here
+        under WATCH and retries if someone else changed it, the stored value is never decoded by lua,
+        whose cjson would round big numbers to 14 digits and turn empty lists into empty objects"""
+        if not new_data:
+            return
+        if self.storage == "hash":
+            updated = self._update_hash(keys=[key], args=self._hash_update_arguments(new_data))
         else:
+            updated = self.redis_client.transaction(lambda pipeline: self._merge_watched(pipeline, key, new_data),
+                                                    key, value_from_callable=True)
+        if not updated:
             logger.info(f"No data found for key {key}")
 
+    def _merge_watched(self, pipeline, key, new_data):
+        """runs inside redis transaction with key watched, returns False if there is nothing to update"""
+        merged = self._merged(pipeline.get(key), new_data)
+        if merged is None:
+            return False
+        pipeline.multi()
+        pipeline.set(key, merged, keepttl=True)
+        return True
+
     def delete(self, key):
-        current = self.select_from_redis(key)
-        if current:
-            self.redis_client.delete(key)
-        else:
+        if not self.redis_client.delete(key):
             logger.info(f"No data found for key {key}")
 
-    def export_all_to_csv(self, pattern='*', file_path="redis_data.csv"):
-        data = self.select_all(pattern)
-        df = pd.DataFrame.from_dict(data, orient='index')
-        df.to_csv(file_path, index_label='Key')
-        print("Data inserted into CSV successfully.")
+    def export_all_to_csv(self, pattern='*', file_path="redis_data.csv", chunk_size=1000, dedupe=False):
+        """write values matching the pattern to csv, chunk by chunk while scanning
+
+        there is a column for every field of any record, records are kept in a temporary file until
+        the header is known. values that are not dicts go to "value" column.
+        SCAN can return a key more than once, with `dedupe` it is written once, but every exported key
+        is then kept in memory
+
+        returns number of exported keys"""
+        with open(file_path, "w", newline="") as file:
+            writer = CsvExportWriter(file, dedupe)
+            for chunk in _batches(self.iter_items(pattern, count=chunk_size), chunk_size):
+                writer.write(chunk)
+            writer.close()
+        logger.info(f"{writer.exported} keys exported to {file_path}")
+        return writer.exported
+
+    def export_all_to_json(self, pattern='*', file_path="redis_data.json", lines=False, chunk_size=1000,
+                            dedupe=False):
+        """write values matching the pattern to json, chunk by chunk while scanning
 
-    def export_all_to_json(self, pattern='*', file_path="redis_data.json"):
-        data = self.select_all(pattern)
-        df = pd.DataFrame.from_dict(data, orient='index')
-        df.to_json(file_path, orient='index', indent=4)
-        print(f"Data exported to {file_path} successfully.")
+        by default the file is one object {key: data}, with `lines` it is NDJSON,
+        one {"Key": key, ...data} object per line. `dedupe` as in export_all_to_csv
 
+        returns number of exported keys"""
+        with open(file_path, "w") as file:
+            writer = JsonExportWriter(file, lines, dedupe)
+            for chunk in _batches(self.iter_items(pattern, count=chunk_size), chunk_size):
+                writer.write(chunk)
+            writer.close()
+        logger.info(f"{writer.exported} keys exported to {file_path}")
+        return writer.exported
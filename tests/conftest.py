@@ -0,0 +1,13 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def postgres_settings():
+    """settings of a throwaway database from DATTYORM_TEST_POSTGRES (a dsn), tests using it are skipped without it"""
+    dsn = os.environ.get("DATTYORM_TEST_POSTGRES")
+    if not dsn:
+        pytest.skip("set DATTYORM_TEST_POSTGRES to a dsn to run postgres tests")
+    psycopg2 = pytest.importorskip("psycopg2")
+    return psycopg2.extensions.parse_dsn(dsn)
@@ -0,0 +1,80 @@
+from unittest import mock
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from postgres_orm import BaseModel, CachedManager, Session, columns
+from redis_orm import RedisORM
+
+
+class CachedEmployee(BaseModel):
+    id = columns.PrimaryKey()
+    name = columns.Text()
+    salary = columns.Integer()
+
+
+@pytest.fixture
+def redis_orm():
+    with mock.patch("redis_orm.redis_orm.redis.Redis", fakeredis.FakeRedis):
+        redis_orm = RedisORM()
+    redis_orm.redis_client.flushall()
+    return redis_orm
+
+
+def _manager(postgres_settings, redis_orm, pooled=True):
+    manager = CachedManager(CachedEmployee(), redis_orm, write_policy="write_through")
+    manager.set_connection(postgres_settings, pooled=pooled)
+    return manager
+
+
+@pytest.fixture
+def manager(postgres_settings, redis_orm):
+    manager = _manager(postgres_settings, redis_orm)
+    with manager.borrow_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS cachedemployee")
+    manager.create_table(CachedEmployee())
+    manager.batch_insert([{"name": "ann", "salary": 10}, {"name": "bob", "salary": 20}])
+    yield manager
+    with manager.borrow_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS cachedemployee")
+
+
+def test_rolled_back_update_is_not_written_through(manager):
+    assert manager.get(1)["salary"] == 10
+    with pytest.raises(RuntimeError):
+        with manager.transaction():
+            manager.update({"salary": 11}, "id", 1)
+            assert manager.get(1)["salary"] == 11  # the transaction sees its own change
+            raise RuntimeError("roll back")
+    assert manager.get(1)["salary"] == 10
+    assert manager.get_many([1, 2]) == {1: {"id": 1, "name": "ann", "salary": 10},
+                                        2: {"id": 2, "name": "bob", "salary": 20}}
+
+
+def test_committed_update_is_written_through(manager):
+    with manager.transaction():
+        manager.update({"salary": 11}, "id", 1)
+    assert manager.cache_stats()["misses"] == 0
+    assert manager.get(1)["salary"] == 11
+    assert manager.cache_stats()["misses"] == 0
+
+
+def test_session_flush_invalidates_rows_cached_during_the_transaction(manager, postgres_settings, redis_orm):
+    # a reader on another connection caches the old row while the flush has not committed yet
+    reader = _manager(postgres_settings, redis_orm, pooled=False)
+    with Session() as session:
+        session.update(manager, {"salary": 11}, "id", 1)
+        session.delete(manager, "id", 2)
+        original_flush_updates = session._flush_updates
+
+        def flush_updates_and_read(table_name):
+            updated = original_flush_updates(table_name)
+            assert reader.get(1)["salary"] == 10
+            assert reader.get(2)["salary"] == 20
+            return updated
+
+        session._flush_updates = flush_updates_and_read
+    reader.local_cache.clear()
+    assert reader.get(1)["salary"] == 11
+    assert reader.get(2) is None
@@ -0,0 +1,114 @@
+import io
+import json
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from data_operators import CSVDataOperator, JsonDataOperator
+from data_operators.indexes import SortedIndex
+
+
+@pytest.fixture
+def operator(tmp_path):
+    path = tmp_path / "people.csv"
+    pd.DataFrame({"id": range(1, 7), "age": [30, 25, 41, 25, None, 18]}).to_csv(path, index=False)
+    operator = CSVDataOperator(str(path))
+    operator.get_data()
+    return operator
+
+
+def _ids(df):
+    return sorted(df["id"].tolist())
+
+
+@pytest.mark.parametrize("kind", ["hash", "sorted"])
+def test_index_lookups_match_scans_after_changes(operator, kind):
+    operator.create_index("age", kind=kind)
+    assert _ids(operator.find("age", 25)) == [2, 4]  # builds the index
+
+    operator.insert_many([{"id": 7, "age": 25}, {"id": 8, "age": 50}, {"id": 9, "age": None}])
+    operator.update_data("id", 1, {"age": 26})
+    operator.delete_data("id", 4)
+
+    lookups = [{"age": 25}, {"age__in": [26, 50]}]
+    if kind == "sorted":
+        lookups += [{"age__gte": 26}, {"age__lt": 25}, {"age__range": (18, 26)}]
+    for lookup in lookups:
+        operator.drop_index("age")
+        scanned = _ids(operator.query(**lookup))
+        operator.create_index("age", kind=kind)
+        assert _ids(operator.query(**lookup)) == scanned, lookup
+    assert _ids(operator.query(age__in=[26, 50])) == [1, 8]
+
+
+def test_sorted_index_merges_changes_without_sorting_again():
+    df = pd.DataFrame({"age": [30, 25, 41]})
+    index = SortedIndex("age")
+    index.lookup(df, "eq", 30)
+    index.add(pd.Index([3, 4, 5]), [27, None, 25])
+    index.remove(pd.Index([0]), [30])
+    assert index._values.tolist() == [25, 25, 27, 41]
+    assert sorted(index._labels[:2].tolist()) == [1, 5]
+    assert sorted(index.lookup(df, "range", (25, 27)).tolist()) == [1, 3, 5]
+
+
+def test_pending_rows_are_flushed_through_df(operator):
+    operator.create_index("age", kind="sorted")
+    operator.find("age", 25)
+    operator.insert_data({"id": 7, "age": 25})
+    operator.insert_data({"id": 8, "age": 99})
+    assert len(operator._pending_rows) == 2
+    assert _ids(operator.find("age", 25)) == [2, 4, 7]  # the lookup goes through df, which flushes the rows
+    assert operator._pending_rows == []
+    assert operator.df.index.tolist() == list(range(8))
+    assert _ids(operator.query(age__gt=50)) == [8]
+
+
+@pytest.mark.parametrize("existing", [False, True], ids=["missing file", "empty file"])
+def test_append_rows_writes_header_of_new_file(tmp_path, existing):
+    path = tmp_path / "new.csv"
+    if existing:
+        path.touch()
+    operator = CSVDataOperator(str(path))
+    assert operator.append_rows([{"id": 1, "name": "ann"}]) == 1
+    assert operator.append_rows([{"name": "bob", "id": 2}]) == 1
+    assert pd.read_csv(path).to_dict("records") == [{"id": 1, "name": "ann"}, {"id": 2, "name": "bob"}]
+
+
+def test_stream_update_adds_column_missing_from_first_chunk(tmp_path):
+    path = tmp_path / "people.csv"
+    pd.DataFrame({"id": range(1, 6)}).to_csv(path, index=False)
+    operator = CSVDataOperator(str(path))
+    assert operator.stream_update({"id": [4, 5]}, {"team": "red"}, chunksize=2) == 2
+    df = pd.read_csv(path)
+    assert df.columns.tolist() == ["id", "team"]
+    assert df["team"].tolist()[3:] == ["red", "red"]
+    assert df["team"].isna().tolist()[:3] == [True, True, True]
+
+
+def _array_records(text, block_size):
+    return list(JsonDataOperator._iter_array(io.StringIO(text), block_size))
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 7, 1 << 20])
+@pytest.mark.parametrize("text", [
+    "[]", " [ ] ", "[1]", "[12345, -6.5e3, true, null]", '[{"a": [1, 2], "b": "x, ]"}, "[,]"]',
+    '\n[\n  {"a": 1} ,\n\t{"a": 2}\n]\n', "1234", '{"a": 1}',
+])
+def test_json_array_records_match_json_loads(text, block_size):
+    expected = json.loads(text)
+    assert _array_records(text, block_size) == (expected if isinstance(expected, list) else [expected])
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 1 << 20])
+@pytest.mark.parametrize("text", ["[1,,2]", "[1,2,]", "[,1]", "[,]", "[1 2]", "[1", "[1,", '["a', "[1] 2", "[1]]"])
+def test_json_array_rejects_malformed_input(text, block_size):
+    with pytest.raises(json.JSONDecodeError):
+        _array_records(text, block_size)
+
+
+def test_update_without_matching_rows_leaves_columns_alone(operator):
+    assert operator.update_where({"id": 99}, {"team": "red"}) == 0
+    assert operator.update_many([{"id": 99, "team": "red"}], key_column="id") == 0
+    assert operator.df.columns.tolist() == ["id", "age"]
@@ -0,0 +1,10 @@
+import pytest
+
+from benchmarks.import_time import BUDGETS, measure
+
+
+@pytest.mark.parametrize("package", list(BUDGETS))
+def test_import_stays_light(package):
+    result = measure(package, repeat=3)
+    assert result["heavy"] == [], f"{package} imports {result['heavy']} at import time"
+    assert result["ms"] <= BUDGETS[package]
@@ -0,0 +1,92 @@
+from unittest import mock
+
+import pytest
+
+from postgres_orm import BaseManager, BaseModel, columns
+
+
+class StreamEmployee(BaseModel):
+    id = columns.PrimaryKey()
+    name = columns.Text()
+    salary = columns.Integer()
+
+
+@pytest.fixture(params=[False, True], ids=["own connection", "pooled"])
+def manager(request, postgres_settings):
+    manager = BaseManager(StreamEmployee())
+    manager.set_connection(postgres_settings, pooled=request.param)
+    with manager.borrow_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS streamemployee")
+    manager.create_table(StreamEmployee())
+    manager.batch_insert([{"name": f"employee {number}", "salary": number} for number in range(1, 6)])
+    yield manager
+    with manager.borrow_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS streamemployee")
+
+
+def _salaries(manager):
+    return sorted(salary for _, salary in manager.select("id", "salary", batch_size=100))
+
+
+def test_writes_while_streaming_are_committed(manager):
+    for employee_id, salary in manager.iter_select("id", "salary", itersize=2):
+        manager.update({"salary": salary * 10}, "id", employee_id)
+    assert _salaries(manager) == [10, 20, 30, 40, 50]
+
+
+def test_stream_inside_transaction_keeps_its_writes(manager):
+    with manager.transaction():
+        manager.delete("salary", 1)
+        rows = list(manager.iter_select("salary"))
+        assert sorted(salary for salary, in rows) == [2, 3, 4, 5]
+    assert _salaries(manager) == [2, 3, 4, 5]
+
+
+def test_query_iterator_inside_transaction_keeps_its_writes(manager):
+    with manager.transaction():
+        manager.update({"salary": 0}, "salary", 5)
+        assert [row[2] for row in manager.filter(salary=0).iterator()] == [0]
+    assert _salaries(manager) == [0, 1, 2, 3, 4]
+
+
+def test_select_all_is_not_prepared():
+    manager = BaseManager(StreamEmployee())
+    manager.enable_statement_cache()
+    manager.connection = mock.MagicMock()
+    with mock.patch.object(manager, "_execute") as execute:
+        manager.select()
+        manager.select("name")
+    assert [call.kwargs["cacheable"] for call in execute.call_args_list] == [False, True]
+
+
+def test_select_all_sees_new_columns(manager):
+    manager.enable_statement_cache()
+    assert len(manager.select()[0]) == 3
+    assert len(manager.select()[0]) == 3
+    with manager.borrow_connection() as connection, connection.cursor() as cursor:
+        cursor.execute("ALTER TABLE streamemployee ADD COLUMN nickname TEXT")
+    assert len(manager.select()[0]) == 4
+
+
+def test_query_update_needs_columns():
+    manager = BaseManager(StreamEmployee())
+    manager.connection = mock.MagicMock()
+    with pytest.raises(ValueError):
+        manager.filter(salary=1).update({})
+    manager.connection.cursor.assert_not_called()
+
+
+def test_concurrent_parallel_exports_keep_their_snapshots(manager, tmp_path):
+    parallel = manager.parallel(workers=2)
+    run_shards = parallel._run_shards
+
+    def another_export_then_insert(shards, job):
+        # a second export starts and ends while the first one is between snapshot and shards
+        parallel._run_shards = run_shards
+        assert parallel.export_data_as_csv(str(tmp_path / "other.csv"))["rows"] == 5
+        manager.batch_insert([{"name": "late", "salary": 6}])
+        return run_shards(shards, job)
+
+    parallel._run_shards = another_export_then_insert
+    assert parallel.export_data_as_csv(str(tmp_path / "first.csv"))["rows"] == 5
+    assert len(manager.select(batch_size=100)) == 6
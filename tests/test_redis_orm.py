@@ -0,0 +1,66 @@
+import io
+import json
+from unittest import mock
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from redis_orm import RedisORM
+from redis_orm.base_redis_orm import JsonExportWriter
+
+
+@pytest.fixture
+def redis_orm():
+    with mock.patch("redis_orm.redis_orm.redis.Redis", fakeredis.FakeRedis):
+        redis_orm = RedisORM()
+    redis_orm.redis_client.flushall()
+    yield redis_orm
+
+
+def test_update_keeps_untouched_numbers_exact(redis_orm):
+    redis_orm.insert_into_redis("user:1", {"id": 12345678901234567, "ratio": 0.12345678901234567, "age": 23})
+    redis_orm.update_data("user:1", {"age": 24})
+    assert redis_orm.select_from_redis("user:1") == {"id": 12345678901234567, "ratio": 0.12345678901234567,
+                                                     "age": 24}
+
+
+def test_update_keeps_empty_lists(redis_orm):
+    redis_orm.insert_into_redis("user:1", {"tags": [], "age": 23})
+    redis_orm.update_data("user:1", {"age": 24, "roles": []})
+    assert redis_orm.select_from_redis("user:1") == {"tags": [], "roles": [], "age": 24}
+
+
+@pytest.mark.parametrize("codec, compression", [("json", "zlib"), ("pickle", None)])
+def test_update_tagged_values(codec, compression):
+    with mock.patch("redis_orm.redis_orm.redis.Redis", fakeredis.FakeRedis):
+        redis_orm = RedisORM(codec=codec, compression=compression, compress_threshold=1)
+    redis_orm.redis_client.flushall()
+    redis_orm.insert_into_redis("user:1", {"id": 12345678901234567, "age": 23})
+    redis_orm.update_data("user:1", {"age": 24})
+    assert redis_orm.select_from_redis("user:1") == {"id": 12345678901234567, "age": 24}
+
+
+def test_update_missing_key_does_nothing(redis_orm):
+    redis_orm.update_data("user:404", {"age": 24})
+    assert redis_orm.select_from_redis("user:404") is None
+
+
+def test_plain_json_orm_updates_value_written_compressed(redis_orm):
+    with mock.patch("redis_orm.redis_orm.redis.Redis", fakeredis.FakeRedis):
+        writer = RedisORM(codec="json", compression="zlib", compress_threshold=1)
+    writer.insert_into_redis("user:1", {"name": "john", "age": 23})
+    redis_orm.update_data("user:1", {"age": 24})
+    assert redis_orm.select_from_redis("user:1") == {"name": "john", "age": 24}
+
+
+@pytest.mark.parametrize("dedupe, exported", [(False, 3), (True, 2)])
+def test_export_dedupe_is_opt_in(dedupe, exported):
+    file = io.StringIO()
+    writer = JsonExportWriter(file, lines=True, dedupe=dedupe)
+    writer.write([("user:1", {"age": 23}), ("user:2", {"age": 24})])
+    writer.write([("user:1", {"age": 23})])  # SCAN returned the key again
+    writer.close()
+    assert writer.exported == exported
+    assert [json.loads(line)["Key"] for line in file.getvalue().splitlines()] == \
+        ["user:1", "user:2", "user:1"][:exported]
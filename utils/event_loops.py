@@ -0,0 +1,42 @@
+import asyncio
+import logging
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# event loop -> {namespace: state}, a loop that is garbage collected takes its state with it
+_states = weakref.WeakKeyDictionary()
+
+
+def loop_state(namespace: str, close=None) -> dict:
+    """
+    dict for things that belong to the running event loop, like connection pools, which can't be used
+    from another loop. created on first use with a "lock", an asyncio.Lock of this loop.
+
+    args:
+    - `namespace`: name of the user, every module gets its own dict
+    - `close`: coroutine function called with the state when the loop shuts down its async generators,
+    asyncio.run does it right before closing the loop
+    """
+    loop = asyncio.get_running_loop()
+    states = _states.setdefault(loop, {})
+    state = states.get(namespace)
+    if state is None:
+        state = states[namespace] = {"lock": asyncio.Lock()}
+        if close is not None:
+            # an async generator suspended at its yield is closed by loop.shutdown_asyncgens(),
+            # its finally block then runs inside the loop. loops only keep weak references to both
+            state["closer"] = _close_with_loop(states, namespace, state, close)
+            state["closer_started"] = asyncio.ensure_future(state["closer"].__anext__())
+    return state
+
+
+async def _close_with_loop(states: dict, namespace: str, state: dict, close):
+    try:
+        yield
+    finally:
+        states.pop(namespace, None)
+        try:
+            await close(state)
+        except Exception as e:
+            logger.error(f"could not close {namespace} resources of the event loop: {e}")
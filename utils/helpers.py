@@ -1,6 +1,5 @@
 import os
 from datetime import datetime
-from data_operators.base_file_info_validation import BaseFileInfo
 
 def parse_file_path(file_path: str) -> tuple[str, str, str]:
     """given the absolute or relative path of a file, returns its
@@ -19,6 +18,8 @@ def parse_file_path(file_path: str) -> tuple[str, str, str]:
 
 def validate_file_path(file_path: str) -> str:
     """given the full path of a file, returns validated path"""
+    from data_operators.base_file_info_validation import BaseFileInfo  # pydantic is imported only when validating
+
     directory_path, file_name, file_extension = parse_file_path(file_path)
     file = BaseFileInfo(file_name=file_name, file_extension=file_extension)
 
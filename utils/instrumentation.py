@@ -0,0 +1,260 @@
+"""
+timing of every database and redis operation, in one place for all managers.
+
+nothing is measured until instrumentation.enable() is called. after that every postgres statement
+(sync and async managers) and every redis command becomes an OperationEvent, which
+
+- updates counters and latency histograms, read them with instrumentation.metrics()
+- is logged to the "dattyorm.slow_query" logger when it took longer than the slow query threshold,
+  slow postgres SELECTs can get their plan from EXPLAIN (ANALYZE, BUFFERS) attached
+- is passed to every hook added with instrumentation.add_hook(callback)
+
+from utils.instrumentation import instrumentation
+instrumentation.enable(slow_query_threshold=0.5, explain_slow_queries=True)
+instrumentation.add_hook(lambda event: print(event.statement, event.duration))
+"""
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("dattyorm.slow_query")
+
+# upper bounds of the latency histogram buckets in seconds, the last bucket is everything above
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class OperationEvent:
+    """one finished operation
+
+    - `source`: "postgres" or "redis"
+    - `operation`: execute, executemany, copy, fetch... for postgres, the command name (GET, HSET) for redis
+    - `statement`: sql text or the redis command with its key
+    - `parameter_count`: number of query parameters, or of parameter sets for executemany
+    - `rows_affected`: rows returned or changed as reported by the driver, -1 if unknown
+    - `duration`: seconds the operation took
+    - `connection_wait`: seconds spent waiting for a pooled connection before it
+    - `error`: exception if the operation failed
+    - `plan`: EXPLAIN (ANALYZE, BUFFERS) output of a slow select, when enabled"""
+    __slots__ = ("source", "operation", "statement", "parameter_count", "rows_affected", "duration",
+                 "connection_wait", "error", "plan")
+
+    def __init__(self, source, operation, statement, parameter_count=0, rows_affected=-1, duration=0.0,
+                 connection_wait=0.0, error=None, plan=None):
+        self.source = source
+        self.operation = operation
+        self.statement = statement
+        self.parameter_count = parameter_count
+        self.rows_affected = rows_affected
+        self.duration = duration
+        self.connection_wait = connection_wait
+        self.error = error
+        self.plan = plan
+
+    def __repr__(self):
+        return (f"OperationEvent({self.source} {self.operation} {self.duration * 1000:.2f}ms "
+                f"rows={self.rows_affected} {self.statement[:80]!r})")
+
+
+class Histogram:
+    """count of observations per bucket plus their sum, like a prometheus histogram"""
+    def __init__(self, buckets=DURATION_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, quantile: float) -> float:
+        """upper bound of the bucket the quantile falls in, an estimate"""
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "sum": self.total, "buckets": dict(zip([*self.buckets, "inf"], self.counts)),
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+class Instrumentation:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.slow_query_threshold = None
+        self.explain_slow_queries = False
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def enable(self, slow_query_threshold: float = None, explain_slow_queries: bool = False) -> None:
+        """
+        start measuring.
+
+        args:
+        - `slow_query_threshold`: seconds, slower operations are logged to "dattyorm.slow_query", None turns it off
+        - `explain_slow_queries`: run EXPLAIN (ANALYZE, BUFFERS) for slow postgres SELECTs and log the plan.
+           the select runs a second time to get the plan, only selects are explained since ANALYZE executes the query
+        """
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def add_hook(self, callback) -> None:
+        """callback(event) is called after every operation, in the thread that ran it, so keep it fast"""
+        self._hooks.append(callback)
+
+    def remove_hook(self, callback) -> None:
+        self._hooks.remove(callback)
+
+    def reset(self) -> None:
+        """forget collected metrics"""
+        with self._lock:
+            self._counters = {}  # (name, source, operation) -> value
+            self._histograms = {}  # (name, source, operation) -> Histogram
+
+    def metrics(self) -> dict:
+        """counters and histograms per source and operation, e.g.
+        {"operations_total": {"postgres.execute": 10}, "duration_seconds": {"postgres.execute": {...}}}"""
+        with self._lock:
+            snapshot = {}
+            for (name, source, operation), value in self._counters.items():
+                snapshot.setdefault(name, {})[f"{source}.{operation}"] = value
+            for (name, source, operation), histogram in self._histograms.items():
+                snapshot.setdefault(name, {})[f"{source}.{operation}"] = histogram.snapshot()
+        return snapshot
+
+    def is_slow(self, duration: float) -> bool:
+        return self.slow_query_threshold is not None and duration >= self.slow_query_threshold
+
+    def connection_waited(self, seconds: float) -> None:
+        """called by the pool after a checkout, reported with the next operation of this thread"""
+        self._local.connection_wait = seconds
+
+    def _take_connection_wait(self) -> float:
+        wait = getattr(self._local, "connection_wait", 0.0)
+        self._local.connection_wait = 0.0
+        return wait
+
+    def emit(self, event: OperationEvent) -> None:
+        if event.source == "postgres" and not event.connection_wait:
+            event.connection_wait = self._take_connection_wait()
+        key = (event.source, event.operation)
+        with self._lock:
+            self._increment("operations_total", key, 1)
+            if event.error is not None:
+                self._increment("errors_total", key, 1)
+            if event.rows_affected > 0:
+                self._increment("rows_total", key, event.rows_affected)
+            self._observe("duration_seconds", key, event.duration)
+            if event.connection_wait:
+                self._observe("connection_wait_seconds", key, event.connection_wait)
+
+        if self.is_slow(event.duration):
+            plan = f"\n{event.plan}" if event.plan else ""
+            slow_query_logger.warning(f"slow {event.source} {event.operation} {event.duration * 1000:.1f}ms "
+                                      f"(waited {event.connection_wait * 1000:.1f}ms for connection, "
+                                      f"{event.rows_affected} rows): {event.statement}{plan}")
+        for hook in self._hooks:
+            try:
+                hook(event)
+            except Exception as e:  # a broken hook should not break queries
+                logger.error(f"instrumentation hook {hook} failed: {e}")
+
+    def _increment(self, name, key, amount) -> None:
+        self._counters[(name, *key)] = self._counters.get((name, *key), 0) + amount
+
+    def _observe(self, name, key, value) -> None:
+        histogram = self._histograms.get((name, *key))
+        if histogram is None:
+            histogram = self._histograms[(name, *key)] = Histogram()
+        histogram.observe(value)
+
+
+instrumentation = Instrumentation()
+
+
+def _redis_command(args):
+    """operation name, statement (command and its first argument, usually the key, values left out)
+    and number of arguments of a redis command"""
+    parts = [part.decode("utf-8", "replace") if isinstance(part, bytes) else str(part) for part in args[:2]]
+    return parts[0].upper(), " ".join(parts), max(len(args) - 1, 0)
+
+
+def _pipeline_command(pipeline):
+    commands = len(pipeline.command_stack)
+    return "PIPELINE", f"PIPELINE of {commands} commands", commands
+
+
+def _timed(method, describe):
+    """wrap a bound method of a redis client or pipeline, sync or async,
+    describe(args) gives operation, statement and parameter count of the call, it runs before the call
+    since a pipeline empties its command stack while executing"""
+    def emit(description, started, error):
+        operation, statement, parameter_count = description
+        instrumentation.emit(OperationEvent("redis", operation, statement, parameter_count,
+                                            duration=time.perf_counter() - started, error=error))
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def timed(*args, **options):
+            if not instrumentation.enabled:
+                return await method(*args, **options)
+            description = describe(args)
+            started = time.perf_counter()
+            error = None
+            try:
+                return await method(*args, **options)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                emit(description, started, error)
+        return timed
+
+    @functools.wraps(method)
+    def timed(*args, **options):
+        if not instrumentation.enabled:
+            return method(*args, **options)
+        description = describe(args)
+        started = time.perf_counter()
+        error = None
+        try:
+            return method(*args, **options)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            emit(description, started, error)
+    return timed
+
+
+def instrument_redis(client):
+    """time every command of a redis.Redis or redis.asyncio.Redis client, a pipeline counts as one operation"""
+    client.execute_command = _timed(client.execute_command, _redis_command)
+    create_pipeline = client.pipeline
+
+    @functools.wraps(create_pipeline)
+    def pipeline(*args, **kwargs):
+        new_pipeline = create_pipeline(*args, **kwargs)
+        describe = lambda _: _pipeline_command(new_pipeline)
+        new_pipeline.execute = _timed(new_pipeline.execute, describe)
+        return new_pipeline
+
+    client.pipeline = pipeline
+    return client
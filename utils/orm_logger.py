@@ -1,15 +1,58 @@
+import atexit
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 CURRENT_WORKING_DIRECTORY = os.getcwd()
 LOG_FILE_PATH = os.path.join(CURRENT_WORKING_DIRECTORY, "orm_log.txt")
 
-def setup_logging():
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(LOG_FILE_PATH),
-            logging.StreamHandler()
-        ]
-    )
\ No newline at end of file
+_listener = None
+
+
+def setup_logging(level=logging.INFO, log_file=LOG_FILE_PATH, stream=True):
+    """
+    log to a file (and stderr) without slowing down the code that logs.
+    records are put on a queue and written by a background thread, so a query never waits for disk.
+    call it once at application start, the orm itself does not configure logging,
+    calling it again does nothing until shutdown_logging()
+
+    args:
+    - `level`: level of the root logger
+    - `log_file`: path of the log file, None to not write a file
+    - `stream`: also print records to stderr
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handlers = []
+    if log_file is not None:
+        handlers.append(logging.FileHandler(log_file))
+    if stream:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(log_queue))
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """write out records still in the queue and stop the background thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    for handler in [handler for handler in root.handlers if isinstance(handler, QueueHandler)]:
+        root.removeHandler(handler)
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None